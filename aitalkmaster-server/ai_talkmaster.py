@@ -19,16 +19,24 @@ import code.aitalkmaster_views
 import code.conversation_views
 import code.generate_views
 import code.translation_views
+import code.metrics_views
+import code.admin_views
 import code.other_views
 
 # Start unified background message worker threads
 from code.message_queue import start_background_message_workers, start_background_audio_generation_workers
 # These workers handle all types of requests: ait, conversation, and generate
+# The workers only dispatch requests, the LLM and TTS calls run on the async engine (limits under server.concurrency)
 # Number of workers is configured in config.yml under server.num_workers (default: 4)
 start_background_message_workers(num_workers=config.server.num_workers)
 # Audio generation workers use a separate queue and are configured under server.num_audio_workers (default: 4)
 start_background_audio_generation_workers(num_workers=config.server.num_audio_workers)
 
+# Archive jobs move the files of reset join_keys to the inactive folder, unfinished jobs of the last run are resumed
+from code.archive_jobs import archive_jobs
+archive_jobs.resume()
+archive_jobs.start()
+
 # Start background monitoring thread
 
 if config.icecast_client is not None:
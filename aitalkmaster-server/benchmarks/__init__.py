@@ -0,0 +1,9 @@
+"""
+Offline benchmarks of the AI Talkmaster server.
+
+The chat, TTS, Liquidsoap and Icecast backends are replaced by local stand-ins with
+configurable latency and failure rates (fake_backends), the server runs unchanged in a
+subprocess with a generated config.yml (server_process), and the scenario drivers
+(scenarios) send requests like the LSL scripts do and report throughput and latency
+percentiles. lsl_load simulates whole fleets of polling in-world objects. Start with `python -m benchmarks.run --help` from the aitalkmaster-server directory.
+"""
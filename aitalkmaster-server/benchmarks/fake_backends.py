@@ -0,0 +1,394 @@
+"""
+Local stand-ins for the backends of the server.
+
+Each fake is a threaded http.server running in the benchmark process. It answers the
+endpoints the server uses with the shapes of the real APIs, after a configurable latency,
+and fails a configurable share of the requests with a 500. Paths are matched with and
+without the /v1 prefix, so base_url can be configured either way.
+"""
+import json
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+# MPEG-2 layer III, 32 kbit/s, 22050 Hz, mono: 104 byte frames of 576 samples.
+# This matches the output profile written by server_process, so the server stores the clips as they are.
+MP3_FRAME_HEADER = bytes([0xFF, 0xF3, 0x40, 0xC4])
+MP3_FRAME_BYTES = 104
+MP3_FRAME_SECONDS = 576 / 22050
+
+def synthetic_mp3(seconds: float) -> bytes:
+    """Silent MP3 of the given duration"""
+    frame = MP3_FRAME_HEADER + bytes(MP3_FRAME_BYTES - len(MP3_FRAME_HEADER))
+    return frame * max(1, int(seconds / MP3_FRAME_SECONDS))
+
+def synthetic_pcm(seconds: float, sample_rate: int = 24000) -> bytes:
+    """Silent 16 bit mono pcm of the given duration"""
+    return bytes(2 * int(seconds * sample_rate))
+
+@dataclass
+class FakeBehaviour:
+    """Latency and failure rate of a fake backend"""
+    latency_seconds: float = 0.0
+    jitter_seconds: float = 0.0
+    failure_rate: float = 0.0
+
+    def delay(self) -> float:
+        return max(0.0, self.latency_seconds + random.uniform(-self.jitter_seconds, self.jitter_seconds))
+
+    def fails(self) -> bool:
+        return random.random() < self.failure_rate
+
+class FakeRequest:
+    """The parts of an HTTP request a route handler needs"""
+
+    def __init__(self, handler: BaseHTTPRequestHandler, path: str, body: bytes):
+        self.handler = handler
+        self.path = path
+        self.body = body
+
+    def json(self) -> dict:
+        return json.loads(self.body or b"{}")
+
+    def text(self) -> str:
+        return self.body.decode("utf-8", errors="replace")
+
+    def respond(self, status: int, body: bytes, content_type: str):
+        self.handler.send_response(status)
+        self.handler.send_header("Content-Type", content_type)
+        self.handler.send_header("Content-Length", str(len(body)))
+        self.handler.end_headers()
+        self.handler.wfile.write(body)
+
+    def respond_json(self, data, status: int = 200):
+        self.respond(status, json.dumps(data).encode(), "application/json")
+
+    def respond_stream(self, chunks, content_type: str):
+        """Send an iterable of byte chunks with chunked transfer encoding"""
+        self.handler.send_response(200)
+        self.handler.send_header("Content-Type", content_type)
+        self.handler.send_header("Transfer-Encoding", "chunked")
+        self.handler.end_headers()
+        for chunk in chunks:
+            self.handler.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            self.handler.wfile.flush()
+        self.handler.wfile.write(b"0\r\n\r\n")
+
+class FakeServer:
+    """Threaded HTTP server with a route table, started on a free local port"""
+
+    name = "fake"
+
+    def __init__(self, behaviour: Optional[FakeBehaviour] = None, host: str = "127.0.0.1", port: int = 0):
+        self.behaviour = behaviour or FakeBehaviour()
+        self.routes: dict[tuple[str, str], tuple[Callable[[FakeRequest], None], bool]] = {}
+        self.request_counts: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+        self.register_routes()
+
+    def register_routes(self):
+        pass
+
+    def route(self, method: str, path: str, handler: Callable[[FakeRequest], None], faults: bool = True):
+        """Add a route, without faults it answers without the latency and failures (model lists read at server startup)"""
+        self.routes[(method, path)] = (handler, faults)
+
+    @property
+    def host(self) -> str:
+        return self._httpd.server_address[0]
+
+    @property
+    def port(self) -> int:
+        return self._httpd.server_address[1]
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self) -> "FakeServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True, name=f"{self.name}-server")
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def count(self, path: str):
+        with self._lock:
+            self.request_counts[path] = self.request_counts.get(path, 0) + 1
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return dict(self.request_counts)
+
+    def dispatch(self, handler: BaseHTTPRequestHandler, method: str):
+        path = handler.path.split("?", 1)[0]
+        if path.startswith("/v1/"):
+            path = path[3:]
+        length = int(handler.headers.get("Content-Length") or 0)
+        body = handler.rfile.read(length) if length else b""
+        request = FakeRequest(handler, path, body)
+        route = self.routes.get((method, path))
+        if route is None:
+            request.respond_json({"error": f"{self.name}: no route for {method} {path}"}, 404)
+            return
+        route_handler, faults = route
+        self.count(path)
+        if faults:
+            time.sleep(self.behaviour.delay())
+            if self.behaviour.fails():
+                request.respond_json({"error": f"{self.name}: injected failure"}, 500)
+                return
+        route_handler(request)
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                fake.dispatch(self, "GET")
+
+            def do_POST(self):
+                fake.dispatch(self, "POST")
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+def reply_words(prompt: str, words: int) -> list[str]:
+    """Reply text of a fake model, a few sentences so sentence-level TTS has work to do"""
+    vocabulary = ["the", "stream", "of", "words", "from", "a", "model", "that", "never", "thinks", "long", "about", "anything"]
+    result = []
+    for index in range(words):
+        word = vocabulary[(index + len(prompt)) % len(vocabulary)]
+        result.append(word + ("." if index % 12 == 11 else ""))
+    return result
+
+def paced(chunks, seconds_per_chunk: float, last: bytes):
+    """Yield the chunks with a delay before each one, like tokens leaving a model, then the last chunk"""
+    for chunk in chunks:
+        if seconds_per_chunk > 0:
+            time.sleep(seconds_per_chunk)
+        yield chunk
+    yield last
+
+def sse_event(event: dict) -> bytes:
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode()
+
+class FakeOllama(FakeServer):
+    """Ollama /api/chat, /api/generate (both also streaming) and /api/tags.
+
+    The behaviour latency is the time to the first token, every word of the reply takes seconds_per_word more.
+    """
+
+    name = "ollama"
+
+    def __init__(self, models: list[str], words: int = 40, seconds_per_word: float = 0.0, **kwargs):
+        self.models = models
+        self.words = words
+        self.seconds_per_word = seconds_per_word
+        super().__init__(**kwargs)
+
+    def register_routes(self):
+        self.route("POST", "/api/chat", self.chat)
+        self.route("POST", "/api/generate", self.generate)
+        self.route("GET", "/api/tags", self.tags, faults=False)
+
+    def tags(self, request: FakeRequest):
+        request.respond_json({"models": [{"name": model, "model": model, "size": 0} for model in self.models]})
+
+    def _reply(self, request: FakeRequest, prompt_text: str, make_part: Callable[[str, bool], dict]):
+        body = request.json()
+        words = reply_words(prompt_text, self.words)
+        prompt_tokens = max(1, len(prompt_text) // 4)
+        final = dict(make_part("", True), done_reason="stop", eval_count=len(words), prompt_eval_count=prompt_tokens,
+                     total_duration=0, load_duration=0, prompt_eval_duration=0, eval_duration=0)
+        if not body.get("stream", True):
+            time.sleep(self.seconds_per_word * len(words))
+            request.respond_json(dict(final, **make_part(" ".join(words), True)))
+            return
+        parts = (json.dumps(make_part(word + " ", False)).encode() + b"\n" for word in words)
+        request.respond_stream(paced(parts, self.seconds_per_word, json.dumps(final).encode() + b"\n"), "application/x-ndjson")
+
+    def chat(self, request: FakeRequest):
+        body = request.json()
+        prompt_text = " ".join(message.get("content", "") for message in body.get("messages", []))
+        self._reply(request, prompt_text, lambda content, done: {
+            "model": body.get("model"), "created_at": "2024-01-01T00:00:00Z",
+            "message": {"role": "assistant", "content": content}, "done": done
+        })
+
+    def generate(self, request: FakeRequest):
+        body = request.json()
+        self._reply(request, body.get("prompt", ""), lambda content, done: {
+            "model": body.get("model"), "created_at": "2024-01-01T00:00:00Z", "response": content, "done": done
+        })
+
+class FakeSpeech(FakeServer):
+    """OpenAI compatible audio.speech, the clip length follows the length of the input text"""
+
+    name = "speech"
+    seconds_per_character = 0.06
+
+    def __init__(self, models: list[str], voices: list[str], **kwargs):
+        self.models = models
+        self.voices = voices
+        super().__init__(**kwargs)
+
+    def register_routes(self):
+        self.route("POST", "/audio/speech", self.speech)
+        self.route("GET", "/models", self.list_models, faults=False)
+
+    def list_models(self, request: FakeRequest):
+        request.respond_json({"object": "list", "data": [{"id": model, "object": "model", "created": 0, "owned_by": self.name} for model in self.models]})
+
+    def speech(self, request: FakeRequest):
+        body = request.json()
+        seconds = max(0.5, len(body.get("input", "")) * self.seconds_per_character)
+        if body.get("response_format") == "pcm":
+            request.respond(200, synthetic_pcm(seconds), "audio/pcm")
+        else:
+            request.respond(200, synthetic_mp3(seconds), "audio/mpeg")
+
+class FakeKokoro(FakeSpeech):
+    """Kokoro FastAPI: audio.speech, /models and /audio/voices"""
+
+    name = "kokoro"
+
+    def register_routes(self):
+        super().register_routes()
+        self.route("GET", "/audio/voices", self.list_voices, faults=False)
+
+    def list_voices(self, request: FakeRequest):
+        request.respond_json({"voices": self.voices})
+
+class FakeOpenAI(FakeSpeech):
+    """OpenAI responses (also parse and streaming), audio.speech and /models, paced like FakeOllama"""
+
+    name = "openai"
+
+    def __init__(self, models: list[str], voices: list[str], words: int = 40, seconds_per_word: float = 0.0, **kwargs):
+        self.words = words
+        self.seconds_per_word = seconds_per_word
+        super().__init__(models, voices, **kwargs)
+
+    def register_routes(self):
+        super().register_routes()
+        self.route("POST", "/responses", self.responses)
+
+    def _response_object(self, body: dict, text: str, output_tokens: int) -> dict:
+        input_text = json.dumps(body.get("input", "")) + (body.get("instructions") or "")
+        input_tokens = max(1, len(input_text) // 4)
+        return {
+            "id": f"resp_{uuid.uuid4().hex}", "object": "response", "created_at": time.time(), "model": body.get("model"),
+            "status": "completed", "parallel_tool_calls": True, "tool_choice": "auto", "tools": [],
+            "output": [{
+                "type": "message", "id": f"msg_{uuid.uuid4().hex}", "status": "completed", "role": "assistant",
+                "content": [{"type": "output_text", "text": text, "annotations": []}]
+            }],
+            "usage": {
+                "input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens,
+                "input_tokens_details": {"cached_tokens": 0}, "output_tokens_details": {"reasoning_tokens": 0}
+            }
+        }
+
+    def responses(self, request: FakeRequest):
+        body = request.json()
+        words = reply_words(json.dumps(body.get("input", "")), self.words)
+        text = " ".join(words)
+        if (body.get("text") or {}).get("format", {}).get("type") == "json_schema":
+            # responses.parse with text_format=CharacterResponse
+            text = json.dumps({"text_response": text})
+        response = self._response_object(body, text, len(words))
+        if not body.get("stream"):
+            time.sleep(self.seconds_per_word * len(words))
+            request.respond_json(response)
+            return
+        events = ({"type": "response.output_text.delta", "item_id": response["output"][0]["id"], "output_index": 0, "content_index": 0, "delta": word + " "} for word in words)
+        completed = {"type": "response.completed", "response": response}
+        request.respond_stream(paced((sse_event(event) for event in events), self.seconds_per_word, sse_event(completed)), "text/event-stream")
+
+class FakeIcecast(FakeServer):
+    """Icecast /admin/stats and /admin/listmounts with the mounts of the streams started on the fake Liquidsoap"""
+
+    name = "icecast"
+
+    def __init__(self, listeners: int = 1, **kwargs):
+        self.listeners = listeners
+        self.mounts: set[str] = set()
+        super().__init__(**kwargs)
+
+    def register_routes(self):
+        self.route("GET", "/admin/stats", self.stats)
+        self.route("GET", "/admin/listmounts", self.list_mounts)
+
+    def _sources(self, with_listeners: bool) -> str:
+        with self._lock:
+            mounts = sorted(self.mounts)
+        listeners = f"<listeners>{self.listeners}</listeners>" if with_listeners else ""
+        return "".join(f'<source mount="{mount}">{listeners}</source>' for mount in mounts)
+
+    def stats(self, request: FakeRequest):
+        request.respond(200, f"<icestats>{self._sources(True)}</icestats>".encode(), "text/xml")
+
+    def list_mounts(self, request: FakeRequest):
+        request.respond(200, f"<icestats>{self._sources(False)}</icestats>".encode(), "text/xml")
+
+class FakeLiquidsoap(FakeServer):
+    """Liquidsoap HTTP control endpoints, started streams show up as mounts on the fake Icecast"""
+
+    name = "liquidsoap"
+
+    def __init__(self, icecast: Optional[FakeIcecast] = None, **kwargs):
+        self.icecast = icecast
+        self.queued_files = 0
+        self.queued_by_mount: dict[str, int] = {}
+        super().__init__(**kwargs)
+
+    def register_routes(self):
+        for kind in ("aitalkmaster", "translation"):
+            self.route("POST", f"/start_{kind}_stream", self.start_stream)
+            self.route("POST", f"/stop_{kind}_stream", self.stop_stream)
+            self.route("POST", f"/queue_{kind}_audio", self.queue_audio)
+
+    @staticmethod
+    def _mount(data: str) -> str:
+        # "join_key[::file]" or "translation::session_key[::file]"
+        if data.startswith("translation::"):
+            return "/translation/" + data.split("::")[1]
+        return "/aitalkmaster/" + data.split("::")[0]
+
+    def start_stream(self, request: FakeRequest):
+        if self.icecast is not None:
+            with self.icecast._lock:
+                self.icecast.mounts.add(self._mount(request.text()))
+        request.respond(200, b"OK", "text/plain")
+
+    def stop_stream(self, request: FakeRequest):
+        if self.icecast is not None:
+            with self.icecast._lock:
+                self.icecast.mounts.discard(self._mount(request.text()))
+        request.respond(200, b"OK", "text/plain")
+
+    def queue_audio(self, request: FakeRequest):
+        mount = self._mount(request.text())
+        with self._lock:
+            self.queued_files += 1
+            self.queued_by_mount[mount] = self.queued_by_mount.get(mount, 0) + 1
+        request.respond(200, b"OK", "text/plain")
+
+    def queued_count(self, mount: str) -> int:
+        """Files queued to the stream of a mount, e.g. /aitalkmaster/<join_key>"""
+        with self._lock:
+            return self.queued_by_mount.get(mount, 0)
@@ -0,0 +1,458 @@
+"""
+Load generator replaying the polling traffic of the in-world LSL scripts:
+
+    python -m benchmarks.lsl_load --objects generate=200 --objects ait_character=40 --duration 300
+    python -m benchmarks.lsl_load --objects all=50 --poll-interval 1 --body-maxlength 2048
+
+Every simulated object runs the state machine of its script (Generate.lsl, Conversation.lsl,
+ait_character.lsl, translation.lsl): it posts a message, then polls on its timer without the
+timeout parameter until the response arrives, an error status ends the interaction or the
+polling timeout of the script is reached. Response bodies are cut to HTTP_BODY_MAXLENGTH like
+OpenSimulator does, a cut 200 is unreadable for the script and it keeps polling.
+
+The report counts polls per useful response and server CPU per completed interaction, so
+deployments can be sized and changes to the polling protocol measured. Spoken interactions
+(ait_character, translation) whose audio never reaches the fake Liquidsoap are reported as
+audio_missing, AI Talkmaster clips the server has not published by the end of the audio wait
+(several per interaction with --streaming-tts) as audio_unpublished. The requests per second
+cover the interactions only, the audio wait afterwards is reported as audio_wait_seconds.
+
+Unlike LSL, an object does not send its next poll while the previous one is still in flight,
+timer ticks missed meanwhile collapse into one poll.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from benchmarks.run import add_setup_arguments, setup_from_arguments
+from benchmarks.scenarios import HttpClient, percentile, wait_for_audio, audio_error, unpublished_error
+from benchmarks.server_process import AUDIO_VOICES, BenchmarkBackends, ServerProcess
+
+# max_response_length of the scripts
+DEFAULT_BODY_MAXLENGTH = 16384
+
+@dataclass
+class LslLoadOptions:
+    """Settings shared by the simulated objects"""
+    duration_seconds: float = 120.0  # no new interactions start afterwards, running ones finish
+    think_seconds: float = 10.0  # mean pause between a response and the next message of an object
+    polling_timeout_seconds: float = 300.0  # polling_timeout of the scripts
+    request_timeout_seconds: float = 30.0  # OpenSimulator gives up a request with status 0 after this
+    turns_per_session: int = 10  # Conversation.lsl messages before the session times out and a new one starts
+    characters_per_join_key: int = 2  # ait_character objects talking in the same conversation
+    audio: bool = True
+    audio_wait_seconds: float = 30.0  # time after the last interaction for the audio of all interactions to be queued
+    # Per script overrides, the script's own values otherwise
+    poll_intervals: dict[str, float] = field(default_factory=dict)
+    body_maxlengths: dict[str, int] = field(default_factory=dict)
+
+@dataclass
+class ScriptStats:
+    """Counters of all objects running one script"""
+    script: str
+    objects: int = 0
+    poll_interval_seconds: float = 0.0
+    body_maxlength: int = 0
+    interactions: int = 0
+    completed: int = 0
+    failed: int = 0
+    timed_out: int = 0
+    session_requests: int = 0
+    posts: int = 0
+    polls: int = 0
+    not_ready: int = 0  # 425 answers to polls
+    truncated: int = 0  # 200 answers cut by HTTP_BODY_MAXLENGTH
+    request_timeouts: int = 0  # requests OpenSimulator would report with status 0
+    latencies: list[float] = field(default_factory=list)
+    max_body_bytes: int = 0
+    errors: list[str] = field(default_factory=list)
+    audio_expected: dict[str, int] = field(default_factory=dict)  # mount -> completed interactions with audio
+    audio_missing: int = 0
+    audio_unpublished: int = 0  # AI Talkmaster clips not published at the end of the audio wait
+
+    def summary(self) -> dict:
+        latencies = sorted(self.latencies)
+        requests = self.session_requests + self.posts + self.polls
+        summary = {
+            "script": self.script,
+            "objects": self.objects,
+            "poll_interval_seconds": self.poll_interval_seconds,
+            "body_maxlength": self.body_maxlength,
+            "interactions": self.interactions,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timed_out": self.timed_out,
+            "http_requests": requests,
+            "polls": self.polls,
+            "not_ready": self.not_ready,
+            "truncated": self.truncated,
+            "request_timeouts": self.request_timeouts,
+            "polls_per_useful_response": round(self.polls / self.completed, 3) if self.completed else None,
+            "requests_per_useful_response": round(requests / self.completed, 3) if self.completed else None,
+            "max_body_bytes": self.max_body_bytes,
+            "response_seconds": {
+                "p50": round(percentile(latencies, 0.50), 4),
+                "p95": round(percentile(latencies, 0.95), 4),
+                "max": round(latencies[-1], 4) if latencies else 0.0
+            }
+        }
+        if self.audio_expected:
+            summary["audio_missing"] = self.audio_missing
+            if self.script == "ait_character":
+                summary["audio_unpublished"] = self.audio_unpublished
+        if self.errors:
+            summary["first_errors"] = self.errors[:5]
+        return summary
+
+class LslObject:
+    """One in-world object, subclasses fill in the requests of their script"""
+    script = ""
+    poll_interval_seconds = 2.0  # pollFreq of the script
+    post_path = ""
+    poll_path = ""
+
+    def __init__(self, index: int, client: HttpClient, stats: ScriptStats, lock: threading.Lock, options: LslLoadOptions):
+        self.index = index
+        self.client = client
+        self.stats = stats
+        self.lock = lock
+        self.options = options
+        self.interval = options.poll_intervals.get(self.script, options.poll_intervals.get("all", self.poll_interval_seconds))
+        self.body_maxlength = options.body_maxlengths.get(self.script, options.body_maxlengths.get("all", DEFAULT_BODY_MAXLENGTH))
+        self.turns = 0
+
+    def start_session(self):
+        """Requests the script sends before its first message"""
+
+    def post_body(self, message_id: str) -> dict:
+        raise NotImplementedError
+
+    def poll_params(self, message_id: str) -> dict:
+        raise NotImplementedError
+
+    def audio_mount(self) -> Optional[str]:
+        """Liquidsoap mount the audio of a response is queued to, None if the script has no audio"""
+        return None
+
+    def count(self, **increments):
+        with self.lock:
+            for name, value in increments.items():
+                setattr(self.stats, name, getattr(self.stats, name) + value)
+
+    def fail(self, reason: str):
+        with self.lock:
+            self.stats.failed += 1
+            self.stats.errors.append(reason)
+
+    def send(self, method: str, path: str, params: Optional[dict] = None, body: Optional[dict] = None) -> tuple[int, bytes]:
+        try:
+            return self.client.request_raw(method, path, params=params, body=body)
+        except TimeoutError:
+            self.count(request_timeouts=1)
+            return 0, b""
+
+    def session_request(self, path: str, body: dict) -> dict:
+        self.count(session_requests=1)
+        status, data = self.send("POST", path, body=body)
+        if status != 200:
+            raise RuntimeError(f"{path} status {status}: {data[:200].decode(errors='replace')}")
+        return json.loads(data)
+
+    def read_response(self, status: int, data: bytes, message_id: str) -> Optional[bool]:
+        """True for the awaited response, False when the script stops polling, None to keep polling"""
+        if status == 200:
+            body = data[:self.body_maxlength]
+            try:
+                response = json.loads(body)
+            except ValueError:
+                # llJsonGetValue fails on the cut body, the message_id does not match and the script polls on
+                if len(data) > self.body_maxlength:
+                    self.count(truncated=1)
+                return None
+            if not isinstance(response, dict) or response.get("message_id") != message_id:
+                return None
+            with self.lock:
+                self.stats.max_body_bytes = max(self.stats.max_body_bytes, len(data))
+            return True
+        if status in (0, 425, 499):
+            return None
+        self.fail(f"status {status}: {data[:200].decode(errors='replace')}")
+        return False
+
+    def interaction(self):
+        message_id = str(uuid.uuid4())
+        self.count(interactions=1)
+        self.turns += 1
+        start = time.perf_counter()
+        self.count(posts=1)
+        status, data = self.send("POST", self.post_path, body=self.post_body(message_id))
+        done = self.read_response(status, data, message_id)
+        next_tick = start + self.interval
+        while done is None:
+            now = time.perf_counter()
+            if next_tick > now:
+                time.sleep(next_tick - now)
+                now = next_tick
+            if now - start > self.options.polling_timeout_seconds:
+                self.count(timed_out=1)
+                return
+            next_tick = max(next_tick + self.interval, now)
+            self.count(polls=1)
+            status, data = self.send("GET", self.poll_path, params=self.poll_params(message_id))
+            if status == 425:
+                self.count(not_ready=1)
+            done = self.read_response(status, data, message_id)
+        if done:
+            elapsed = time.perf_counter() - start
+            mount = self.audio_mount()
+            with self.lock:
+                self.stats.completed += 1
+                self.stats.latencies.append(elapsed)
+                if mount is not None:
+                    self.stats.audio_expected[mount] = self.stats.audio_expected.get(mount, 0) + 1
+
+    def pause(self, deadline: float):
+        """Time until the avatar says something again, jittered so objects do not poll in lockstep"""
+        time.sleep(max(0.0, min(random.uniform(0.5, 1.5) * self.options.think_seconds, deadline - time.time())))
+
+    def run(self, deadline: float):
+        time.sleep(random.uniform(0, min(self.options.think_seconds, self.interval * 5)))
+        while time.time() < deadline:
+            try:
+                self.start_session()
+                self.interaction()
+            except Exception as e:
+                self.fail(f"{type(e).__name__}: {e}")
+            self.pause(deadline)
+
+class GenerateObject(LslObject):
+    """Generate.lsl: one message per touch, polled without consume"""
+    script = "generate"
+    post_path = "/generate/postMessage"
+    poll_path = "/generate/getMessageResponse"
+
+    def post_body(self, message_id: str) -> dict:
+        return {"message": "Describe a sunset in two sentences.", "message_id": message_id}
+
+    def poll_params(self, message_id: str) -> dict:
+        return {"message_id": message_id}
+
+class ConversationObject(LslObject):
+    """Conversation.lsl: a conversation per visitor with several messages"""
+    script = "conversation"
+    post_path = "/conversation/postMessage"
+    poll_path = "/conversation/getMessageResponse"
+    conversation_key: Optional[str] = None
+
+    def start_session(self):
+        if self.conversation_key is None or self.turns >= self.options.turns_per_session:
+            response = self.session_request("/conversation/start", {"username": "Visitor", "system_instructions": "You are a helpful guide."})
+            self.conversation_key = response["conversation_key"]
+            self.turns = 0
+
+    def post_body(self, message_id: str) -> dict:
+        return {"conversation_key": self.conversation_key, "message": "What should I see next?", "message_id": message_id}
+
+    def poll_params(self, message_id: str) -> dict:
+        return {"conversation_key": self.conversation_key, "message_id": message_id}
+
+class AitCharacterObject(LslObject):
+    """ait_character.lsl: characters sharing a join_key, polled every second"""
+    script = "ait_character"
+    poll_interval_seconds = 1.0
+    post_path = "/ait/postMessage"
+    poll_path = "/ait/getMessageResponse"
+    started = False
+
+    @property
+    def join_key(self) -> str:
+        return f"lsl-load-{self.index // max(1, self.options.characters_per_join_key)}"
+
+    def start_session(self):
+        if not self.started:
+            self.session_request("/ait/startConversation", {"join_key": self.join_key})
+            self.started = True
+
+    def post_body(self, message_id: str) -> dict:
+        body = {"join_key": self.join_key, "username": "Visitor", "message": "Tell me something about this place.",
+                "charactername": f"Character{self.index}", "message_id": message_id}
+        if self.options.audio:
+            body["audio_voice"] = AUDIO_VOICES[self.index % len(AUDIO_VOICES)]
+        return body
+
+    def poll_params(self, message_id: str) -> dict:
+        return {"join_key": self.join_key, "message_id": message_id}
+
+    def audio_mount(self) -> Optional[str]:
+        return f"/aitalkmaster/{self.join_key}" if self.options.audio else None
+
+class TranslationObject(LslObject):
+    """translation.lsl: a fixed session_key from the notecard"""
+    script = "translation"
+    post_path = "/translation/translate"
+    poll_path = "/translation/getTranslation"
+
+    def post_body(self, message_id: str) -> dict:
+        return {"session_key": f"lsl-load-{self.index}", "message": "Welcome to the region, the event starts at eight.",
+                "source_language": "English", "target_language": "German", "message_id": message_id}
+
+    def poll_params(self, message_id: str) -> dict:
+        return {"session_key": f"lsl-load-{self.index}", "message_id": message_id}
+
+    def audio_mount(self) -> Optional[str]:
+        return f"/translation/lsl-load-{self.index}"
+
+LSL_SCRIPTS: dict[str, type[LslObject]] = {
+    "generate": GenerateObject,
+    "conversation": ConversationObject,
+    "ait_character": AitCharacterObject,
+    "translation": TranslationObject,
+}
+
+@dataclass
+class LslLoadResult:
+    scripts: list[ScriptStats]
+    wall_seconds: float = 0.0  # until the last interaction finished
+    audio_wait_seconds: float = 0.0  # after that, until the audio was queued to Liquidsoap
+    server_cpu_seconds: Optional[float] = None
+
+    def summary(self) -> dict:
+        completed = sum(stats.completed for stats in self.scripts)
+        polls = sum(stats.polls for stats in self.scripts)
+        requests = sum(stats.session_requests + stats.posts + stats.polls for stats in self.scripts)
+        summary = {
+            "objects": sum(stats.objects for stats in self.scripts),
+            "wall_seconds": round(self.wall_seconds, 3),
+            "audio_wait_seconds": round(self.audio_wait_seconds, 3),
+            "completed": completed,
+            "http_requests": requests,
+            "requests_per_second": round(requests / self.wall_seconds, 3) if self.wall_seconds else 0.0,
+            "polls_per_useful_response": round(polls / completed, 3) if completed else None,
+            "scripts": [stats.summary() for stats in self.scripts]
+        }
+        if self.server_cpu_seconds is not None:
+            summary["server_cpu_seconds"] = round(self.server_cpu_seconds, 3)
+            summary["server_cpu_ms_per_completed_interaction"] = round(1000 * self.server_cpu_seconds / completed, 3) if completed else None
+            summary["server_cpu_ms_per_request"] = round(1000 * self.server_cpu_seconds / requests, 3) if requests else None
+        return summary
+
+def run_lsl_load(base_url: str, objects: dict[str, int], options: LslLoadOptions,
+                 cpu_seconds: Optional[Callable[[], Optional[float]]] = None,
+                 queued_count: Optional[Callable[[str], int]] = None,
+                 unpublished_clips: Optional[Callable[[], int]] = None) -> LslLoadResult:
+    """Run the objects of every script at once for the duration of the options
+
+    queued_count checks the audio with the fake Liquidsoap, unpublished_clips asks the server for
+    clips still on their way there.
+    """
+    lock = threading.Lock()
+    simulated: list[LslObject] = []
+    result = LslLoadResult(scripts=[])
+    for script, count in objects.items():
+        stats = ScriptStats(script=script, objects=count)
+        result.scripts.append(stats)
+        for index in range(count):
+            simulated.append(LSL_SCRIPTS[script](index, HttpClient(base_url, timeout_seconds=options.request_timeout_seconds), stats, lock, options))
+        if count:
+            stats.poll_interval_seconds = simulated[-1].interval
+            stats.body_maxlength = simulated[-1].body_maxlength
+
+    cpu_before = cpu_seconds() if cpu_seconds else None
+    start = time.perf_counter()
+    deadline = time.time() + options.duration_seconds
+    if simulated:
+        with ThreadPoolExecutor(max_workers=len(simulated), thread_name_prefix="lsl-object") as executor:
+            for future in [executor.submit(lsl_object.run, deadline) for lsl_object in simulated]:
+                future.result()
+    result.wall_seconds = time.perf_counter() - start
+    if queued_count is not None:
+        # The scripts use different mounts, so one wait covers all of them
+        expected = {mount: count for stats in result.scripts for mount, count in stats.audio_expected.items()}
+        missing = wait_for_audio(expected, queued_count, options.audio_wait_seconds, unpublished_clips)
+        for stats in result.scripts:
+            for mount, count in stats.audio_expected.items():
+                if mount in missing:
+                    stats.audio_missing += missing[mount]
+                    stats.errors.append(audio_error(mount, missing[mount], count))
+            # Only AI Talkmaster clips are sequenced, the server reports the ones not published yet
+            if stats.script == "ait_character" and stats.audio_expected and unpublished_clips is not None:
+                stats.audio_unpublished = unpublished_clips()
+                if stats.audio_unpublished:
+                    stats.errors.append(unpublished_error(stats.audio_unpublished, options.audio_wait_seconds))
+        result.audio_wait_seconds = time.perf_counter() - start - result.wall_seconds
+    cpu_after = cpu_seconds() if cpu_seconds else None
+    if cpu_before is not None and cpu_after is not None:
+        result.server_cpu_seconds = cpu_after - cpu_before
+    return result
+
+def per_script(values: Optional[list[str]], cast: Callable[[str], object], option: str) -> dict:
+    """Parse SCRIPT=VALUE arguments, a bare VALUE or all=VALUE applies to every script"""
+    parsed = {}
+    for value in values or []:
+        script, _, number = value.rpartition("=")
+        script = script or "all"
+        if script != "all" and script not in LSL_SCRIPTS:
+            raise argparse.ArgumentTypeError(f"{option}: unknown script {script}, use one of {', '.join(LSL_SCRIPTS)} or all")
+        parsed[script] = cast(number)
+    return parsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay the polling traffic of the LSL scripts against the AI Talkmaster server and local fake backends")
+    parser.add_argument("--objects", action="append", metavar="[SCRIPT=]COUNT",
+                        help=f"simulated objects per script ({', '.join(LSL_SCRIPTS)}), repeatable, 10 of each by default")
+    parser.add_argument("--poll-interval", action="append", metavar="[SCRIPT=]SECONDS", help="timer interval while polling, the script's own by default")
+    parser.add_argument("--body-maxlength", action="append", metavar="[SCRIPT=]BYTES", help=f"HTTP_BODY_MAXLENGTH, {DEFAULT_BODY_MAXLENGTH} by default")
+    parser.add_argument("--duration", type=float, default=120.0, help="seconds during which new interactions start")
+    parser.add_argument("--think-seconds", type=float, default=10.0, help="mean pause between a response and the next message of an object")
+    parser.add_argument("--polling-timeout", type=float, default=300.0)
+    parser.add_argument("--request-timeout", type=float, default=30.0, help="seconds after which a request counts as status 0")
+    parser.add_argument("--turns-per-session", type=int, default=10, help="messages per conversation of Conversation.lsl")
+    parser.add_argument("--characters-per-join-key", type=int, default=2)
+    parser.add_argument("--audio-wait", type=float, default=30.0, help="seconds after the last interaction for the audio to be queued")
+    add_setup_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        counts = per_script(args.objects or ["all=10"], int, "--objects")
+        poll_intervals = per_script(args.poll_interval, float, "--poll-interval")
+        body_maxlengths = per_script(args.body_maxlength, int, "--body-maxlength")
+    except (argparse.ArgumentTypeError, ValueError) as e:
+        parser.error(str(e))
+    objects = {script: counts.get(script, counts.get("all", 0)) for script in LSL_SCRIPTS}
+
+    setup = setup_from_arguments(args)
+    if not setup.audio and objects["translation"]:
+        # Translations are always spoken, they need the audio backends
+        objects["translation"] = 0
+    objects = {script: count for script, count in objects.items() if count > 0}
+
+    options = LslLoadOptions(
+        duration_seconds=args.duration,
+        think_seconds=args.think_seconds,
+        polling_timeout_seconds=args.polling_timeout,
+        request_timeout_seconds=args.request_timeout,
+        turns_per_session=args.turns_per_session,
+        characters_per_join_key=args.characters_per_join_key,
+        audio=setup.audio,
+        audio_wait_seconds=args.audio_wait,
+        poll_intervals=poll_intervals,
+        body_maxlengths=body_maxlengths
+    )
+
+    with BenchmarkBackends(setup) as backends, ServerProcess(setup, backends, keep_workdir=args.keep_workdir) as server:
+        result = run_lsl_load(server.base_url, objects, options, cpu_seconds=server.cpu_seconds,
+                              queued_count=backends.liquidsoap.queued_count if setup.audio else None,
+                              unpublished_clips=server.unpublished_clips if setup.audio else None)
+        print(json.dumps(result.summary(), indent=2))
+        print(json.dumps({"backend_requests": backends.get_stats()}, indent=2))
+        if args.keep_workdir:
+            print(f"Server files kept in {server.workdir}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Command line entry point of the benchmarks, run from the aitalkmaster-server directory:
+
+    python -m benchmarks.run --scenario ait --interactions 200 --concurrency 20
+    python -m benchmarks.run --scenario all --num-workers 8 --llm-latency 2 --tts-latency 0.5
+
+Prints one JSON summary per scenario (throughput, p50/p95/p99 latency, errors, server CPU).
+Interactions whose audio never reaches the fake Liquidsoap count as errors (audio_missing), as do
+clips the server has not published by the end of the audio wait (audio_unpublished).
+"""
+import argparse
+import json
+
+from benchmarks.fake_backends import FakeBehaviour
+from benchmarks.scenarios import SCENARIOS, ScenarioOptions, run_scenario
+from benchmarks.server_process import BenchmarkSetup, BenchmarkBackends, ServerProcess
+
+def add_setup_arguments(parser: argparse.ArgumentParser):
+    """Backend and server arguments, shared with the LSL load generator"""
+    parser.add_argument("--chat-backend", choices=["ollama", "openai"], default="ollama")
+    parser.add_argument("--no-audio", action="store_true", help="run without TTS, Liquidsoap and Icecast")
+    parser.add_argument("--streaming-tts", action="store_true")
+    parser.add_argument("--num-workers", type=int, default=4)
+    parser.add_argument("--num-audio-workers", type=int, default=4)
+    parser.add_argument("--chat-concurrency", type=int, default=64)
+    parser.add_argument("--audio-concurrency", type=int, default=16)
+    parser.add_argument("--port", type=int, default=6100)
+    parser.add_argument("--words", type=int, default=40, help="words per fake chat reply")
+    parser.add_argument("--seconds-per-word", type=float, default=0.0)
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds to the first token")
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0)
+    parser.add_argument("--tts-latency", type=float, default=0.3)
+    parser.add_argument("--tts-failure-rate", type=float, default=0.0)
+    parser.add_argument("--liquidsoap-latency", type=float, default=0.005)
+    parser.add_argument("--liquidsoap-failure-rate", type=float, default=0.0)
+    parser.add_argument("--icecast-latency", type=float, default=0.0)
+    parser.add_argument("--icecast-failure-rate", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.2, help="latency jitter as a fraction of the latency")
+    parser.add_argument("--keep-workdir", action="store_true", help="keep config, logs and audio of the server under test")
+
+def setup_from_arguments(args: argparse.Namespace) -> BenchmarkSetup:
+    def behaviour(latency: float, failure_rate: float) -> FakeBehaviour:
+        return FakeBehaviour(latency_seconds=latency, jitter_seconds=latency * args.jitter, failure_rate=failure_rate)
+
+    return BenchmarkSetup(
+        chat_backend=args.chat_backend,
+        audio=not args.no_audio,
+        streaming_tts=args.streaming_tts,
+        num_workers=args.num_workers,
+        num_audio_workers=args.num_audio_workers,
+        chat_concurrency=args.chat_concurrency,
+        audio_concurrency=args.audio_concurrency,
+        port=args.port,
+        words=args.words,
+        seconds_per_word=args.seconds_per_word,
+        llm=behaviour(args.llm_latency, args.llm_failure_rate),
+        tts=behaviour(args.tts_latency, args.tts_failure_rate),
+        liquidsoap=behaviour(args.liquidsoap_latency, args.liquidsoap_failure_rate),
+        icecast=behaviour(args.icecast_latency, args.icecast_failure_rate)
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the AI Talkmaster server against local fake backends")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS) + ["all"], default="all")
+    parser.add_argument("--interactions", type=int, default=100, help="interactions per scenario")
+    parser.add_argument("--concurrency", type=int, default=10, help="client threads")
+    parser.add_argument("--long-poll", type=float, default=30.0, help="timeout parameter of getMessageResponse")
+    parser.add_argument("--turns-per-session", type=int, default=10)
+    parser.add_argument("--audio-wait", type=float, default=30.0, help="seconds after the last response for the audio to be queued")
+    add_setup_arguments(parser)
+    args = parser.parse_args()
+
+    setup = setup_from_arguments(args)
+    options = ScenarioOptions(long_poll_seconds=args.long_poll, turns_per_session=args.turns_per_session, audio=setup.audio, audio_wait_seconds=args.audio_wait)
+    scenarios = sorted(SCENARIOS) if args.scenario == "all" else [args.scenario]
+    if not setup.audio and "translation" in scenarios:
+        # Translations are always spoken, they need the audio backends
+        scenarios.remove("translation")
+
+    with BenchmarkBackends(setup) as backends, ServerProcess(setup, backends, keep_workdir=args.keep_workdir) as server:
+        for name in scenarios:
+            result = run_scenario(name, server.base_url, args.interactions, args.concurrency, options, cpu_seconds=server.cpu_seconds,
+                                  queued_count=backends.liquidsoap.queued_count if setup.audio else None,
+                                  unpublished_clips=server.unpublished_clips if setup.audio else None)
+            print(json.dumps(result.summary(), indent=2))
+        print(json.dumps({"backend_requests": backends.get_stats()}, indent=2))
+        if args.keep_workdir:
+            print(f"Server files kept in {server.workdir}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""
+Scenario drivers: each interaction posts a message and waits for its response, like an
+in-world object does, and its end-to-end latency is recorded. Spoken interactions are only
+complete once their audio was queued to Liquidsoap, this is checked at the end of the run.
+With streaming TTS an interaction has one clip per sentence, so the check also waits until
+the server has no unpublished clips left. The interactions and this audio drain are timed
+separately, the throughput only covers the interactions.
+
+The drivers use http.client with one keep-alive connection per client thread, so the client
+side stays cheap compared to the server it measures.
+"""
+import http.client
+import json
+import math
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+from urllib.parse import urlencode, urlparse
+
+from benchmarks.server_process import AUDIO_VOICES
+
+class HttpClient:
+    """JSON over a keep-alive connection, one client per thread"""
+
+    def __init__(self, base_url: str, timeout_seconds: float = 120.0):
+        parsed = urlparse(base_url)
+        self._host = parsed.hostname
+        self._port = parsed.port
+        self._timeout_seconds = timeout_seconds
+        self._connection: Optional[http.client.HTTPConnection] = None
+        self.requests = 0
+
+    def request_raw(self, method: str, path: str, params: Optional[dict] = None, body: Optional[dict] = None) -> tuple[int, bytes]:
+        """Status and undecoded body of a request"""
+        if params:
+            path = f"{path}?{urlencode(params)}"
+        payload = json.dumps(body).encode() if body is not None else None
+        headers = {"Content-Type": "application/json"} if payload is not None else {}
+        for attempt in range(2):
+            if self._connection is None:
+                self._connection = http.client.HTTPConnection(self._host, self._port, timeout=self._timeout_seconds)
+            try:
+                self._connection.request(method, path, body=payload, headers=headers)
+                response = self._connection.getresponse()
+                data = response.read()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                # The server closed the keep-alive connection, retry once on a new one
+                self._connection.close()
+                self._connection = None
+                if attempt == 1:
+                    raise
+            except TimeoutError:
+                # A late response would arrive on this connection, never reuse it
+                self._connection.close()
+                self._connection = None
+                raise
+        self.requests += 1
+        return response.status, data
+
+    def request(self, method: str, path: str, params: Optional[dict] = None, body: Optional[dict] = None) -> tuple[int, object]:
+        status, data = self.request_raw(method, path, params=params, body=body)
+        try:
+            return status, json.loads(data) if data else None
+        except ValueError:
+            return status, data.decode(errors="replace")
+
+    def get(self, path: str, **params) -> tuple[int, object]:
+        return self.request("GET", path, params=params)
+
+    def post(self, path: str, body: dict) -> tuple[int, object]:
+        return self.request("POST", path, body=body)
+
+class InteractionError(Exception):
+    pass
+
+def expect(status: int, data: object, *accepted: int):
+    if status not in accepted:
+        raise InteractionError(f"status {status}: {str(data)[:200]}")
+
+@dataclass
+class ScenarioOptions:
+    """Settings shared by the scenario drivers"""
+    long_poll_seconds: float = 30.0  # timeout parameter of the getMessageResponse requests
+    poll_interval_seconds: float = 0.5  # endpoints without long polling (getTranslation)
+    turns_per_session: int = 10  # messages per join_key / conversation before a client starts a new one
+    audio: bool = True
+    audio_wait_seconds: float = 30.0  # time after the last response for the audio of all interactions to be queued
+
+class ClientState:
+    """Per thread session of a driver (join_key, conversation_key, turn counter)"""
+
+    def __init__(self, client: HttpClient, name: str):
+        self.client = client
+        self.name = name
+        self.session_key: Optional[str] = None
+        self.turns = 0
+
+    def session(self, options: ScenarioOptions, start: Callable[[], str]) -> str:
+        if self.session_key is None or self.turns >= options.turns_per_session:
+            self.session_key = start()
+            self.turns = 0
+        self.turns += 1
+        return self.session_key
+
+def wait_for_response(client: HttpClient, path: str, options: ScenarioOptions, **params) -> object:
+    """Long poll a getMessageResponse endpoint until the response is there"""
+    while True:
+        status, data = client.get(path, timeout=options.long_poll_seconds, **params)
+        if status == 200:
+            return data
+        expect(status, data, 425)
+
+def ait_interaction(state: ClientState, options: ScenarioOptions) -> Optional[str]:
+    join_key = state.session(options, lambda: f"bench-{state.name}-{uuid.uuid4().hex[:8]}")
+    message_id = uuid.uuid4().hex
+    body = {"join_key": join_key, "username": "Visitor", "message": "Tell me something about this place.",
+            "charactername": "Guide", "message_id": message_id}
+    if options.audio:
+        body["audio_voice"] = AUDIO_VOICES[state.turns % len(AUDIO_VOICES)]
+    status, data = state.client.post("/ait/postMessage", body)
+    expect(status, data, 200, 425)
+    wait_for_response(state.client, "/ait/getMessageResponse", options, join_key=join_key, message_id=message_id)
+    return f"/aitalkmaster/{join_key}" if options.audio else None
+
+def start_conversation(state: ClientState) -> str:
+    status, data = state.client.post("/conversation/start", {"system_instructions": "You are a helpful guide."})
+    expect(status, data, 200)
+    return data["conversation_key"]
+
+def conversation_interaction(state: ClientState, options: ScenarioOptions) -> Optional[str]:
+    conversation_key = state.session(options, lambda: start_conversation(state))
+    message_id = uuid.uuid4().hex
+    status, data = state.client.post("/conversation/postMessage", {"conversation_key": conversation_key, "message": "What should I see next?", "message_id": message_id})
+    expect(status, data, 200, 425)
+    wait_for_response(state.client, "/conversation/getMessageResponse", options, conversation_key=conversation_key, message_id=message_id)
+
+def generate_interaction(state: ClientState, options: ScenarioOptions) -> Optional[str]:
+    message_id = uuid.uuid4().hex
+    status, data = state.client.post("/generate/postMessage", {"message_id": message_id, "message": "Describe a sunset in two sentences."})
+    expect(status, data, 200, 425)
+    wait_for_response(state.client, "/generate/getMessageResponse", options, message_id=message_id, consume="true")
+
+def translation_interaction(state: ClientState, options: ScenarioOptions) -> Optional[str]:
+    session_key = state.session(options, lambda: f"bench-{state.name}-{uuid.uuid4().hex[:8]}")
+    message_id = uuid.uuid4().hex
+    body = {"session_key": session_key, "message": "Welcome to the region, the event starts at eight.",
+            "source_language": "English", "target_language": "German", "message_id": message_id}
+    status, data = state.client.post("/translation/translate", body)
+    expect(status, data, 200, 425)
+    while True:
+        status, data = state.client.get("/translation/getTranslation", session_key=session_key, message_id=message_id)
+        if status == 200:
+            return f"/translation/{session_key}"
+        expect(status, data, 425)
+        time.sleep(options.poll_interval_seconds)
+
+# An interaction returns the Liquidsoap mount its audio is queued to, None if it has no audio
+SCENARIOS: dict[str, Callable[[ClientState, ScenarioOptions], Optional[str]]] = {
+    "ait": ait_interaction,
+    "conversation": conversation_interaction,
+    "generate": generate_interaction,
+    "translation": translation_interaction,
+}
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(fraction * len(sorted_values))
+    return sorted_values[min(len(sorted_values), max(rank, 1)) - 1]
+
+@dataclass
+class ScenarioResult:
+    scenario: str
+    interactions: int
+    concurrency: int
+    wall_seconds: float = 0.0  # until the last interaction completed
+    audio_wait_seconds: float = 0.0  # after that, until the audio was queued to Liquidsoap
+    latencies: list[float] = field(default_factory=list)
+    errors: list[str] = field(default_factory=list)
+    http_requests: int = 0
+    server_cpu_seconds: Optional[float] = None
+    audio_expected: dict[str, int] = field(default_factory=dict)  # mount -> completed interactions with audio
+    audio_missing: int = 0  # completed interactions whose audio was never queued
+    audio_unpublished: int = 0  # clips the server still had not published at the end of the audio wait
+    audio_errors: list[str] = field(default_factory=list)
+
+    def summary(self) -> dict:
+        latencies = sorted(self.latencies)
+        completed = len(latencies)
+        summary = {
+            "scenario": self.scenario,
+            "interactions": self.interactions,
+            "concurrency": self.concurrency,
+            "completed": completed,
+            "errors": len(self.errors) + self.audio_missing + self.audio_unpublished,
+            "wall_seconds": round(self.wall_seconds, 3),
+            "throughput_per_second": round(completed / self.wall_seconds, 3) if self.wall_seconds else 0.0,
+            "http_requests": self.http_requests,
+            "latency_seconds": {
+                "mean": round(sum(latencies) / completed, 4) if completed else 0.0,
+                "p50": round(percentile(latencies, 0.50), 4),
+                "p95": round(percentile(latencies, 0.95), 4),
+                "p99": round(percentile(latencies, 0.99), 4),
+                "max": round(latencies[-1], 4) if latencies else 0.0
+            }
+        }
+        if self.audio_expected:
+            summary["audio_missing"] = self.audio_missing
+            summary["audio_unpublished"] = self.audio_unpublished
+            summary["audio_wait_seconds"] = round(self.audio_wait_seconds, 3)
+        if self.server_cpu_seconds is not None:
+            summary["server_cpu_seconds"] = round(self.server_cpu_seconds, 3)
+            summary["server_cpu_ms_per_interaction"] = round(1000 * self.server_cpu_seconds / completed, 3) if completed else 0.0
+        if self.errors or self.audio_errors:
+            summary["first_errors"] = (self.errors + self.audio_errors)[:5]
+        return summary
+
+def wait_for_audio(expected: dict[str, int], queued_count: Callable[[str], int], wait_seconds: float,
+                   unpublished_clips: Optional[Callable[[], int]] = None) -> dict[str, int]:
+    """Wait until each mount got at least one queued file per expected interaction and the server
+    reports no unpublished clips, return the shortfall per mount"""
+    deadline = time.time() + wait_seconds
+    while True:
+        missing = {mount: count - queued_count(mount) for mount, count in expected.items() if queued_count(mount) < count}
+        drained = unpublished_clips is None or not expected or unpublished_clips() == 0
+        if (not missing and drained) or time.time() >= deadline:
+            return missing
+        time.sleep(0.1)
+
+def audio_error(mount: str, missing: int, expected: int) -> str:
+    return f"AudioMissing: {missing} of {expected} interactions on {mount} had no audio queued to Liquidsoap"
+
+def unpublished_error(unpublished: int, wait_seconds: float) -> str:
+    return f"AudioUnpublished: {unpublished} clips were still not published to Liquidsoap {wait_seconds}s after the last response"
+
+def run_scenario(name: str, base_url: str, interactions: int, concurrency: int, options: ScenarioOptions,
+                 cpu_seconds: Optional[Callable[[], Optional[float]]] = None,
+                 queued_count: Optional[Callable[[str], int]] = None,
+                 unpublished_clips: Optional[Callable[[], int]] = None) -> ScenarioResult:
+    """Run interactions of a scenario on concurrency client threads
+
+    queued_count checks the audio with the fake Liquidsoap, unpublished_clips asks the server for
+    clips still on their way there.
+    """
+    interaction = SCENARIOS[name]
+    result = ScenarioResult(scenario=name, interactions=interactions, concurrency=concurrency)
+    lock = threading.Lock()
+    remaining = [interactions]
+
+    def client_thread(thread_index: int):
+        state = ClientState(HttpClient(base_url), f"{name}{thread_index}")
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    break
+                remaining[0] -= 1
+            start = time.perf_counter()
+            try:
+                mount = interaction(state, options)
+                elapsed = time.perf_counter() - start
+                with lock:
+                    result.latencies.append(elapsed)
+                    if mount is not None:
+                        result.audio_expected[mount] = result.audio_expected.get(mount, 0) + 1
+            except Exception as e:
+                with lock:
+                    result.errors.append(f"{type(e).__name__}: {e}")
+        with lock:
+            result.http_requests += state.client.requests
+
+    cpu_before = cpu_seconds() if cpu_seconds else None
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"bench-{name}") as executor:
+        for future in [executor.submit(client_thread, index) for index in range(concurrency)]:
+            future.result()
+    result.wall_seconds = time.perf_counter() - start
+    if queued_count is not None:
+        missing = wait_for_audio(result.audio_expected, queued_count, options.audio_wait_seconds, unpublished_clips)
+        result.audio_missing = sum(missing.values())
+        result.audio_errors = [audio_error(mount, count, result.audio_expected[mount]) for mount, count in missing.items()]
+        if unpublished_clips is not None and result.audio_expected:
+            result.audio_unpublished = unpublished_clips()
+            if result.audio_unpublished:
+                result.audio_errors.append(unpublished_error(result.audio_unpublished, options.audio_wait_seconds))
+        result.audio_wait_seconds = time.perf_counter() - start - result.wall_seconds
+    cpu_after = cpu_seconds() if cpu_seconds else None
+    if cpu_before is not None and cpu_after is not None:
+        result.server_cpu_seconds = cpu_after - cpu_before
+    return result
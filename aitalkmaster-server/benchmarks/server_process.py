@@ -0,0 +1,200 @@
+"""
+Runs the server under test against the fake backends.
+
+BenchmarkBackends starts one fake per backend. ServerProcess writes a config.yml pointing at
+them into a scratch directory and starts ai_talkmaster.py there in a subprocess, so logs and
+generated audio stay out of the working tree and the server runs exactly as in production.
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+import yaml
+
+from benchmarks.fake_backends import FakeBehaviour, FakeOllama, FakeOpenAI, FakeKokoro, FakeLiquidsoap, FakeIcecast
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+SERVER_SCRIPT = SERVER_DIR / "ai_talkmaster.py"
+
+CHAT_MODEL = "bench-model"
+AUDIO_MODEL = "kokoro"
+AUDIO_VOICES = ["af_bench", "am_bench"]
+
+@dataclass
+class BenchmarkSetup:
+    """Backends and server settings of a benchmark run"""
+    chat_backend: str = "ollama"  # ollama or openai
+    audio: bool = True
+    streaming_tts: bool = False
+    num_workers: int = 4
+    num_audio_workers: int = 4
+    chat_concurrency: int = 64
+    audio_concurrency: int = 16
+    port: int = 6100
+    # Reply length and pacing of the fake chat models
+    words: int = 40
+    seconds_per_word: float = 0.0
+    llm: FakeBehaviour = field(default_factory=lambda: FakeBehaviour(latency_seconds=0.5, jitter_seconds=0.1))
+    tts: FakeBehaviour = field(default_factory=lambda: FakeBehaviour(latency_seconds=0.3, jitter_seconds=0.05))
+    liquidsoap: FakeBehaviour = field(default_factory=lambda: FakeBehaviour(latency_seconds=0.005))
+    icecast: FakeBehaviour = field(default_factory=FakeBehaviour)
+    # Extra server settings merged into the server section of the config, e.g. {"tracing": {"slow_seconds": 5}}
+    server_overrides: dict = field(default_factory=dict)
+
+class BenchmarkBackends:
+    """The fake backends of a setup, started and stopped together"""
+
+    def __init__(self, setup: BenchmarkSetup):
+        self.setup = setup
+        if setup.chat_backend == "openai":
+            self.chat = FakeOpenAI([CHAT_MODEL], AUDIO_VOICES, words=setup.words, seconds_per_word=setup.seconds_per_word, behaviour=setup.llm)
+        else:
+            self.chat = FakeOllama([CHAT_MODEL], words=setup.words, seconds_per_word=setup.seconds_per_word, behaviour=setup.llm)
+        self.icecast = FakeIcecast(behaviour=setup.icecast)
+        self.liquidsoap = FakeLiquidsoap(icecast=self.icecast, behaviour=setup.liquidsoap)
+        self.tts = FakeKokoro([AUDIO_MODEL], AUDIO_VOICES, behaviour=setup.tts) if setup.audio else None
+
+    def all(self) -> list:
+        return [fake for fake in (self.chat, self.tts, self.liquidsoap, self.icecast) if fake is not None]
+
+    def __enter__(self) -> "BenchmarkBackends":
+        for fake in self.all():
+            fake.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        for fake in self.all():
+            fake.stop()
+
+    def get_stats(self) -> dict:
+        return {fake.name: fake.get_stats() for fake in self.all()}
+
+def build_config(setup: BenchmarkSetup, backends: BenchmarkBackends, workdir: Path) -> dict:
+    """config.yml of the server under test"""
+    server = {
+        "host": "127.0.0.1",
+        "port": setup.port,
+        "log_file": str(workdir / "logfile.txt"),
+        "llm_log_file": str(workdir / "llm_logfile.txt"),
+        "num_workers": setup.num_workers,
+        "num_audio_workers": setup.num_audio_workers,
+        "concurrency": {"chat": setup.chat_concurrency, "audio": setup.audio_concurrency},
+        # The load comes from one address, the rate limit would only measure itself
+        "usage": {"use_rate_limit": False, "rate_limit_xForwardedFor": False, "rate_limit_per_day": 1000000, "audio_cost_per_second": 100},
+        "logging": {"stdout": False},
+        "tracing": {"slow_log_file": str(workdir / "slow_logfile.txt")}
+    }
+    for key, value in setup.server_overrides.items():
+        if isinstance(value, dict) and isinstance(server.get(key), dict):
+            server[key] = {**server[key], **value}
+        else:
+            server[key] = value
+
+    config = {"server": server, "aitalkmaster": {"join_key_keep_alive_list": [], "streaming_tts": setup.streaming_tts}}
+    if setup.chat_backend == "openai":
+        key_file = workdir / "openai-key.txt"
+        key_file.write_text("benchmark-key")
+        config["chat_client"] = {"mode": "openai", "key_file": str(key_file), "base_url": backends.chat.url + "/v1",
+                                 "default_model": CHAT_MODEL, "allowed_models": [CHAT_MODEL]}
+    else:
+        config["chat_client"] = {"mode": "ollama", "base_url": backends.chat.url,
+                                 "default_model": CHAT_MODEL, "allowed_models": [CHAT_MODEL]}
+
+    if setup.audio:
+        config["audio_client"] = {
+            "mode": "kokoro", "base_url": backends.tts.url + "/v1",
+            "default_voice": AUDIO_VOICES[0], "default_model": AUDIO_MODEL,
+            "allowed_voices": AUDIO_VOICES, "allowed_models": [AUDIO_MODEL],
+            # The fake returns MP3 in exactly this profile, so no ffmpeg conversion runs
+            "output_profile": {"request_format": "mp3", "sample_rate": 22050, "channels": 1, "bitrate": "32k"}
+        }
+        config["liquidsoap_client"] = {"host": backends.liquidsoap.host, "http_port": backends.liquidsoap.port}
+        config["icecast_client"] = {
+            "host": backends.icecast.host, "port": backends.icecast.port, "admin_password": "password",
+            "aitalkmaster_stream_endpoint_prefix": f"http://127.0.0.1:{setup.port}/ait/stream/",
+            "translation_stream_endpoint_prefix": f"http://127.0.0.1:{setup.port}/translation/stream/"
+        }
+    return config
+
+class ServerProcess:
+    """ai_talkmaster.py in a subprocess with its own scratch directory"""
+
+    def __init__(self, setup: BenchmarkSetup, backends: BenchmarkBackends, keep_workdir: bool = False):
+        self.setup = setup
+        self.backends = backends
+        self.keep_workdir = keep_workdir
+        self.workdir = Path(tempfile.mkdtemp(prefix="aitalkmaster-bench-"))
+        self.process: Optional[subprocess.Popen] = None
+        self._output = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.setup.port}"
+
+    def start(self, timeout_seconds: float = 60.0):
+        config = build_config(self.setup, self.backends, self.workdir)
+        # The config validation of the server writes to ./logs/config_logfile.txt
+        (self.workdir / "logs").mkdir(exist_ok=True)
+        (self.workdir / "config.yml").write_text(yaml.safe_dump(config, sort_keys=False))
+        self._output = open(self.workdir / "server_output.txt", "w")
+        self.process = subprocess.Popen([sys.executable, str(SERVER_SCRIPT)], cwd=self.workdir, stdout=self._output, stderr=subprocess.STDOUT)
+        deadline = time.time() + timeout_seconds
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Server exited with {self.process.returncode}, see {self.workdir / 'server_output.txt'}")
+            try:
+                with urllib.request.urlopen(self.base_url + "/statusAitalkmaster", timeout=1) as response:
+                    if response.status == 200:
+                        return
+            except OSError:
+                time.sleep(0.2)
+        self.stop()
+        raise RuntimeError(f"Server did not answer within {timeout_seconds}s, see {self.workdir / 'server_output.txt'}")
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        if self._output is not None:
+            self._output.close()
+        if not self.keep_workdir:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def __enter__(self) -> "ServerProcess":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def unpublished_clips(self) -> int:
+        """Audio clips the server has sequenced but not yet published to Liquidsoap, from its /metrics"""
+        with urllib.request.urlopen(self.base_url + "/metrics", timeout=10) as response:
+            for line in response.read().decode().splitlines():
+                if line.startswith("ait_unpublished_clips "):
+                    return int(float(line.split()[1]))
+        return 0
+
+    def cpu_seconds(self) -> Optional[float]:
+        """User plus system CPU time of the server process so far, None where /proc is not available"""
+        if self.process is None:
+            return None
+        try:
+            with open(f"/proc/{self.process.pid}/stat") as stat_file:
+                # The command name may contain spaces, the fields after it are space separated
+                fields = stat_file.read().rsplit(")", 1)[1].split()
+        except OSError:
+            return None
+        # utime and stime are fields 14 and 15 of /proc/<pid>/stat, counted after the command name from field 3
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
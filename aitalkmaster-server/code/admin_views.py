@@ -0,0 +1,47 @@
+import secrets
+from typing import Optional
+
+from fastapi import Request
+from fastapi.responses import JSONResponse
+
+from code.shared import app, config
+from code.tracing import tracer
+
+def request_token(fastapi_request: Request) -> str:
+    """Token of X-Admin-Token, or of an Authorization: Bearer header as sent by Prometheus"""
+    token = fastapi_request.headers.get("X-Admin-Token", "")
+    authorization = fastapi_request.headers.get("Authorization", "")
+    if not token and authorization.lower().startswith("bearer "):
+        token = authorization[len("bearer "):].strip()
+    return token
+
+def admin_token_error(fastapi_request: Request) -> Optional[JSONResponse]:
+    """403 response unless the request carries the configured admin token"""
+    if not config.server.admin_token:
+        return JSONResponse(
+            status_code=403,
+            content={"error": "Admin endpoints are disabled, set server.admin_token to enable them"}
+        )
+    token = request_token(fastapi_request)
+    if not secrets.compare_digest(token.encode(), config.server.admin_token.encode()):
+        return JSONResponse(
+            status_code=403,
+            content={"error": "Invalid admin token"}
+        )
+    return None
+
+@app.get("/admin/traces")
+def get_traces(fastapi_request: Request, limit: int = 50, min_seconds: float = 0.0):
+    """Stage timings of the most recent finished jobs, newest first"""
+    error = admin_token_error(fastapi_request)
+    if error is not None:
+        return error
+
+    return JSONResponse(
+        status_code=200,
+        content={
+            "stats": tracer.get_stats(),
+            "slow_seconds": config.server.tracing.slow_seconds,
+            "traces": tracer.get_recent(max(limit, 0), min_seconds)
+        }
+    )
@@ -1,10 +1,14 @@
-from typing import Optional
+from typing import Optional, Any
 from datetime import datetime
 from pathlib import Path
 from mutagen.mp3 import MP3
+import re
 import time
+import threading
+import asyncio
 from dataclasses import dataclass
 from code.shared import log
+from code.context_manager import Transcript, ContextManager, estimate_tokens
 
 def time_str():
     return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -47,10 +51,27 @@ class AssistantResponse:
         if self.timestamp is None:
             self.timestamp = time.time()
 
+@dataclass
+class AudioClipJob:
+    """A line of an AI Talkmaster instance on its way through the TTS and publish pipeline stages"""
+    ait_instance: Any  # AitalkmasterInstance
+    sequence_number: int
+    full_name: str
+    filename: str
+    text: str
+    name: str
+    audio_voice: str
+    audio_model: str
+    audio_instructions: str
+    ip_address: str
+    response_id: Optional[str] = None  # set for responses to postMessage, None for generateAudio
+    failed: bool = False
+    trace: Any = None  # JobTrace of the job that queued the clip, held open until the clip is published
+
 class AitalkmasterInstance:
     """Simplified AitalkmasterInstance class using message classes for better readability"""
     
-    def __init__(self, join_key: str):
+    def __init__(self, join_key: str, sequence_start: int = 0):
         self.join_key = join_key
         self.created_at = time.time()
         self.last_listened_at = time.time()
@@ -58,14 +79,40 @@ class AitalkmasterInstance:
         # Lists of message objects for better readability
         self.user_messages: list[UserMessage] = []
         self.assistant_responses: list[AssistantResponse] = []
+
+        # Indexes next to the ordered lists, polls and duplicate checks should not scan the whole conversation
+        self.user_messages_by_id: dict[str, UserMessage] = {}
+        self.assistant_responses_by_id: dict[str, AssistantResponse] = {}
+        # Ids of queued requests, a request with the same id is refused until they are processed
+        self.reserved_message_ids: set[str] = set()
+        self._message_id_lock = threading.Lock()
+
+        # Dialog for the chat model, maintained as messages are added
+        self.transcript = Transcript()
+        self.context = ContextManager(self.transcript, f"join_key {join_key}")
         
         # Audio sequence counter for this instance
-        self.audio_sequence_counter = 0
+        # AIT messages and generateAudio requests for the same join_key run on different queues, so the counter needs a lock
+        self.audio_sequence_counter = sequence_start
+        self._sequence_lock = threading.Lock()
+
+        # Clips are synthesized in parallel but published to liquidsoap strictly in sequence order
+        self.next_publish_sequence = sequence_start + 1
+        self.pending_publish: dict[int, Optional[AudioClipJob]] = {}
+        self.publish_lock = asyncio.Lock()
+
+        # Files of this instance, the archive job of a reset moves them once the clips are published
+        self.clip_files: list[str] = []
+        self.merged_filename = f'./generated-audio/aitalkmaster/active/{join_key}/merged_conversation_{join_key}.mp3'
+        # Published clips are appended to the merged file from a worker thread while a reset can move it aside
+        self.merge_lock = threading.Lock()
 
     def addUserMessage(self, message: str, name: str, message_id: str):
         """Add a user message to the conversation"""
         user_msg = UserMessage(message=message, name=name, message_id=message_id)
         self.user_messages.append(user_msg)
+        self.user_messages_by_id[message_id] = user_msg
+        self.transcript.append("user", f"{name}: {message}")
 
     def addResponse(self, response: str, name: str, response_id: str, filename: str):
         """Add an assistant response to the conversation"""
@@ -76,71 +123,147 @@ class AitalkmasterInstance:
             filename=filename
         )
         self.assistant_responses.append(assistant_resp)
+        self.assistant_responses_by_id[response_id] = assistant_resp
+        self.transcript.append("assistant", f"{name}: {response}")
 
     def contains_message_id(self, message_id: str) -> bool:
         """Check if a message ID already exists in user messages"""
-        for user_msg in self.user_messages:
-            if user_msg.message_id == message_id:
-                return True
-        return False
+        return message_id in self.user_messages_by_id
+
+    def reserve_message_ids(self, message_ids: list[str]) -> Optional[int]:
+        """Reserve the message and response ids of a request before it is queued
+
+        Returns:
+            The index of the first id that is already used, reserved or repeated, None if all were reserved
+        """
+        with self._message_id_lock:
+            for index, message_id in enumerate(message_ids):
+                if (message_id in self.reserved_message_ids or message_id in message_ids[:index]
+                        or message_id in self.user_messages_by_id or message_id in self.assistant_responses_by_id):
+                    return index
+            self.reserved_message_ids.update(message_ids)
+            return None
+
+    def release_message_ids(self, message_ids: list[str]):
+        """Release the ids of a processed request, its messages and responses hold them from now on"""
+        with self._message_id_lock:
+            self.reserved_message_ids.difference_update(message_ids)
+
+    def get_response(self, response_id: str) -> Optional[AssistantResponse]:
+        """Get the assistant response for a response ID"""
+        return self.assistant_responses_by_id.get(response_id)
     
-    def getDialog(self):
-        """Get complete dialog including both user messages and assistant responses in chronological order"""
-        dialog = []
-        
-        # Combine user messages and assistant responses in chronological order
-        all_messages = []
-        
-        # Add user messages
-        for user_msg in self.user_messages:
-            all_messages.append({
-                "timestamp": user_msg.timestamp,
-                "role": "user",
-                "content": f"{user_msg.name}: {user_msg.message}",
-                "message_id": user_msg.message_id
-            })
-        
-        # Add assistant responses
-        for assistant_resp in self.assistant_responses:
-            all_messages.append({
-                "timestamp": assistant_resp.timestamp,
-                "role": "assistant", 
-                "content": f"{assistant_resp.name}: {assistant_resp.response}",
-                "response_id": assistant_resp.response_id
-            })
-        
-        # Sort by actual timestamp to maintain chronological order
-        all_messages.sort(key=lambda x: x["timestamp"])
-        
-        # Return only the role and content for chat model compatibility
-        for msg in all_messages:
-            dialog.append({
-                "role": msg["role"],
-                "content": msg["content"]
-            })
+    def getPromptDialog(self, model: str, ip_address: str, system_instructions: str = "") -> list[dict]:
+        """Get the dialog within the context budget of the model, older messages are replaced by a summary charged to ip_address"""
+        return self.context.build_messages(model, ip_address, estimate_tokens(system_instructions))
+
+    def getDialog(self) -> list[dict]:
+        """Get complete dialog including both user messages and assistant responses in chronological order
         
-        return dialog
+        The returned list is the maintained transcript, it must not be modified.
+        """
+        return self.transcript.messages
 
     def set_audio_created_at(self, response_id: str, timestamp: float):
         """Set the audio creation timestamp for a specific response"""
-        for assistant_resp in self.assistant_responses:
-            if assistant_resp.response_id == response_id:
-                assistant_resp.audio_created_at = timestamp
-                break
+        assistant_resp = self.assistant_responses_by_id.get(response_id)
+        if assistant_resp is not None:
+            assistant_resp.audio_created_at = timestamp
 
     def generate_sequence_str(self) -> str:
         """Generate a sequence string for audio files with leading zeros for proper sorting"""
         # Increment sequence counter for this instance
-        self.audio_sequence_counter += 1
-        sequence_number = self.audio_sequence_counter
+        with self._sequence_lock:
+            self.audio_sequence_counter += 1
+            sequence_number = self.audio_sequence_counter
         
         # Format sequence number with leading zeros for proper sorting (e.g., 001, 002, 003)
         sequence_str = f"{sequence_number:03d}"
         return sequence_str
 
+    def add_clip_file(self, full_name: str):
+        """Record the file of a clip, so the archive job finds clips written after the reset"""
+        with self._sequence_lock:
+            self.clip_files.append(full_name)
+
+    def archive_files(self) -> list[str]:
+        """Clip files and merged file of this instance that exist"""
+        with self._sequence_lock:
+            files = list(self.clip_files)
+        with self.merge_lock:
+            files.append(self.merged_filename)
+        return [file_name for file_name in files if Path(file_name).exists()]
+
+    def retire_merged_file(self, archived_filename: str):
+        """Move the merged file aside on a reset, clips published later are appended to the moved file"""
+        with self.merge_lock:
+            if Path(self.merged_filename).exists():
+                Path(self.merged_filename).rename(archived_filename)
+            self.merged_filename = archived_filename
+
+    def unpublished_clip_count(self) -> int:
+        """Clips with a sequence number of this instance that have not been published or skipped yet"""
+        with self._sequence_lock:
+            return self.audio_sequence_counter - self.next_publish_sequence + 1
+
+    def has_unpublished_clips(self) -> bool:
+        """True while clips with a sequence number of this instance have not been published or skipped yet"""
+        return self.unpublished_clip_count() > 0
+
+    def complete_sequence(self, sequence_number: int, job: Optional[AudioClipJob]) -> list[AudioClipJob]:
+        """Record a finished clip and return the clips that can now be published in sequence order.
+        
+        Failed clips are recorded as None, so they do not hold back the clips after them.
+        Must be called while holding publish_lock.
+        """
+        self.pending_publish[sequence_number] = job
+        ready = []
+        while self.next_publish_sequence in self.pending_publish:
+            ready_job = self.pending_publish.pop(self.next_publish_sequence)
+            if ready_job is not None:
+                ready.append(ready_job)
+            self.next_publish_sequence += 1
+        return ready
+
     def __str__(self):
         return str(self.getDialog())
 
+class SentenceSplitter:
+    """Cuts a streamed LLM response into sentences for sentence-level TTS.
+
+    A sentence is only emitted once the next sentence has started, so the last sentence
+    of the response always stays in the buffer until flush(). Very short sentences
+    (e.g. "Hi.") are joined with the next one to avoid many tiny clips.
+    """
+    SENTENCE_END = re.compile(r'[.!?…]+["\')\]]*\s+(?=\S)|\n+(?=\S)')
+
+    def __init__(self, min_length: int = 20):
+        self.min_length = min_length
+        self.buffer = ""
+        self._scan_from = 0
+
+    def feed(self, delta: str) -> list[str]:
+        """Add streamed text and return the sentences that are complete"""
+        self.buffer += delta
+        sentences = []
+        start = 0
+        for match in self.SENTENCE_END.finditer(self.buffer, self._scan_from):
+            if match.end() - start < self.min_length:
+                continue
+            sentences.append(self.buffer[start:match.end()].strip())
+            start = match.end()
+        self.buffer = self.buffer[start:]
+        # A boundary needs the first character of the next sentence, rescan the tail on the next feed
+        self._scan_from = max(0, len(self.buffer) - 8)
+        return sentences
+
+    def flush(self) -> str:
+        """Return the remaining text at the end of the stream"""
+        remainder = self.buffer.strip()
+        self.buffer = ""
+        self._scan_from = 0
+        return remainder
+
 def remove_name(message: str, charactername: str):
     if message.lower().startswith(f"{charactername.lower()}: "):
         message = message[len(charactername)+2:]
@@ -1,23 +1,31 @@
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi import Request
+import asyncio
 import time
 from pathlib import Path
-import shutil
+import threading
 from datetime import datetime
 from mutagen.easyid3 import EasyID3
-from mutagen.mp3 import MP3
+from mutagen.id3 import ID3NoHeaderError
 
 import traceback
-
-from code.config import ChatClientMode, AudioClientMode
-from code.aitalkmaster_utils import AitalkmasterInstance, remove_name
-from code.audio_utils import start_aitalkmaster_stream, queue_aitalkmaster_audio
-from code.request_models import AitPostMessageRequest, AitResetJoinkeyRequest, AitGenerateAudioRequest, AitStartConversationRequest
-from code.validation_decorators import validate_chat_model_decorator, validate_audio_decorator, rate_limit_decorator, validate_join_key_decorator
-from code.shared import app, config, log, llm_log
-from pydub import AudioSegment
+from typing import Optional
+
+from code.config import ChatClientMode
+from code.aitalkmaster_utils import AitalkmasterInstance, AudioClipJob, SentenceSplitter, remove_name
+from code.audio_utils import start_aitalkmaster_stream, queue_aitalkmaster_audio, save_audio, mp3_audio_frames
+from code.request_models import AitPostMessageRequest, AitPostMessagesRequest, AitSceneMessageRequest, AitResetJoinkeyRequest, AitGenerateAudioRequest, AitStartConversationRequest
+from code.validation_decorators import validate_chat_model_decorator, validate_audio_decorator, rate_limit_decorator, validate_join_key_decorator, validate_callback_url_decorator, validate_batch_decorator, join_key_error, callback_url_error, chat_model_error, audio_error
+from code.webhook_delivery import webhooks
+from code.shared import app, config, log, llm_log, log_enabled
 from code.openai_response import CharacterResponse
-import io
+from code.async_engine import async_engine
+from code.metrics import LLM_LATENCY, LLM_ERRORS, timed_call
+from code.tracing import trace_stage, current_trace, activate_trace, release_trace
+from code.archive_jobs import archive_jobs
+from code.pipeline import PipelineStage
+from code.notifications import notifications, ait_channel, event_stream
+from code.chat_request import ollama_chat_messages, ollama_cache_kwargs, openai_cache_kwargs, record_ollama_usage, record_openai_usage
 from code.rate_limiter import get_ip_address_for_rate_limit, increment_resource_usage
 from code.message_queue import queue_message_request, RequestType, queue_audio_generation_request
 from ollama import ResponseError
@@ -25,159 +33,56 @@ from ollama import ResponseError
 active_aitalkmaster_instances = {}
 finished_aitalkmaster_instances = []
 
-def save_audio(filename: str, response_msg: str, audio_voice: str, audio_model: str, audio_instructions: str, ip_address: str):
-    if config.audio_client.mode == AudioClientMode.OPENAI:
-        response = config.get_or_create_openai_audio_client().audio.speech.create(
-            model=audio_model,
-            voice=audio_voice,
-            input=response_msg,
-            instructions=audio_instructions,
-            response_format="mp3",
-            speed=1.0)
-        # the headers do not provide a direct "cost"
-        # we should use the duration of the audio to estimate the cost
-    else:
-        response = config.get_or_create_opensource_audio_client().audio.speech.create(
-            model=audio_model,
-            voice=audio_voice,
-            input=response_msg,
-            instructions=audio_instructions,
-            response_format="mp3",
-            speed=1.0)
-
-    with open(filename, "wb") as f:
-        f.write(response.content)
-
-    # Get audio duration for rate limiting
-    audio = AudioSegment.from_file(io.BytesIO(response.content), format="mp3")
-    duration_seconds = len(audio) / 1000.0  # pydub returns duration in milliseconds
-
-    log(f'duration_seconds: {duration_seconds}')
-    
-    # Use duration as weight for rate limiting (duration in seconds)
-    increment_resource_usage(ip_address, duration_seconds * config.server.usage.audio_cost_per_second)
-
-    output_path = filename
-    audio.export(output_path, format="mp3", codec="libmp3lame", bitrate="128k")
+# Last audio sequence number per join_key, a new instance continues it while the old files are being archived
+last_sequence_numbers = {}
 
+# Request threads and workers can ask for the same join_key at the same time, only one of them may create the instance
+ait_instances_lock = threading.RLock()
 
 def save_metadata(filename: str, name: str, join_key: str):
-    mp3 = MP3(filename)
-    if mp3.tags is None:
-        mp3.add_tags()
-
-    # Use EasyID3 to set metadata
-    tags = EasyID3(filename)
+    try:
+        tags = EasyID3(filename)
+    except ID3NoHeaderError:
+        # Provider MP3s stored as is may have no ID3 header yet
+        tags = EasyID3()
     tags["title"] = join_key
     tags["artist"] = "AIT " + name
     tags["album"] = join_key
     tags["genre"] = "Speech"
-    tags.save()
-
-def merge_audio_files(join_key: str):
-    """Merge all audio files from a conversation directory into a single file"""
-    try:
-        # Get the directory path for this join_key (use aitalkmaster-specific directory)
-        audio_dir = Path(f'./generated-audio/aitalkmaster/active/{join_key}')
-        
-        if not audio_dir.exists():
-            log(f'No audio directory found for join_key: {join_key}')
-            return False
-        
-        # Find all MP3 files in the directory, excluding the merged file itself
-        audio_files = []
-        for file_path in audio_dir.iterdir():
-            if file_path.is_file() and file_path.suffix.lower() == '.mp3':
-                # Skip the merged file if it already exists
-                if not file_path.name.startswith('merged_conversation_'):
-                    audio_files.append(str(file_path))
-        
-        if not audio_files:
-            log(f'No audio files found in directory for join_key: {join_key}')
-            return False
-        
-        # Sort files by their sequence number (filename contains sequence)
-        audio_files.sort()
-        
-        # Create merged audio file path
-        merged_filename = f'./generated-audio/aitalkmaster/active/{join_key}/merged_conversation_{join_key}.mp3'
-        
-        # Load and concatenate all audio files
-        combined_audio = AudioSegment.empty()
-        
-        for audio_file in audio_files:
-            try:
-                audio_segment = AudioSegment.from_mp3(audio_file)
-                combined_audio += audio_segment
-                log(f'Added audio file to merge: {audio_file}')
-            except Exception as e:
-                log(f'Error loading audio file {audio_file}: {e}')
-                continue
-        
-        if len(combined_audio) == 0:
-            log(f'No valid audio content found for merge in join_key: {join_key}')
-            return False
-        
-        # Export the merged audio file
-        combined_audio.export(merged_filename, format="mp3", bitrate="192k")
-        
-        # Add metadata to the merged file
-        save_metadata(merged_filename, "AI Talkmaster", join_key)
-        
-        log(f'Successfully merged {len(audio_files)} audio files into: {merged_filename}')
-        log(f'Merged audio duration: {len(combined_audio) / 1000.0:.2f} seconds')
-        
-        return True
-        
-    except Exception as e:
-        log(f'Error merging audio files for {join_key}: {e}')
-        return False
+    tags.save(filename)
 
-def move_audio_files_to_inactive(join_key: str):
-    """Move audio files from active to inactive folder when conversation is reset"""
-    try:
-        # Create inactive directory structure
-        inactive_base_dir = Path('./generated-audio/inactive')
-        inactive_base_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Create date-based subfolder
-        current_date = datetime.now().strftime("%Y%m%d-%H%M%S")
-        inactive_dir = inactive_base_dir / f"{join_key}_{current_date}"
-        inactive_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Source directory (active conversation)
-        active_dir = Path(f'./generated-audio/aitalkmaster/active/{join_key}')
-        
-        if active_dir.exists():
-            # Move all files from active to inactive directory
-            for file_path in active_dir.iterdir():
-                if file_path.is_file():
-                    destination = inactive_dir / file_path.name
-                    shutil.move(str(file_path), str(destination))
-                    log(f'Moved audio file: {file_path} -> {destination}')
-            
-            # We only make the directory empty, removing the active directory itself would stop the audio stream.
-            
-            return True
-        else:
-            log(f'No active directory found for join_key: {join_key}')
-            return False
-            
-    except Exception as e:
-        log(f'Error moving audio files for {join_key}: {e}')
-        return False
-
-def get_response_ollama(request: AitPostMessageRequest, ait_instance: AitalkmasterInstance, ip_address: str) -> str:
-    full_dialog = []
-    full_dialog.append({
-        "role": "system",
-        "content": request.system_instructions  
-    })
-    for d in ait_instance.getDialog():
-        full_dialog.append(d)
+def append_to_merged_audio(ait_instance: AitalkmasterInstance, full_name: str):
+    """Append the audio frames of a published clip to the merged conversation file of the instance.
+    
+    Clips are appended in publish order, so the merged file is always up to date and a reset
+    does not have to decode anything. The merged file gets its tags when it is created.
+    """
+    join_key = ait_instance.join_key
+    with open(full_name, "rb") as f:
+        frames = mp3_audio_frames(f.read())
+
+    # The lock keeps a reset from moving the file aside between the check and the write
+    with ait_instance.merge_lock:
+        merged_filename = ait_instance.merged_filename
+        if not Path(merged_filename).exists():
+            Path(merged_filename).touch()
+            tags = EasyID3()
+            tags["title"] = join_key
+            tags["artist"] = "AIT AI Talkmaster"
+            tags["album"] = join_key
+            tags["genre"] = "Speech"
+            tags.save(merged_filename)
+        with open(merged_filename, "ab") as f:
+            f.write(frames)
+
+async def get_response_ollama(request: AitPostMessageRequest, ait_instance: AitalkmasterInstance, ip_address: str) -> str:
+    full_dialog = ollama_chat_messages(request.system_instructions, ait_instance.getPromptDialog(request.model, ip_address, request.system_instructions))
 
     try:
-        response = config.get_or_create_ollama_chat_client().chat(model=request.model, messages = full_dialog, think=request.think, options=request.options)
+        async with async_engine.limit("chat"):
+            with timed_call(LLM_LATENCY, LLM_ERRORS, backend="ollama", model=request.model):
+                response = await config.get_or_create_ollama_async_chat_client().chat(model=request.model, messages = full_dialog, think=request.think, options=request.options, **ollama_cache_kwargs())
+        record_ollama_usage(full_dialog, response, f"ait:{request.join_key}")
         response_msg = remove_name(response["message"]["content"], request.charactername)
         increment_resource_usage(ip_address, response["eval_count"])
         return response_msg
@@ -187,16 +92,20 @@ def get_response_ollama(request: AitPostMessageRequest, ait_instance: Aitalkmast
         llm_log(error_msg)
         return error_msg
 
-def get_response_openai(request: AitPostMessageRequest, ait_instance: AitalkmasterInstance, ip_address: str) -> str:
+async def get_response_openai(request: AitPostMessageRequest, ait_instance: AitalkmasterInstance, ip_address: str) -> str:
     try:
-        response = config.get_or_create_openai_chat_client().responses.parse(
-            model=request.model,
-            input=ait_instance.getDialog(),
-            instructions=request.system_instructions,
-            text_format=CharacterResponse,
-            store=False
-        )
+        async with async_engine.limit("chat"):
+            with timed_call(LLM_LATENCY, LLM_ERRORS, backend="openai", model=request.model):
+                response = await config.get_or_create_openai_async_chat_client().responses.parse(
+                    model=request.model,
+                    input=ait_instance.getPromptDialog(request.model, ip_address, request.system_instructions),
+                    instructions=request.system_instructions,
+                    text_format=CharacterResponse,
+                    store=False,
+                    **openai_cache_kwargs(f"ait:{request.join_key}")
+                )
 
+        record_openai_usage(response.usage, f"ait:{request.join_key}")
         increment_resource_usage(ip_address, response.usage.total_tokens)
 
         response_msg = remove_name(response.output_parsed.text_response, request.charactername)
@@ -208,6 +117,91 @@ def get_response_openai(request: AitPostMessageRequest, ait_instance: Aitalkmast
         llm_log(error_msg)
         return error_msg
 
+async def stream_response_ollama(request: AitPostMessageRequest, ait_instance: AitalkmasterInstance, ip_address: str):
+    """Yield the response text of the Ollama chat model as it is generated"""
+    full_dialog = ollama_chat_messages(request.system_instructions, ait_instance.getPromptDialog(request.model, ip_address, request.system_instructions))
+
+    stream = await config.get_or_create_ollama_async_chat_client().chat(model=request.model, messages = full_dialog, think=request.think, options=request.options, stream=True, **ollama_cache_kwargs())
+    async for part in stream:
+        if part["message"]["content"]:
+            yield part["message"]["content"]
+        if part["done"]:
+            record_ollama_usage(full_dialog, part, f"ait:{request.join_key}")
+            increment_resource_usage(ip_address, part["eval_count"] or 0)
+
+async def stream_response_openai(request: AitPostMessageRequest, ait_instance: AitalkmasterInstance, ip_address: str):
+    """Yield the response text of the OpenAI model as it is generated.
+    
+    Structured output (CharacterResponse) arrives as partial JSON while streaming, so plain text output is streamed instead.
+    """
+    stream = await config.get_or_create_openai_async_chat_client().responses.create(
+        model=request.model,
+        input=ait_instance.getPromptDialog(request.model, ip_address, request.system_instructions),
+        instructions=request.system_instructions,
+        store=False,
+        stream=True,
+        **openai_cache_kwargs(f"ait:{request.join_key}")
+    )
+    async for event in stream:
+        if event.type == "response.output_text.delta":
+            yield event.delta
+        elif event.type == "response.completed":
+            record_openai_usage(event.response.usage, f"ait:{request.join_key}")
+            increment_resource_usage(ip_address, event.response.usage.total_tokens)
+
+async def get_response_streaming(request: AitPostMessageRequest, ait_instance: AitalkmasterInstance, ip_address: str) -> str:
+    """Stream the chat response and hand each sentence to the TTS stage as soon as it is complete.
+    
+    The response is added to the instance before the last sentence is queued, so the last clip
+    carries the response_id and sets audio_created_at when it is published.
+    """
+    if config.chat_client.mode == ChatClientMode.OPENAI:
+        backend = "openai"
+        stream = stream_response_openai(request, ait_instance, ip_address)
+    else:
+        backend = "ollama"
+        stream = stream_response_ollama(request, ait_instance, ip_address)
+
+    splitter = SentenceSplitter()
+    sentences = []
+
+    async def queue_sentence(sentence: str, response_id: Optional[str] = None):
+        if not sentences:
+            # The model tends to prefix its answer with the character name, as in the non-streaming responses
+            sentence = remove_name(sentence, request.charactername).strip()
+        if not sentence:
+            return
+        sentences.append(sentence)
+        await queue_clip(build_clip_job(request, ait_instance, sentence, ip_address, response_id))
+
+    try:
+        async with async_engine.limit("chat"):
+            with timed_call(LLM_LATENCY, LLM_ERRORS, backend=backend, model=request.model):
+                async for delta in stream:
+                    for sentence in splitter.feed(delta):
+                        await queue_sentence(sentence)
+        remainder = splitter.flush()
+    except Exception as e:
+        remainder = f"ResponseError: {str(e)}"
+        log(remainder)
+        llm_log(remainder)
+
+    if not sentences:
+        remainder = remove_name(remainder, request.charactername).strip()
+    response_msg = " ".join(sentences + [remainder]).strip()
+
+    ait_instance.addResponse(response_msg, request.charactername, response_id=request.message_id, filename=None)
+    publish_response_event(request, response_msg)
+    if remainder:
+        await queue_sentence(remainder, response_id=request.message_id)
+    return response_msg
+
+def publish_response_event(request: AitPostMessageRequest, response: str):
+    """Wake the long-poll requests waiting for this response, tell the event stream of the join_key and the callback_url"""
+    event = {"type": "response", "join_key": request.join_key, "message_id": request.message_id, "name": request.charactername, "response": response}
+    notifications.publish(ait_channel(request.join_key), request.message_id, event)
+    webhooks.deliver(request.callback_url, event)
+
 def build_filename(request: AitPostMessageRequest, ait_instance: AitalkmasterInstance):
     # Create subdirectory for the join_key in aitalkmaster folder
     join_key_dir = Path(f'./generated-audio/aitalkmaster/active/{request.join_key}')
@@ -218,29 +212,141 @@ def build_filename(request: AitPostMessageRequest, ait_instance: AitalkmasterIns
     filename = f'{sequence_str}_{request.charactername}_{request.message_id}_{request.audio_voice}.mp3'
 
     full_name = f'./generated-audio/aitalkmaster/active/{request.join_key}/{filename}'
-    return full_name, filename
+    ait_instance.add_clip_file(full_name)
+    return full_name, filename, int(sequence_str)
+
+def build_clip_job(request: AitPostMessageRequest, ait_instance: AitalkmasterInstance, text: str, ip_address: str, response_id: Optional[str]) -> AudioClipJob:
+    """Clip of a character line, this takes its sequence number, so the job must reach queue_clip or skip_clip"""
+    full_name, filename, sequence_number = build_filename(request, ait_instance)
+    return AudioClipJob(
+        ait_instance=ait_instance,
+        sequence_number=sequence_number,
+        full_name=full_name,
+        filename=filename,
+        text=text,
+        name=request.charactername,
+        audio_voice=request.audio_voice or "",
+        audio_model=request.audio_model or "",
+        audio_instructions=request.audio_instructions or "",
+        ip_address=ip_address,
+        response_id=response_id
+    )
+
+async def queue_clip(job: AudioClipJob):
+    """Hand a clip to the TTS stage, the trace of the current job stays open until the clip is published"""
+    job.trace = current_trace()
+    if job.trace is not None:
+        job.trace.hold()
+    try:
+        await tts_stage.put(job)
+    except BaseException:
+        # Cancelled while the TTS stage was full, the clip never reaches the publish stage
+        release_trace(job.trace, f'audio clip {job.filename} was not queued')
+        await skip_clip(job)
+        raise
+
+async def skip_clip(job: AudioClipJob):
+    """Give up the sequence number of a clip that will not be synthesized, so the clips after it are not held back"""
+    job.failed = True
+    # Shielded, a cancelled job must still release its sequence number
+    await asyncio.shield(publish_ready(job.ait_instance, job.sequence_number, None))
+
+async def add_response_with_clip(request: AitPostMessageRequest, ait_instance: AitalkmasterInstance, response_msg: str, ip_address: str):
+    """Add a response, tell the clients about it and hand its clip to the pipeline"""
+    job = build_clip_job(request, ait_instance, response_msg, ip_address, request.message_id) if config.audio_client is not None else None
+    try:
+        # The response is visible to /ait/getMessageResponse from here on, the audio follows through the pipeline
+        ait_instance.addResponse(response_msg, request.charactername, response_id=request.message_id, filename=job.filename if job is not None else None)
+        publish_response_event(request, response_msg)
+    except BaseException:
+        if job is not None:
+            await skip_clip(job)
+        raise
+    if job is not None:
+        await queue_clip(job)
+
+async def synthesize_clip(job: AudioClipJob):
+    """TTS stage: synthesize and store the clip, then hand it to the publish stage"""
+    with activate_trace(job.trace):
+        try:
+            await save_audio(job.full_name, job.text, job.audio_voice, job.audio_model, job.audio_instructions, job.ip_address)
+        except Exception as e:
+            log(f'exception in TTS stage for {job.filename}: {e}')
+            job.failed = True
+    # Failed clips are published as well, so the clips after them are not held back
+    await publish_stage.put(job)
+
+async def publish_clip(job: AudioClipJob):
+    """Publish stage: tag the clip and queue it to liquidsoap in sequence order"""
+    if not job.failed:
+        try:
+            with activate_trace(job.trace), trace_stage("metadata"):
+                await asyncio.to_thread(save_metadata, job.full_name, job.name, job.ait_instance.join_key)
+        except Exception as e:
+            log(f'exception in publish stage while tagging {job.filename}: {e}')
+            job.failed = True
+    if job.failed:
+        # Failed clips are skipped by complete_sequence, their trace ends here
+        release_trace(job.trace, f'audio clip {job.filename} failed')
+
+    await publish_ready(job.ait_instance, job.sequence_number, None if job.failed else job)
+
+async def publish_ready(ait_instance: AitalkmasterInstance, sequence_number: int, job: Optional[AudioClipJob]):
+    """Record the clip of a sequence number, None if there is none, and publish the clips that are now in sequence"""
+    async with ait_instance.publish_lock:
+        for ready_job in ait_instance.complete_sequence(sequence_number, job):
+            # The jobs are already taken out of the sequence, an error with one of them must not drop the others
+            try:
+                with activate_trace(ready_job.trace):
+                    with trace_stage("liquidsoap"):
+                        await asyncio.to_thread(queue_aitalkmaster_audio, ait_instance.join_key, ready_job.filename)
+                    try:
+                        with trace_stage("merge"):
+                            await asyncio.to_thread(append_to_merged_audio, ait_instance, ready_job.full_name)
+                    except Exception as e:
+                        log(f'Error appending {ready_job.filename} to the merged audio of {ait_instance.join_key}: {e}')
+            except Exception as e:
+                log(f'Error publishing {ready_job.filename} to {ait_instance.join_key}: {e}')
+                release_trace(ready_job.trace, f'publishing audio clip {ready_job.filename} failed')
+                continue
+            release_trace(ready_job.trace)
+            if ready_job.response_id is not None:
+                ait_instance.set_audio_created_at(ready_job.response_id, time.time())
+            notifications.publish(ait_channel(ait_instance.join_key), None, {"type": "audio", "message_id": ready_job.response_id, "name": ready_job.name, "filename": ready_job.filename})
+
+# The LLM stage is the queued job itself, TTS and publishing run in their own stages
+tts_stage = PipelineStage("AitTtsStage", synthesize_clip, config.server.pipeline.tts_workers, config.server.pipeline.tts_queue_size)
+publish_stage = PipelineStage("AitPublishStage", publish_clip, config.server.pipeline.publish_workers, config.server.pipeline.publish_queue_size)
 
 
 def get_or_create_ait_instance(join_key: str) -> AitalkmasterInstance:
-    if join_key in active_aitalkmaster_instances.keys():
-        ait_instance = active_aitalkmaster_instances[join_key]
-    else:
-        reset_aitalkmaster(join_key)
-        ait_instance = AitalkmasterInstance(join_key=join_key)
-        if config.liquidsoap_client is not None:
-            start_aitalkmaster_stream(join_key)
+    with ait_instances_lock:
+        ait_instance = active_aitalkmaster_instances.get(join_key)
+        if ait_instance is not None:
+            return ait_instance
+        # No instance is active, only files left by an earlier server run can be archived
+        _, files = retire_ait_instance(join_key)
+        ait_instance = AitalkmasterInstance(join_key=join_key, sequence_start=last_sequence_numbers.get(join_key, 0))
         active_aitalkmaster_instances[join_key] = ait_instance
+
+    # Journaling the archive job and starting the stream block, they must not hold up the other join_keys
+    archive_jobs.submit(join_key, None, files)
+    if config.liquidsoap_client is not None:
+        start_aitalkmaster_stream(join_key)
     return ait_instance
 
-def process_post_message(request_model: AitPostMessageRequest, ip_address: str):
+async def process_post_message(request_model: AitPostMessageRequest, ip_address: str):
     """Process a postMessage request in the background"""
+    ait_instance = None
     try:
-        data_json = request_model.model_dump()
-        log(f'Processing queued postMessage data: {data_json}')
+        if log_enabled("debug", "requests"):
+            log(f'Processing queued postMessage data: {request_model.model_dump()}', "debug", "requests")
 
         join_key = request_model.join_key
 
-        ait_instance = get_or_create_ait_instance(join_key)
+        # Creating an instance can reset the join_key and starts the stream, both block
+        with trace_stage("instance"):
+            ait_instance = await asyncio.to_thread(get_or_create_ait_instance, join_key)
 
         # Check if message_id already exists (this should have been checked before queuing, but double-check)
         if ait_instance.contains_message_id(request_model.message_id):
@@ -248,40 +354,109 @@ def process_post_message(request_model: AitPostMessageRequest, ip_address: str):
             return
         
         ait_instance.addUserMessage(request_model.message, name=request_model.username, message_id=request_model.message_id)
-        
-        if config.chat_client.mode == ChatClientMode.OPENAI:
-            response_msg = get_response_openai(request_model, ait_instance, ip_address)
-        elif config.chat_client.mode == ChatClientMode.OLLAMA:
-            response_msg = get_response_ollama(request_model, ait_instance, ip_address)
-        else:
-            log(f'Error: unknown chat client mode: {config.chat_client.mode}')
-            return
-
-        if config.audio_client is not None:
-            full_name, filename = build_filename(request_model, ait_instance)
-        else:
-            full_name = None
-            filename = None
 
-        ait_instance.addResponse(response_msg, request_model.charactername, response_id=request_model.message_id, filename=filename)
+        if config.aitalkmaster.streaming_tts and config.audio_client is not None:
+            with trace_stage("llm_stream"):
+                response_msg = await get_response_streaming(request_model, ait_instance, ip_address)
+            log(f'{datetime.now().strftime("%Y-%m-%d %H:%M")} ait/postMessage (background, streaming): message: {request_model.message} response: {response_msg}')
+            return
+        
+        with trace_stage("llm"):
+            if config.chat_client.mode == ChatClientMode.OPENAI:
+                response_msg = await get_response_openai(request_model, ait_instance, ip_address)
+            elif config.chat_client.mode == ChatClientMode.OLLAMA:
+                response_msg = await get_response_ollama(request_model, ait_instance, ip_address)
+            else:
+                log(f'Error: unknown chat client mode: {config.chat_client.mode}')
+                return
 
-        if config.audio_client is not None:
-            save_audio(full_name, response_msg, request_model.audio_voice or "", request_model.audio_model or "", request_model.audio_instructions or "", ip_address)
-            save_metadata(full_name, request_model.charactername, join_key)
-            queue_aitalkmaster_audio(join_key, filename)
-            ait_instance.set_audio_created_at(request_model.message_id, time.time())
+        await add_response_with_clip(request_model, ait_instance, response_msg, ip_address)
         
         log(f'{datetime.now().strftime("%Y-%m-%d %H:%M")} ait/postMessage (background): message: {request_model.message} response: {response_msg}')
         
     except Exception as e:
         log(f'exception in process_post_message: {e}')
         log(f'stack: {traceback.print_exc()}')
+    finally:
+        # Reserved by /ait/postMessage, the message and response hold the id from now on
+        if ait_instance is not None:
+            ait_instance.release_message_ids([request_model.message_id])
+
+def scene_message_ids(request_model: AitSceneMessageRequest) -> list[str]:
+    """Id of the user message followed by the response ids of the characters"""
+    return [request_model.message_id] + [character.message_id for character in request_model.characters]
+
+def scene_character_request(request_model: AitSceneMessageRequest, character) -> AitPostMessageRequest:
+    """postMessage request of one character of a scene, so the single message helpers can be reused"""
+    return AitPostMessageRequest(
+        join_key=request_model.join_key,
+        username=request_model.username,
+        message=request_model.message,
+        charactername=character.charactername,
+        message_id=character.message_id,
+        model=character.model,
+        think=character.think,
+        system_instructions=character.system_instructions,
+        audio_voice=character.audio_voice,
+        options=character.options,
+        audio_instructions=character.audio_instructions,
+        audio_model=character.audio_model,
+        callback_url=character.callback_url
+    )
+
+async def get_character_response(request: AitPostMessageRequest, ait_instance: AitalkmasterInstance, ip_address: str) -> str:
+    if config.chat_client.mode == ChatClientMode.OPENAI:
+        return await get_response_openai(request, ait_instance, ip_address)
+    return await get_response_ollama(request, ait_instance, ip_address)
+
+async def process_scene_message(request_model: AitSceneMessageRequest, ip_address: str):
+    """Process a scene message in the background: all characters answer the same dialog concurrently.
+
+    The user message is added once and the chat calls of all characters run in parallel against
+    that dialog, so a scene takes one LLM latency instead of one per character. The responses are
+    added and their clips sequenced in character order, so the stream order does not depend on
+    which model answered first. Scenes always use the non-streaming path.
+    """
+    ait_instance = None
+    try:
+        log(f'Processing queued scene message for {request_model.join_key}: {request_model.message} characters: {[character.charactername for character in request_model.characters]}')
+
+        with trace_stage("instance"):
+            ait_instance = await asyncio.to_thread(get_or_create_ait_instance, request_model.join_key)
+
+        if ait_instance.contains_message_id(request_model.message_id):
+            log(f'Warning: message_id {request_model.message_id} already exists in ait with key {request_model.join_key}')
+            return
+
+        ait_instance.addUserMessage(request_model.message, name=request_model.username, message_id=request_model.message_id)
+
+        character_requests = [scene_character_request(request_model, character) for character in request_model.characters]
+        # No response is added before all calls finished, so every character sees the same dialog
+        with trace_stage("llm"):
+            responses = await asyncio.gather(*(get_character_response(request, ait_instance, ip_address) for request in character_requests), return_exceptions=True)
+
+        for request, response_msg in zip(character_requests, responses):
+            if isinstance(response_msg, Exception):
+                log(f'Error in scene response of {request.charactername}: {response_msg}')
+                response_msg = f"ResponseError: {str(response_msg)}"
+
+            await add_response_with_clip(request, ait_instance, response_msg, ip_address)
+
+        log(f'{datetime.now().strftime("%Y-%m-%d %H:%M")} ait/postSceneMessage (background): message: {request_model.message} responses: {[(request.charactername, response) for request, response in zip(character_requests, responses)]}')
+
+    except Exception as e:
+        log(f'exception in process_scene_message: {e}')
+        log(f'stack: {traceback.print_exc()}')
+    finally:
+        # Reserved by /ait/postSceneMessage until all character responses are added
+        if ait_instance is not None:
+            ait_instance.release_message_ids(scene_message_ids(request_model))
 
-def process_generate_audio(request_model: AitGenerateAudioRequest, ip_address: str):
+async def process_generate_audio(request_model: AitGenerateAudioRequest, ip_address: str):
     """Process a generateAudio request in the background"""
     try:
-        data_json = request_model.model_dump()
-        log(f'Processing queued generateAudio data: {data_json}')
+        if log_enabled("debug", "requests"):
+            log(f'Processing queued generateAudio data: {request_model.model_dump()}', "debug", "requests")
 
         if config.audio_client is None:
             log(f'Error: audio is not available on this AI Talkmaster server')
@@ -289,7 +464,8 @@ def process_generate_audio(request_model: AitGenerateAudioRequest, ip_address: s
 
         join_key = request_model.join_key
 
-        ait_instance = get_or_create_ait_instance(join_key)  # This starts the audio stream if it is not already running
+        with trace_stage("instance"):
+            ait_instance = await asyncio.to_thread(get_or_create_ait_instance, join_key)  # This starts the audio stream if it is not already running
 
         # Create directory for the join_key if it doesn't exist
         join_key_dir = Path(f'./generated-audio/aitalkmaster/active/{request_model.join_key}')
@@ -300,12 +476,20 @@ def process_generate_audio(request_model: AitGenerateAudioRequest, ip_address: s
         # Generate filename with sequence number
         filename = f'{sequence_str}_{request_model.username}_generateAudio_{request_model.audio_voice}.mp3'
         full_name = f'./generated-audio/aitalkmaster/active/{request_model.join_key}/{filename}'
-        
-        save_audio(full_name, request_model.message, request_model.audio_voice or "", request_model.audio_model or "", request_model.audio_instructions or "", ip_address)
-
-        save_metadata(full_name, request_model.username, join_key)
-
-        queue_aitalkmaster_audio(join_key, filename)
+        ait_instance.add_clip_file(full_name)
+        
+        await queue_clip(AudioClipJob(
+            ait_instance=ait_instance,
+            sequence_number=int(sequence_str),
+            full_name=full_name,
+            filename=filename,
+            text=request_model.message,
+            name=request_model.username,
+            audio_voice=request_model.audio_voice or "",
+            audio_model=request_model.audio_model or "",
+            audio_instructions=request_model.audio_instructions or "",
+            ip_address=ip_address
+        ))
         
         log(f'{datetime.now().strftime("%Y-%m-%d %H:%M")} generateAudio (background): message: {request_model.message} -> {filename}')
         
@@ -316,21 +500,32 @@ def process_generate_audio(request_model: AitGenerateAudioRequest, ip_address: s
 
 @app.post("/ait/postMessage")
 @validate_join_key_decorator
+@validate_callback_url_decorator
 @validate_chat_model_decorator
 @validate_audio_decorator
 @rate_limit_decorator
 def postaitMessage(request_model: AitPostMessageRequest, fastapi_request: Request):
     try:
-        data_json = request_model.model_dump()
-        log(f'postMessage data (queued): {data_json}')
+        if log_enabled("debug", "requests"):
+            log(f'postMessage data (queued): {request_model.model_dump()}', "debug", "requests")
 
         join_key = request_model.join_key
 
+        # Extract IP address for rate limiting in background processing
+        ip_address, error = get_ip_address_for_rate_limit(fastapi_request)
+        if error:
+            return JSONResponse(
+                status_code=500,
+                content={
+                    "error": error
+                }
+            )
+
         # Get or create instance to check for duplicate message_id
         ait_instance = get_or_create_ait_instance(join_key)
 
-        # Check if message_id already exists
-        if ait_instance.contains_message_id(request_model.message_id):
+        # The message_id is also the response id, it must not be used or pending in a queued request
+        if ait_instance.reserve_message_ids([request_model.message_id]) is not None:
             return JSONResponse(
                 status_code=400,
                 content={
@@ -339,7 +534,34 @@ def postaitMessage(request_model: AitPostMessageRequest, fastapi_request: Reques
                 }
             )
         
-        # Extract IP address for rate limiting in background processing
+        # Queue the request for background processing
+        queue_message_request(RequestType.AIT, request_model, ip_address, process_post_message)
+        
+        # Return 425 to indicate the request is being processed
+        return JSONResponse(
+            status_code=425,
+            content={
+                "message_id": request_model.message_id,
+                "status": "processing",
+                "info": "Request queued for background processing"
+            }
+        )
+    except Exception as e:
+        log(f'exception in /ait/postMessage: {e}')
+        log(f'stack: {traceback.print_exc()}')
+        return JSONResponse(
+            status_code=500,
+            content=f"Internal server error: {str(e)}"
+        )
+
+@app.post("/ait/postMessages")
+@validate_batch_decorator(join_key_error, callback_url_error, chat_model_error, audio_error)
+@rate_limit_decorator
+def postaitMessages(request_model: AitPostMessagesRequest, fastapi_request: Request):
+    """Queue several messages at once, they are validated and rate limited as one request and processed in list order"""
+    try:
+        log(f'postMessages (queued): {len(request_model.messages)} messages for join_keys {sorted({message.join_key for message in request_model.messages})}')
+
         ip_address, error = get_ip_address_for_rate_limit(fastapi_request)
         if error:
             return JSONResponse(
@@ -348,21 +570,97 @@ def postaitMessage(request_model: AitPostMessageRequest, fastapi_request: Reques
                     "error": error
                 }
             )
-        
-        # Queue the request for background processing
-        queue_message_request(RequestType.AIT, request_model, ip_address, process_post_message)
-        
-        # Return 425 to indicate the request is being processed
+
+        # Reserve all message_ids before anything is queued, nothing stays reserved if one is taken
+        reserved = []
+        for index, message in enumerate(request_model.messages):
+            ait_instance = get_or_create_ait_instance(message.join_key)
+            if ait_instance.reserve_message_ids([message.message_id]) is not None:
+                for reserved_instance, message_id in reserved:
+                    reserved_instance.release_message_ids([message_id])
+                return JSONResponse(
+                    status_code=400,
+                    content={
+                        "message_id": message.message_id,
+                        "index": index,
+                        "error": f'Invalid message ID, already exists in ait with key {message.join_key}'
+                    }
+                )
+            reserved.append((ait_instance, message.message_id))
+
+        for message in request_model.messages:
+            queue_message_request(RequestType.AIT, message, ip_address, process_post_message)
+
+        return JSONResponse(
+            status_code=425,
+            content={
+                "message_ids": [message.message_id for message in request_model.messages],
+                "status": "processing",
+                "info": "Requests queued for background processing"
+            }
+        )
+    except Exception as e:
+        log(f'exception in /ait/postMessages: {e}')
+        log(f'stack: {traceback.print_exc()}')
+        return JSONResponse(
+            status_code=500,
+            content=f"Internal server error: {str(e)}"
+        )
+
+@app.post("/ait/postSceneMessage")
+@validate_join_key_decorator
+@validate_batch_decorator(callback_url_error, chat_model_error, audio_error, field="characters")
+@rate_limit_decorator
+def postaitSceneMessage(request_model: AitSceneMessageRequest, fastapi_request: Request):
+    """One user message answered by several characters, the responses are fetched per character message_id"""
+    try:
+        log(f'postSceneMessage (queued): join_key: {request_model.join_key} message: {request_model.message} characters: {[character.charactername for character in request_model.characters]}')
+
+        ip_address, error = get_ip_address_for_rate_limit(fastapi_request)
+        if error:
+            return JSONResponse(
+                status_code=500,
+                content={
+                    "error": error
+                }
+            )
+
+        ait_instance = get_or_create_ait_instance(request_model.join_key)
+
+        # The character ids become response ids, a postMessage or another scene must not take them while this one is queued
+        response_ids = [character.message_id for character in request_model.characters]
+        taken = ait_instance.reserve_message_ids(scene_message_ids(request_model))
+        if taken == 0:
+            return JSONResponse(
+                status_code=400,
+                content={
+                    "message_id": request_model.message_id,
+                    "error": f'Invalid message ID, already exists in ait with key {request_model.join_key}'
+                }
+            )
+        if taken is not None:
+            return JSONResponse(
+                status_code=400,
+                content={
+                    "message_id": response_ids[taken - 1],
+                    "index": taken - 1,
+                    "error": f'Invalid character message ID, already used in ait with key {request_model.join_key}'
+                }
+            )
+
+        queue_message_request(RequestType.AIT, request_model, ip_address, process_scene_message)
+
         return JSONResponse(
             status_code=425,
             content={
                 "message_id": request_model.message_id,
+                "message_ids": response_ids,
                 "status": "processing",
                 "info": "Request queued for background processing"
             }
         )
     except Exception as e:
-        log(f'exception in /ait/postMessage: {e}')
+        log(f'exception in /ait/postSceneMessage: {e}')
         log(f'stack: {traceback.print_exc()}')
         return JSONResponse(
             status_code=500,
@@ -370,7 +668,8 @@ def postaitMessage(request_model: AitPostMessageRequest, fastapi_request: Reques
         )
 
 @app.get("/ait/getMessageResponse")
-def getaitMessageResponse(join_key: str, message_id: str):
+async def getaitMessageResponse(join_key: str, message_id: str, timeout: float = 0):
+    """Response of a message, with timeout > 0 the request waits up to that many seconds for it instead of returning 425"""
     if " " in join_key:
         return JSONResponse(
             status_code=400,
@@ -388,15 +687,18 @@ def getaitMessageResponse(join_key: str, message_id: str):
                 content=f"There was no conversation with the join_key: {join_key}"
             )
         
-        for assistant_resp in ait_instance.assistant_responses:
-            if assistant_resp.response_id == message_id:
-                return JSONResponse(
-                    status_code=200,
-                    content={
-                        "message_id": message_id, 
-                        "response": assistant_resp.response
-                    }
-                )
+        if timeout > 0:
+            assistant_resp = await notifications.wait(ait_channel(join_key), message_id, timeout, lambda: ait_instance.get_response(message_id))
+        else:
+            assistant_resp = ait_instance.get_response(message_id)
+        if assistant_resp is not None:
+            return JSONResponse(
+                status_code=200,
+                content={
+                    "message_id": message_id, 
+                    "response": assistant_resp.response
+                }
+            )
 
         return JSONResponse(
             status_code=425,
@@ -410,27 +712,101 @@ def getaitMessageResponse(join_key: str, message_id: str):
             content=f"Internal server error: {str(e)}"
         )
     
-def reset_aitalkmaster(join_key: str):
+@app.get("/ait/events")
+async def aitEvents(join_key: str):
+    """Server-sent events of a join_key: "response" when a message is answered, "audio" when its clip is queued to the stream"""
+    if " " in join_key:
+        return JSONResponse(
+            status_code=400,
+            content={
+                "error": f'Invalid join key "{join_key}", it contains spaces',
+            }
+        )
+    return StreamingResponse(event_stream(ait_channel(join_key)), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get("/ait/getMessageResponses")
+async def getaitMessageResponses(join_key: str, message_ids: str, timeout: float = 0):
+    """Responses of several messages of a join_key, message_ids is comma separated.
+
+    Ready responses are returned together with the ids that are still pending. With timeout > 0
+    the request waits up to that many seconds until all responses are ready.
+    """
+    if " " in join_key:
+        return JSONResponse(
+            status_code=400,
+            content={
+                "error": f'Invalid join key "{join_key}", it contains spaces',
+            }
+        )
+
+    ids = [message_id for message_id in message_ids.split(",") if message_id]
+    if len(ids) > config.server.max_batch_size:
+        return JSONResponse(
+            status_code=400,
+            content={"error": f"{len(ids)} message_ids requested, at most {config.server.max_batch_size} are allowed"}
+        )
+
+    try:
+        ait_instance = active_aitalkmaster_instances.get(join_key)
+        if ait_instance is None:
+            return JSONResponse(
+                status_code=400,
+                content=f"There was no conversation with the join_key: {join_key}"
+            )
+
+        if timeout > 0:
+            await asyncio.gather(*(
+                notifications.wait(ait_channel(join_key), message_id, timeout, lambda message_id=message_id: ait_instance.get_response(message_id))
+                for message_id in ids
+            ))
+
+        responses = []
+        pending = []
+        for message_id in ids:
+            assistant_resp = ait_instance.get_response(message_id)
+            if assistant_resp is None:
+                pending.append(message_id)
+            else:
+                responses.append({"message_id": message_id, "name": assistant_resp.name, "response": assistant_resp.response})
+
+        return JSONResponse(
+            status_code=200 if not pending else 425,
+            content={"responses": responses, "pending": pending}
+        )
+
+    except Exception as e:
+        log(f'exception in /ait/getMessageResponses: {e}')
+        return JSONResponse(
+            status_code=500,
+            content=f"Internal server error: {str(e)}"
+        )
+
+def retire_ait_instance(join_key: str) -> tuple[Optional[AitalkmasterInstance], list]:
+    """Swap out the instance of a join_key and list the files of its archive job, ait_instances_lock must be held
+    
+    The files are listed before a new instance of the join_key can add its own.
+    """
+    ait_instance = active_aitalkmaster_instances.pop(join_key, None)
+    if ait_instance is not None:
+        finished_aitalkmaster_instances.append(ait_instance)
+        # The files of this instance are archived in the background, new files continue its numbering so names do not collide
+        last_sequence_numbers[join_key] = ait_instance.audio_sequence_counter
+    files = archive_jobs.list_files(join_key, ait_instance) if config.audio_client is not None else []
+    return ait_instance, files
+
+def reset_aitalkmaster(join_key: str, remove_active_dir: bool = False) -> Optional[str]:
+    """Swap out the instance of a join_key and hand its archival to a background archive job
+    
+    Returns:
+        The archive job id, None if there was nothing to archive
+    """
     # We do not stop the liquidsoap stream since that would lead to an interruption in the OpenSimulator viewers' audio stream.
 
-    if config.audio_client is not None:
-        merge_audio_files(join_key)
-        move_audio_files_to_inactive(join_key)
-
-    if join_key in active_aitalkmaster_instances.keys():
-        # Log the completed conversation before moving to finished instances
-        ait_instance = active_aitalkmaster_instances[join_key]
-        conversation_data = {
-            "join_key": join_key,
-            "conversation": ait_instance.getDialog(),
-            "created_at": ait_instance.created_at,
-            "reset_at": time.time()
-        }
-        llm_log(f'{datetime.now().strftime("%Y-%m-%d %H:%M")} AI Talkmaster: Completed conversation for {join_key}: {conversation_data}')
-        
-        finished_aitalkmaster_instances.append(active_aitalkmaster_instances[join_key])
+    with ait_instances_lock:
+        ait_instance, files = retire_ait_instance(join_key)
 
-        del active_aitalkmaster_instances[join_key]
+    job = archive_jobs.submit(join_key, ait_instance, files, remove_active_dir=remove_active_dir)
+    return job.job_id if job is not None else None
 
 @app.post("/ait/resetJoinkey")
 @rate_limit_decorator
@@ -439,8 +815,9 @@ def resetJoinkey(request_model: AitResetJoinkeyRequest, fastapi_request: Request
     try:
         join_key = request_model.join_key
 
+        archive_job_id = None
         if join_key in active_aitalkmaster_instances.keys():
-            reset_aitalkmaster(join_key)
+            archive_job_id = reset_aitalkmaster(join_key)
 
             log(f'AI Talkmaster: conversation has been reset: {join_key}')
         else:
@@ -452,14 +829,16 @@ def resetJoinkey(request_model: AitResetJoinkeyRequest, fastapi_request: Request
                 status_code=200,
                 content={
                     "info":f"{join_key} has been reset",
-                    "stream_url": stream_url
+                    "stream_url": stream_url,
+                    "archive_job_id": archive_job_id
                 }
             )
         else:
             return JSONResponse(
                 status_code=200,
                 content={
-                    "info":f"{join_key} has been reset"
+                    "info":f"{join_key} has been reset",
+                    "archive_job_id": archive_job_id
                 }
             )
     except Exception as e:
@@ -469,6 +848,27 @@ def resetJoinkey(request_model: AitResetJoinkeyRequest, fastapi_request: Request
             content=f"Internal server error: {str(e)}"
         )
 
+@app.get("/ait/archiveStatus")
+def getArchiveStatus(job_id: str):
+    try:
+        status = archive_jobs.get_status(job_id)
+        if status is None:
+            return JSONResponse(
+                status_code=400,
+                content={"error": f"There was no archive job with the job_id: {job_id}"}
+            )
+
+        return JSONResponse(
+            status_code=200,
+            content=status
+        )
+    except Exception as e:
+        log(f'exception in /ait/archiveStatus: {e}')
+        return JSONResponse(
+            status_code=500,
+            content=f"Internal server error: {str(e)}"
+        )
+
 @app.post("/ait/startConversation")
 @validate_join_key_decorator
 def startStream(request_model: AitStartConversationRequest, fastapi_request: Request):
@@ -0,0 +1,231 @@
+"""
+Background archival of reset AI Talkmaster join_keys.
+
+A reset only swaps the instance out and records an archive job. Moving the audio files to the
+inactive folder and logging the completed dialog is done by a background worker with retries.
+Jobs are journaled to disk, so jobs that did not finish before a restart are resumed.
+"""
+import json
+import queue
+import shutil
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Optional
+
+from code.shared import log, llm_log
+
+ARCHIVE_JOB_DIR = Path('./generated-audio/archive-jobs')
+MAX_ATTEMPTS = 5
+RETRY_DELAY_SECONDS = 10
+MAX_FINISHED_JOBS = 1000
+# A job waits this long for clips of its instance that are still being published, a clip that never arrives does not block it
+CLIP_WAIT_SECONDS = 120
+CLIP_CHECK_SECONDS = 1
+
+@dataclass
+class ArchiveJob:
+    """Archival of the audio files and dialog of one reset join_key"""
+    job_id: str
+    join_key: str
+    inactive_dir: str
+    files: list = field(default_factory=list)
+    remove_active_dir: bool = False
+    status: str = "pending"  # pending, waiting, running, retrying, done, failed
+    attempts: int = 0
+    error: str = ""
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    ait_instance: Any = None  # in memory only, the dialog is lost if the server restarts before the job runs
+
+    def to_dict(self) -> dict:
+        """Journal and status representation, the instance holds locks and is not part of it"""
+        return {
+            "job_id": self.job_id,
+            "join_key": self.join_key,
+            "inactive_dir": self.inactive_dir,
+            "files": list(self.files),
+            "remove_active_dir": self.remove_active_dir,
+            "status": self.status,
+            "attempts": self.attempts,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at
+        }
+
+    def waits_for_clips(self) -> bool:
+        """True while clips of the instance are still on their way to liquidsoap, their files must stay in place"""
+        return (self.ait_instance is not None and self.ait_instance.has_unpublished_clips()
+                and time.time() - self.created_at < CLIP_WAIT_SECONDS)
+
+class ArchiveJobQueue:
+    """Queue of archive jobs with a journal on disk and a bounded history of finished jobs"""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._jobs: OrderedDict[str, ArchiveJob] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _journal_path(self, job: ArchiveJob) -> Path:
+        return ARCHIVE_JOB_DIR / f'{job.job_id}.json'
+
+    def _write_journal(self, job: ArchiveJob):
+        ARCHIVE_JOB_DIR.mkdir(parents=True, exist_ok=True)
+        with open(self._journal_path(job), "w") as f:
+            json.dump(job.to_dict(), f)
+
+    def list_files(self, join_key: str, ait_instance: Any) -> list:
+        """Files to archive for a swapped out instance, called before a new instance of the join_key starts
+        
+        The merged file of the instance is moved aside, so a new instance starts a new one. Without
+        an instance the active directory holds files left by an earlier server run.
+        """
+        active_dir = Path(f'./generated-audio/aitalkmaster/active/{join_key}')
+        if ait_instance is not None:
+            current_date = datetime.now().strftime("%Y%m%d-%H%M%S")
+            ait_instance.retire_merged_file(str(active_dir / f'merged_conversation_{join_key}_{current_date}.mp3'))
+            return ait_instance.archive_files()
+        if not active_dir.exists() or self.has_pending(join_key):
+            # The files in the directory belong to the instance of the pending job
+            return []
+        return [str(file_path) for file_path in active_dir.iterdir() if file_path.is_file()]
+
+    def submit(self, join_key: str, ait_instance: Any, files: list, remove_active_dir: bool = False) -> Optional[ArchiveJob]:
+        """Record and queue an archive job for the files of list_files()"""
+        if not files and ait_instance is None and not remove_active_dir:
+            return None
+
+        current_date = datetime.now().strftime("%Y%m%d-%H%M%S")
+        job = ArchiveJob(
+            job_id=str(uuid.uuid4()),
+            join_key=join_key,
+            inactive_dir=str(Path('./generated-audio/inactive') / f"{join_key}_{current_date}"),
+            files=files,
+            remove_active_dir=remove_active_dir,
+            ait_instance=ait_instance
+        )
+        self._write_journal(job)
+        self._remember(job)
+        self._queue.put(job)
+        log(f'Archive job {job.job_id} queued for {join_key} with {len(files)} files')
+        return job
+
+    def _remember(self, job: ArchiveJob):
+        with self._lock:
+            self._jobs[job.job_id] = job
+            while len(self._jobs) > MAX_FINISHED_JOBS:
+                oldest_id = next(iter(self._jobs))
+                if self._jobs[oldest_id].status not in ("done", "failed"):
+                    break
+                del self._jobs[oldest_id]
+
+    def get_status(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.to_dict() if job is not None else None
+
+    def has_pending(self, join_key: str) -> bool:
+        """True while an archive job for the join_key still needs its active directory"""
+        with self._lock:
+            return any(job.join_key == join_key and job.status not in ("done", "failed") for job in self._jobs.values())
+
+    def resume(self):
+        """Queue the journaled jobs that did not finish before the last shutdown"""
+        if not ARCHIVE_JOB_DIR.exists():
+            return
+        for journal_file in sorted(ARCHIVE_JOB_DIR.glob('*.json')):
+            try:
+                with open(journal_file, "r") as f:
+                    job = ArchiveJob(**json.load(f))
+                job.status = "pending"
+                self._remember(job)
+                self._queue.put(job)
+                log(f'Archive job {job.job_id} for {job.join_key} resumed from journal')
+            except Exception as e:
+                log(f'Error resuming archive job from {journal_file}: {e}')
+
+    def _run(self, job: ArchiveJob):
+        inactive_dir = Path(job.inactive_dir)
+        inactive_dir.mkdir(parents=True, exist_ok=True)
+
+        if job.ait_instance is not None:
+            # Clips that were still in TTS or publish at the reset were written after the job was submitted
+            job.files = job.files + [file_name for file_name in job.ait_instance.archive_files() if file_name not in job.files]
+
+        # Moving is idempotent, files that were moved by an earlier attempt are skipped
+        for file_name in job.files:
+            file_path = Path(file_name)
+            if file_path.exists():
+                destination = inactive_dir / file_path.name
+                shutil.move(str(file_path), str(destination))
+                log(f'Moved audio file: {file_path} -> {destination}')
+        # We only make the directory empty, removing the active directory itself would stop the audio stream.
+
+        if job.ait_instance is not None:
+            conversation_data = {
+                "join_key": job.join_key,
+                "conversation": job.ait_instance.getDialog(),
+                "created_at": job.ait_instance.created_at,
+                "reset_at": job.created_at
+            }
+            llm_log(f'{datetime.now().strftime("%Y-%m-%d %H:%M")} AI Talkmaster: Completed conversation for {job.join_key}: {conversation_data}')
+            job.ait_instance = None
+
+        if job.remove_active_dir:
+            # Import here to avoid circular imports
+            from code.aitalkmaster_views import active_aitalkmaster_instances, ait_instances_lock
+            active_dir = Path(f'./generated-audio/aitalkmaster/active/{job.join_key}')
+            # Holding the lock keeps a new instance from being created while the directory is removed
+            with ait_instances_lock:
+                if job.join_key in active_aitalkmaster_instances:
+                    log(f"Kept active aitalkmaster icecast directory {active_dir}, a new instance of {job.join_key} uses it")
+                elif active_dir.exists():
+                    shutil.rmtree(active_dir)
+                    log(f"Deleted active aitalkmaster icecast directory: {active_dir}")
+
+    def _put_later(self, job: ArchiveJob, delay_seconds: float):
+        timer = threading.Timer(delay_seconds, self._queue.put, args=(job,))
+        timer.daemon = True
+        timer.start()
+
+    def _worker(self):
+        worker_name = threading.current_thread().name
+        while True:
+            job = self._queue.get()
+            if job.waits_for_clips():
+                job.status = "waiting"
+                self._put_later(job, CLIP_CHECK_SECONDS)
+                continue
+            job.status = "running"
+            job.attempts += 1
+            try:
+                self._run(job)
+                job.status = "done"
+                job.finished_at = time.time()
+                self._journal_path(job).unlink(missing_ok=True)
+                log(f'{worker_name}: Archive job {job.job_id} for {job.join_key} done')
+            except Exception as e:
+                job.error = str(e)
+                log(f'{worker_name}: Archive job {job.job_id} for {job.join_key} failed (attempt {job.attempts}): {e}')
+                log(f'stack: {traceback.format_exc()}')
+                if job.attempts < MAX_ATTEMPTS:
+                    job.status = "retrying"
+                    self._write_journal(job)
+                    self._put_later(job, RETRY_DELAY_SECONDS * job.attempts)
+                else:
+                    job.status = "failed"
+                    job.finished_at = time.time()
+                    self._write_journal(job)
+
+    def start(self, num_workers: int = 1):
+        """Start the archive worker threads"""
+        for i in range(num_workers):
+            threading.Thread(target=self._worker, daemon=True, name=f"ArchiveWorker-{i+1}").start()
+        log(f"Started {num_workers} archive worker threads")
+
+archive_jobs = ArchiveJobQueue()
@@ -0,0 +1,63 @@
+"""
+Asyncio execution engine for the LLM and TTS backend calls.
+
+Queued requests with a coroutine processor are run on the FastAPI event loop instead of
+holding a worker thread for the whole network round-trip. Each backend has its own
+semaphore, so the number of in-flight chat and audio calls is bounded by
+server.concurrency and not by the number of worker threads.
+"""
+import asyncio
+import threading
+import concurrent.futures
+from typing import Callable, Coroutine, Any, Dict, Optional
+
+from code.shared import config, log
+
+class AsyncEngine:
+    """Runs coroutines on one event loop and bounds the concurrency per backend"""
+
+    def __init__(self, limits: Dict[str, int]):
+        self._limits = limits
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._lock = threading.Lock()
+
+    def attach(self, loop: asyncio.AbstractEventLoop):
+        """Use the given (FastAPI) event loop for all submitted coroutines"""
+        with self._lock:
+            self._loop = loop
+            # Semaphores belong to the loop they were first used on
+            self._semaphores = {}
+        log(f"Async engine attached to event loop, limits: {self._limits}")
+
+    def detach(self):
+        with self._lock:
+            self._loop = None
+            self._semaphores = {}
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                # No FastAPI loop attached (e.g. the server is not started through uvicorn), run an own loop
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, daemon=True, name="AsyncEngineLoop").start()
+                self._loop = loop
+                self._semaphores = {}
+                log("Async engine started its own event loop")
+            return self._loop
+
+    def limit(self, backend: str) -> asyncio.Semaphore:
+        """Semaphore bounding the in-flight calls to a backend ("chat" or "audio")"""
+        semaphore = self._semaphores.get(backend)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self._limits.get(backend, 1))
+            self._semaphores[backend] = semaphore
+        return semaphore
+
+    def submit(self, coroutine: Coroutine[Any, Any, Any], on_done: Callable[[concurrent.futures.Future], None]) -> concurrent.futures.Future:
+        """Schedule a coroutine from any thread, on_done is called with the finished future"""
+        future = asyncio.run_coroutine_threadsafe(coroutine, self._get_loop())
+        future.add_done_callback(on_done)
+        return future
+
+async_engine = AsyncEngine({"chat": config.server.concurrency.chat, "audio": config.server.concurrency.audio})
@@ -1,6 +1,17 @@
 """Audio streaming utilities for liquidsoap integration"""
+import asyncio
+import io
+import time
 import requests
+from typing import Optional
+from mutagen.mp3 import MP3
+from pydub import AudioSegment
 from code.shared import config, log
+from code.config import AudioClientMode
+from code.rate_limiter import increment_resource_usage
+from code.async_engine import async_engine
+from code.tracing import trace_stage
+from code.metrics import TTS_LATENCY, TTS_ERRORS, TTS_AUDIO_SECONDS, LIQUIDSOAP_LATENCY, LIQUIDSOAP_FAILURES, timed_call
 
 def send_http_command(endpoint: str, data: str) -> bool:
     """Send an HTTP POST request to the liquidsoap server"""
@@ -8,6 +19,7 @@ def send_http_command(endpoint: str, data: str) -> bool:
         log(f"[-] No liquidsoap client config found, canceling HTTP request to '{endpoint}'")
         return False
 
+    start = time.perf_counter()
     try:
         url = f"http://{config.liquidsoap_client.host}:{config.liquidsoap_client.http_port}{endpoint}"
         response = requests.post(
@@ -16,22 +28,27 @@ def send_http_command(endpoint: str, data: str) -> bool:
             timeout=5,
             headers={'Content-Type': 'text/plain'}
         )
+        LIQUIDSOAP_LATENCY.observe(time.perf_counter() - start, command=endpoint)
         
         if response.status_code == 200:
-            log(f"[*] HTTP request to '{endpoint}' successful, response: {response.text.strip()}")
+            log(f"[*] HTTP request to '{endpoint}' successful, response: {response.text.strip()}", "debug", "liquidsoap")
             return True
         else:
-            log(f"[-] HTTP request to '{endpoint}' failed with status {response.status_code}: {response.text.strip()}")
+            log(f"[-] HTTP request to '{endpoint}' failed with status {response.status_code}: {response.text.strip()}", "warning", "liquidsoap")
+            LIQUIDSOAP_FAILURES.inc(command=endpoint, reason="status")
             return False
             
     except requests.exceptions.Timeout:
-        log(f"[-] HTTP request to '{endpoint}' timed out")
+        log(f"[-] HTTP request to '{endpoint}' timed out", "warning", "liquidsoap")
+        LIQUIDSOAP_FAILURES.inc(command=endpoint, reason="timeout")
         return False
     except requests.exceptions.ConnectionError:
-        log(f"[-] Cannot connect to liquidsoap HTTP server at {config.liquidsoap_client.host}:{config.liquidsoap_client.http_port}")
+        log(f"[-] Cannot connect to liquidsoap HTTP server at {config.liquidsoap_client.host}:{config.liquidsoap_client.http_port}", "error", "liquidsoap")
+        LIQUIDSOAP_FAILURES.inc(command=endpoint, reason="connection")
         return False
     except Exception as e:
-        log(f"[-] Error sending HTTP request to '{endpoint}': {e}")
+        log(f"[-] Error sending HTTP request to '{endpoint}': {e}", "error", "liquidsoap")
+        LIQUIDSOAP_FAILURES.inc(command=endpoint, reason="error")
         return False
 
 def start_aitalkmaster_stream(stream_name: str) -> bool:
@@ -45,7 +62,7 @@ def start_aitalkmaster_stream(stream_name: str) -> bool:
 
 def queue_aitalkmaster_audio(stream_name: str, filename: str) -> bool:
     """Queue an audio file for a specific liquidsoap stream via HTTP request"""
-    log(f"[+] Queuing audio file '{filename}' for '{stream_name}'")
+    log(f"[+] Queuing audio file '{filename}' for '{stream_name}'", "debug", "liquidsoap")
     data = f"{stream_name}::{filename}"
     success = send_http_command("/queue_aitalkmaster_audio", data)
     return success
@@ -71,7 +88,7 @@ def start_translation_stream(session_key: str) -> bool:
 
 def queue_translation_audio(session_key: str, filename: str) -> bool:
     """Queue an audio file for a translation liquidsoap stream via HTTP request"""
-    log(f"[+] Queuing translation audio file '{filename}' for '{session_key}'")
+    log(f"[+] Queuing translation audio file '{filename}' for '{session_key}'", "debug", "liquidsoap")
     data = f"translation::{session_key}::{filename}"
     success = send_http_command("/queue_translation_audio", data)
     return success
@@ -85,3 +102,139 @@ def stop_translation_stream(session_key: str) -> bool:
     
     return success
 
+
+
+# MPEG audio frame handling, used to concatenate MP3 files without decoding them
+MP3_BITRATES_KBPS = {
+    1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 0],  # MPEG 1 layer III
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160, 0]  # MPEG 2 and 2.5 layer III
+}
+MP3_SAMPLE_RATES = {
+    3: [44100, 48000, 32000],  # MPEG 1
+    2: [22050, 24000, 16000],  # MPEG 2
+    0: [11025, 12000, 8000]  # MPEG 2.5
+}
+
+def mp3_frame_length(header: bytes) -> Optional[int]:
+    """Length in bytes of the layer III frame starting with this 4 byte header, None if it is not a valid header"""
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+    version = (header[1] >> 3) & 0x03
+    layer = (header[1] >> 1) & 0x03
+    bitrate_index = header[2] >> 4
+    sample_rate_index = (header[2] >> 2) & 0x03
+    padding = (header[2] >> 1) & 0x01
+    if version == 1 or layer != 1 or sample_rate_index == 3:
+        return None
+    bitrate = MP3_BITRATES_KBPS[1 if version == 3 else 2][bitrate_index] * 1000
+    if bitrate == 0:
+        return None
+    sample_rate = MP3_SAMPLE_RATES[version][sample_rate_index]
+    samples_per_frame = 1152 if version == 3 else 576
+    return samples_per_frame // 8 * bitrate // sample_rate + padding
+
+def mp3_audio_frames(content: bytes) -> bytes:
+    """The MPEG audio frames of an MP3 file without ID3 tags and without the Xing/Info/VBRI header frame"""
+    start = 0
+    end = len(content)
+    if content[:3] == b"ID3" and len(content) >= 10:
+        tag_size = (content[6] & 0x7F) << 21 | (content[7] & 0x7F) << 14 | (content[8] & 0x7F) << 7 | (content[9] & 0x7F)
+        footer_size = 10 if content[5] & 0x10 else 0
+        start = 10 + tag_size + footer_size
+    if end - 128 >= start and content[end - 128:end - 125] == b"TAG":
+        end -= 128
+
+    # Skip padding up to the first frame
+    while start + 4 <= end and mp3_frame_length(content[start:start + 4]) is None:
+        start += 1
+
+    first_frame_length = mp3_frame_length(content[start:start + 4])
+    if first_frame_length is not None:
+        # The info frame of the first file would describe the length of only that file inside the merged file
+        first_frame_start = content[start:start + min(first_frame_length, 64)]
+        if b"Xing" in first_frame_start or b"Info" in first_frame_start or b"VBRI" in first_frame_start:
+            start += first_frame_length
+    return content[start:end]
+
+# Text to speech, shared by the AIT and translation processors
+async def synthesize_speech(text: str, audio_voice: str, audio_model: str, audio_instructions: str) -> bytes:
+    """Request speech for a text from the configured audio client and return the MP3 bytes"""
+    if config.audio_client.mode == AudioClientMode.OPENAI:
+        client = config.get_or_create_openai_async_audio_client()
+    else:
+        client = config.get_or_create_opensource_async_audio_client()
+
+    async with async_engine.limit("audio"):
+        with timed_call(TTS_LATENCY, TTS_ERRORS, model=audio_model, voice=audio_voice):
+            response = await client.audio.speech.create(
+                model=audio_model,
+                voice=audio_voice,
+                input=text,
+                instructions=audio_instructions,
+                response_format=config.audio_client.output_profile.request_format,
+                speed=1.0)
+            # the headers do not provide a direct "cost"
+            # we should use the duration of the audio to estimate the cost
+            return await response.aread()
+
+def matches_output_profile(content: bytes) -> Optional[float]:
+    """Duration of the audio if it is an MP3 stream in the configured output profile, None if it needs a conversion"""
+    profile = config.audio_client.output_profile
+    if profile.request_format != "mp3":
+        return None
+    try:
+        info = MP3(io.BytesIO(content)).info
+    except Exception:
+        return None
+    if profile.sample_rate is not None and info.sample_rate != profile.sample_rate:
+        return None
+    if profile.channels is not None and info.channels != profile.channels:
+        return None
+    if profile.bitrate is not None and info.bitrate != int(profile.bitrate.rstrip("k")) * 1000:
+        return None
+    return info.length
+
+def convert_to_output_profile(filename: str, content: bytes) -> float:
+    """Convert provider audio to the MP3 output profile in one encoding step and return its duration"""
+    profile = config.audio_client.output_profile
+    if profile.request_format == "pcm":
+        # Raw pcm needs no decoding, it is handed to the encoder directly
+        audio = AudioSegment(data=content, sample_width=2, frame_rate=profile.pcm_sample_rate, channels=1)
+    else:
+        audio = AudioSegment.from_file(io.BytesIO(content), format=profile.request_format)
+
+    # Resampling and downmixing are done by ffmpeg as part of the encoding
+    parameters = []
+    if profile.sample_rate is not None:
+        parameters += ["-ar", str(profile.sample_rate)]
+    if profile.channels is not None:
+        parameters += ["-ac", str(profile.channels)]
+    audio.export(filename, format="mp3", codec="libmp3lame", bitrate=profile.bitrate or "128k", parameters=parameters)
+    return len(audio) / 1000.0  # pydub returns duration in milliseconds
+
+def store_audio(filename: str, content: bytes, ip_address: str) -> float:
+    """Write synthesized audio to disk and charge its duration to the rate limit of the IP address.
+    
+    MP3 from the provider that already matches the output profile is written as is,
+    everything else is converted once by convert_to_output_profile.
+    """
+    duration_seconds = matches_output_profile(content)
+    if duration_seconds is None:
+        duration_seconds = convert_to_output_profile(filename, content)
+    else:
+        with open(filename, "wb") as f:
+            f.write(content)
+
+    log(f'duration_seconds: {duration_seconds}', "debug", "audio")
+    
+    # Use duration as weight for rate limiting (duration in seconds)
+    increment_resource_usage(ip_address, duration_seconds * config.server.usage.audio_cost_per_second)
+    return duration_seconds
+
+async def save_audio(filename: str, text: str, audio_voice: str, audio_model: str, audio_instructions: str, ip_address: str):
+    """Synthesize a text and store it as an MP3 file, file and CPU work runs off the event loop"""
+    with trace_stage("tts"):
+        content = await synthesize_speech(text, audio_voice, audio_model, audio_instructions)
+    with trace_stage("encode"):
+        duration_seconds = await asyncio.to_thread(store_audio, filename, content, ip_address)
+    TTS_AUDIO_SECONDS.inc(duration_seconds, voice=audio_voice)
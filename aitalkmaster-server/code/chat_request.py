@@ -0,0 +1,96 @@
+"""
+Cache-aware request layout for the chat backends.
+
+Ollama reuses the KV cache of the previous call and OpenAI caches prompts, but only for a
+byte-identical prefix. Requests are therefore always laid out as system instructions, summary,
+dialog (oldest first) with nothing per-call in front of the history. Ollama gets a keep_alive so
+the model and its cache stay loaded between turns, OpenAI gets a prompt_cache_key per dialog so
+the calls of one dialog are routed to the same cache.
+
+OpenAI reports the cached prompt tokens of a call. Ollama only reports the prompt tokens it
+evaluated (prompt_eval_count), the tokens it reused from the KV cache are derived from the
+estimated prompt length and are labelled as derived in the stats and metrics.
+"""
+import threading
+from dataclasses import dataclass
+from typing import Any
+
+from code.shared import config, log
+from code.context_manager import estimate_tokens
+from code.metrics import LLM_TOKENS
+
+@dataclass
+class PromptCacheStats:
+    """Cached and uncached prompt tokens of the calls to one backend"""
+    source: str  # "reported" by the backend or "derived" from the evaluated prompt tokens
+    calls: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "source": self.source,
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "uncached_tokens": self.prompt_tokens - self.cached_tokens,
+            "cached_ratio": round(self.cached_tokens / self.prompt_tokens, 3) if self.prompt_tokens else 0.0
+        }
+
+_stats: dict[str, PromptCacheStats] = {}
+_stats_lock = threading.Lock()
+
+def record_prompt_tokens(backend: str, source: str, prompt_tokens: int, cached_tokens: int):
+    cached_tokens = max(0, min(cached_tokens, prompt_tokens))
+    with _stats_lock:
+        stats = _stats.setdefault(backend, PromptCacheStats(source))
+        stats.calls += 1
+        stats.prompt_tokens += prompt_tokens
+        stats.cached_tokens += cached_tokens
+    LLM_TOKENS.inc(prompt_tokens, backend=backend, kind="prompt")
+    LLM_TOKENS.inc(cached_tokens, backend=backend, kind="cached" if source == "reported" else "cached_derived")
+
+def get_prompt_cache_stats() -> dict:
+    """Per backend prompt token counters"""
+    with _stats_lock:
+        return {backend: stats.to_dict() for backend, stats in _stats.items()}
+
+def ollama_chat_messages(system: str, dialog: list[dict]) -> list[dict]:
+    """System instructions followed by the dialog, the prefix only changes when the context is truncated or summarized"""
+    return [{"role": "system", "content": system}] + dialog
+
+def ollama_cache_kwargs() -> dict:
+    """Keep the model and its KV cache loaded between the turns of a dialog"""
+    return {"keep_alive": config.chat_client.keep_alive}
+
+def openai_cache_kwargs(cache_key: str) -> dict:
+    """Route the calls of one dialog to the same OpenAI prompt cache"""
+    if not config.chat_client.prompt_cache:
+        return {}
+    # extra_body works with client versions that do not know the prompt_cache_key parameter yet
+    return {"extra_body": {"prompt_cache_key": cache_key}}
+
+def record_ollama_usage(messages: list[dict], response: Any, name: str):
+    """Record the prompt tokens of an Ollama call of the dialog name.
+
+    prompt_eval_count is what Ollama measured, the tokens it reused from the KV cache are derived
+    as the estimated prompt length minus the evaluated tokens.
+    """
+    prompt_eval_count = response.get("prompt_eval_count") or 0
+    estimated_prompt_tokens = sum(estimate_tokens(message["content"]) for message in messages)
+    prompt_tokens = max(estimated_prompt_tokens, prompt_eval_count)
+    reused_tokens = prompt_tokens - prompt_eval_count
+    record_prompt_tokens("ollama", "derived", prompt_tokens, reused_tokens)
+    LLM_TOKENS.inc(response.get("eval_count") or 0, backend="ollama", kind="completion")
+    log(f'Prompt cache {name}: ollama {response.get("model", "")} evaluated {prompt_eval_count} of about {estimated_prompt_tokens} prompt tokens, '
+        f'{reused_tokens} reused from the KV cache (derived)', "info", "prompt_cache")
+
+def record_openai_usage(usage: Any, name: str):
+    """Record the prompt tokens of an OpenAI call of the dialog name, OpenAI reports the cached tokens"""
+    if usage is None:
+        return
+    details = getattr(usage, "input_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", 0) or 0
+    record_prompt_tokens("openai", "reported", usage.input_tokens, cached_tokens)
+    LLM_TOKENS.inc(getattr(usage, "output_tokens", 0) or 0, backend="openai", kind="completion")
+    log(f'Prompt cache {name}: openai reported {cached_tokens} of {usage.input_tokens} prompt tokens cached', "info", "prompt_cache")
@@ -5,8 +5,8 @@ from typing import Dict, Any, Optional, List, Tuple
 from pydantic import Field
 from dataclasses import dataclass
 from enum import Enum
-from ollama import Client
-from openai import OpenAI
+from ollama import Client, AsyncClient
+from openai import OpenAI, AsyncOpenAI
 
 def log(message):
     with open("./logs/config_logfile.txt", "a") as file:
@@ -35,6 +35,74 @@ class UsageConfig:
     rate_limit_per_day: int = 100000
     audio_cost_per_second: float = 100
 
+@dataclass
+class QueueConfig:
+    """Scheduling of the background message queue"""
+    # Lower number is served first, AIT requests drive live audio streams
+    priorities: dict = Field(default_factory=lambda: {"ait": 0, "translation": 1, "conversation": 2, "generate": 3})
+    # Requests that waited longer than this are served before higher priorities
+    starvation_seconds: float = 30.0
+
+@dataclass
+class ConcurrencyConfig:
+    """Maximum number of in-flight calls per backend in the async engine"""
+    chat: int = 64
+    audio: int = 16
+
+@dataclass
+class PipelineConfig:
+    """Worker pools and hand-off queue sizes of the AIT TTS and publish stages"""
+    tts_workers: int = 8
+    tts_queue_size: int = 64
+    publish_workers: int = 2
+    publish_queue_size: int = 64
+
+@dataclass
+class ConversationStoreConfig:
+    """Capacity and idle eviction of the conversation store"""
+    max_conversations: int = 1000
+    idle_timeout_seconds: float = 86400
+
+@dataclass
+class GenerateResultsConfig:
+    """Bounds of the cache holding /generate results until they are polled"""
+    max_results: int = 1000
+    max_bytes: int = 64 * 1024 * 1024
+    ttl_seconds: float = 3600
+
+@dataclass
+class WebhookConfig:
+    """Delivery of finished responses to the callback_url of a request"""
+    workers: int = 2
+    queue_size: int = 1000
+    pool_size: int = 10
+    timeout_seconds: float = 10.0
+    max_attempts: int = 3
+    retry_delay_seconds: float = 2.0
+    allowed_hosts: list = Field(default_factory=list)  # hosts, addresses or networks that may resolve to non-public addresses
+
+@dataclass
+class LoggingConfig:
+    """Buffered log writer and log levels"""
+    level: str = "info"
+    # Level per subsystem, e.g. {"liquidsoap": "debug", "monitor": "warning"}
+    levels: dict = Field(default_factory=dict)
+    buffer_size: int = 10000
+    flush_interval_seconds: float = 0.5
+    max_bytes: int = 50 * 1024 * 1024
+    backup_count: int = 5
+    stdout: bool = True
+
+@dataclass
+class TracingConfig:
+    """Stage timing traces of queued jobs"""
+    enabled: bool = True
+    # Jobs taking longer than this are written to the slow log
+    slow_seconds: float = 10.0
+    slow_log_file: str = "slow_logfile.txt"
+    # Finished traces kept for /admin/traces
+    recent_traces: int = 200
+
 @dataclass
 class ServerConfig:
     """Server configuration settings"""
@@ -44,7 +112,22 @@ class ServerConfig:
     llm_log_file: str = "llm_logfile.txt"
     num_workers: int = 4
     num_audio_workers: int = 4
+    # Longest wait of a long-poll getMessageResponse and keep-alive interval of the event streams
+    long_poll_max_seconds: float = 30.0
+    sse_heartbeat_seconds: float = 15.0
+    # Most messages in one request to the batch endpoints
+    max_batch_size: int = 16
+    # Token of the /admin endpoints, they are disabled while it is empty
+    admin_token: str = ""
     usage: UsageConfig = None
+    queue: QueueConfig = None
+    concurrency: ConcurrencyConfig = None
+    pipeline: PipelineConfig = None
+    conversations: ConversationStoreConfig = None
+    generate_results: GenerateResultsConfig = None
+    webhooks: WebhookConfig = None
+    logging: LoggingConfig = None
+    tracing: TracingConfig = None
 
 @dataclass
 class ChatClientConfig:
@@ -53,6 +136,23 @@ class ChatClientConfig:
     base_url: str = ""
     default_model: str = "llama3.2"
     allowed_models: list = Field(default_factory=list)
+    # Prompt token budget per model, older turns are folded into a rolling summary
+    context_budgets: dict = Field(default_factory=dict)
+    default_context_budget: int = 8000
+    keep_last_messages: int = 20
+    summary_model: str = ""  # empty uses the model of the conversation
+    # Provider prompt caching: how long Ollama keeps the model (and its KV cache) loaded, OpenAI prompt_cache_key routing
+    keep_alive: str = "30m"
+    prompt_cache: bool = True
+
+@dataclass
+class AudioOutputProfile:
+    """Format requested from the TTS provider and the MP3 profile of the files queued to liquidsoap"""
+    request_format: str = "mp3"  # mp3, opus, aac, flac, wav or pcm
+    pcm_sample_rate: int = 24000  # sample rate of raw pcm responses (16 bit, mono)
+    sample_rate: Optional[int] = None  # None keeps the provider sample rate
+    channels: Optional[int] = None  # None keeps the provider channels
+    bitrate: Optional[str] = None  # e.g. "32k", None keeps the provider bitrate
 
 @dataclass
 class AudioClientConfig:
@@ -63,6 +163,7 @@ class AudioClientConfig:
     default_model: str = "tts-1"
     allowed_voices: list = Field(default_factory=list)
     allowed_models: list = Field(default_factory=list)
+    output_profile: AudioOutputProfile = None
 
 @dataclass
 class LiquidsoapClientConfig:
@@ -84,6 +185,8 @@ class IcecastClientConfig:
 class AitalkmasterConfig:
     """AI Talkmaster configuration"""
     join_key_keep_alive_list: list = Field(default_factory=list)
+    # Stream the chat response and synthesize each sentence as soon as it is complete
+    streaming_tts: bool = False
 
 class Config:
     """
@@ -105,6 +208,10 @@ class Config:
         self._opensource_audio_client: Optional[Any] = None
         self._openai_chat_client: Optional[Any] = None
         self._openai_audio_client: Optional[Any] = None
+        self._ollama_async_chat_client: Optional[Any] = None
+        self._opensource_async_audio_client: Optional[Any] = None
+        self._openai_async_chat_client: Optional[Any] = None
+        self._openai_async_audio_client: Optional[Any] = None
         
         # Validation results storage
         self._validation_results: Optional[Dict[str, Any]] = None
@@ -132,6 +239,16 @@ class Config:
         # Server configuration
         server_data = self.config_data.get('server', {})
         usage_data = server_data.get('usage', {})
+        queue_data = server_data.get('queue', {})
+        queue_priorities = {"ait": 0, "translation": 1, "conversation": 2, "generate": 3}
+        queue_priorities.update(queue_data.get('priorities', {}))
+        concurrency_data = server_data.get('concurrency', {})
+        pipeline_data = server_data.get('pipeline', {})
+        conversations_data = server_data.get('conversations', {})
+        generate_results_data = server_data.get('generate_results', {})
+        webhooks_data = server_data.get('webhooks', {})
+        logging_data = server_data.get('logging', {})
+        tracing_data = server_data.get('tracing', {})
         
         self.server = ServerConfig(
             host=server_data.get('host'),
@@ -140,11 +257,62 @@ class Config:
             llm_log_file=server_data.get('llm_log_file'),
             num_workers=server_data.get('num_workers', 4),
             num_audio_workers=server_data.get('num_audio_workers', 4),
+            long_poll_max_seconds=server_data.get('long_poll_max_seconds', 30.0),
+            sse_heartbeat_seconds=server_data.get('sse_heartbeat_seconds', 15.0),
+            max_batch_size=server_data.get('max_batch_size', 16),
+            admin_token=server_data.get('admin_token', ''),
             usage=UsageConfig(
                 use_rate_limit=usage_data.get('use_rate_limit'),
                 rate_limit_xForwardedFor=usage_data.get('rate_limit_xForwardedFor'),
                 rate_limit_per_day=usage_data.get('rate_limit_per_day'),
                 audio_cost_per_second=usage_data.get('audio_cost_per_second')
+            ),
+            queue=QueueConfig(
+                priorities=queue_priorities,
+                starvation_seconds=queue_data.get('starvation_seconds', 30.0)
+            ),
+            concurrency=ConcurrencyConfig(
+                chat=concurrency_data.get('chat', 64),
+                audio=concurrency_data.get('audio', 16)
+            ),
+            pipeline=PipelineConfig(
+                tts_workers=pipeline_data.get('tts_workers', 8),
+                tts_queue_size=pipeline_data.get('tts_queue_size', 64),
+                publish_workers=pipeline_data.get('publish_workers', 2),
+                publish_queue_size=pipeline_data.get('publish_queue_size', 64)
+            ),
+            conversations=ConversationStoreConfig(
+                max_conversations=conversations_data.get('max_conversations', 1000),
+                idle_timeout_seconds=conversations_data.get('idle_timeout_seconds', 86400)
+            ),
+            generate_results=GenerateResultsConfig(
+                max_results=generate_results_data.get('max_results', 1000),
+                max_bytes=generate_results_data.get('max_bytes', 64 * 1024 * 1024),
+                ttl_seconds=generate_results_data.get('ttl_seconds', 3600)
+            ),
+            webhooks=WebhookConfig(
+                workers=webhooks_data.get('workers', 2),
+                queue_size=webhooks_data.get('queue_size', 1000),
+                pool_size=webhooks_data.get('pool_size', 10),
+                timeout_seconds=webhooks_data.get('timeout_seconds', 10.0),
+                max_attempts=webhooks_data.get('max_attempts', 3),
+                retry_delay_seconds=webhooks_data.get('retry_delay_seconds', 2.0),
+                allowed_hosts=webhooks_data.get('allowed_hosts', [])
+            ),
+            logging=LoggingConfig(
+                level=logging_data.get('level', 'info'),
+                levels=logging_data.get('levels', {}),
+                buffer_size=logging_data.get('buffer_size', 10000),
+                flush_interval_seconds=logging_data.get('flush_interval_seconds', 0.5),
+                max_bytes=logging_data.get('max_bytes', 50 * 1024 * 1024),
+                backup_count=logging_data.get('backup_count', 5),
+                stdout=logging_data.get('stdout', True)
+            ),
+            tracing=TracingConfig(
+                enabled=tracing_data.get('enabled', True),
+                slow_seconds=tracing_data.get('slow_seconds', 10.0),
+                slow_log_file=tracing_data.get('slow_log_file', 'slow_logfile.txt'),
+                recent_traces=tracing_data.get('recent_traces', 200)
             )
         )
         
@@ -165,13 +333,20 @@ class Config:
             key_file=chat_client_data.get('key_file'),
             base_url=chat_client_data.get('base_url'),
             default_model=chat_client_data.get('default_model'),
-            allowed_models=chat_client_data.get('allowed_models')
+            allowed_models=chat_client_data.get('allowed_models'),
+            context_budgets=chat_client_data.get('context_budgets', {}),
+            default_context_budget=chat_client_data.get('default_context_budget', 8000),
+            keep_last_messages=chat_client_data.get('keep_last_messages', 20),
+            summary_model=chat_client_data.get('summary_model', ''),
+            keep_alive=chat_client_data.get('keep_alive', '30m'),
+            prompt_cache=chat_client_data.get('prompt_cache', True)
         )
         
         # Audio client configuration (optional)
         audio_client_data = self.config_data.get('audio_client')
         if audio_client_data:
             audio_mode = audio_client_data.get('mode')
+            output_profile_data = audio_client_data.get('output_profile', {})
             if audio_mode is None:
                 raise ConfigurationValidationError("Audio client mode is required but not specified")
             
@@ -188,7 +363,14 @@ class Config:
                 default_voice=audio_client_data.get('default_voice'),
                 default_model=audio_client_data.get('default_model'),
                 allowed_voices=audio_client_data.get('allowed_voices'),
-                allowed_models=audio_client_data.get('allowed_models')
+                allowed_models=audio_client_data.get('allowed_models'),
+                output_profile=AudioOutputProfile(
+                    request_format=output_profile_data.get('request_format', 'mp3'),
+                    pcm_sample_rate=output_profile_data.get('pcm_sample_rate', 24000),
+                    sample_rate=output_profile_data.get('sample_rate'),
+                    channels=output_profile_data.get('channels'),
+                    bitrate=output_profile_data.get('bitrate')
+                )
             )
         else:
             self.audio_client = None
@@ -219,7 +401,8 @@ class Config:
         # Aitalkmaster configuration
         aitalkmaster_data = self.config_data.get('aitalkmaster', {})
         self.aitalkmaster = AitalkmasterConfig(
-            join_key_keep_alive_list=aitalkmaster_data.get('join_key_keep_alive_list')
+            join_key_keep_alive_list=aitalkmaster_data.get('join_key_keep_alive_list'),
+            streaming_tts=aitalkmaster_data.get('streaming_tts', False)
         )
         
         # Validate stream endpoint prefix if audio client is configured
@@ -334,18 +517,75 @@ class Config:
                 'llm_log_file': self.server.llm_log_file,
                 'num_workers': self.server.num_workers,
                 'num_audio_workers': self.server.num_audio_workers,
+                'long_poll_max_seconds': self.server.long_poll_max_seconds,
+                'sse_heartbeat_seconds': self.server.sse_heartbeat_seconds,
+                'max_batch_size': self.server.max_batch_size,
+                'admin_token': '***' if self.server.admin_token else '',
                 'usage': {
                     'use_rate_limit': self.server.usage.use_rate_limit,
                     'rate_limit_xForwardedFor': self.server.usage.rate_limit_xForwardedFor,
                     'rate_limit_per_day': self.server.usage.rate_limit_per_day,
                     'audio_cost_per_second': self.server.usage.audio_cost_per_second
+                },
+                'queue': {
+                    'priorities': self.server.queue.priorities,
+                    'starvation_seconds': self.server.queue.starvation_seconds
+                },
+                'concurrency': {
+                    'chat': self.server.concurrency.chat,
+                    'audio': self.server.concurrency.audio
+                },
+                'pipeline': {
+                    'tts_workers': self.server.pipeline.tts_workers,
+                    'tts_queue_size': self.server.pipeline.tts_queue_size,
+                    'publish_workers': self.server.pipeline.publish_workers,
+                    'publish_queue_size': self.server.pipeline.publish_queue_size
+                },
+                'conversations': {
+                    'max_conversations': self.server.conversations.max_conversations,
+                    'idle_timeout_seconds': self.server.conversations.idle_timeout_seconds
+                },
+                'generate_results': {
+                    'max_results': self.server.generate_results.max_results,
+                    'max_bytes': self.server.generate_results.max_bytes,
+                    'ttl_seconds': self.server.generate_results.ttl_seconds
+                },
+                'webhooks': {
+                    'workers': self.server.webhooks.workers,
+                    'queue_size': self.server.webhooks.queue_size,
+                    'pool_size': self.server.webhooks.pool_size,
+                    'timeout_seconds': self.server.webhooks.timeout_seconds,
+                    'max_attempts': self.server.webhooks.max_attempts,
+                    'retry_delay_seconds': self.server.webhooks.retry_delay_seconds,
+                    'allowed_hosts': self.server.webhooks.allowed_hosts
+                },
+                'logging': {
+                    'level': self.server.logging.level,
+                    'levels': self.server.logging.levels,
+                    'buffer_size': self.server.logging.buffer_size,
+                    'flush_interval_seconds': self.server.logging.flush_interval_seconds,
+                    'max_bytes': self.server.logging.max_bytes,
+                    'backup_count': self.server.logging.backup_count,
+                    'stdout': self.server.logging.stdout
+                },
+                'tracing': {
+                    'enabled': self.server.tracing.enabled,
+                    'slow_seconds': self.server.tracing.slow_seconds,
+                    'slow_log_file': self.server.tracing.slow_log_file,
+                    'recent_traces': self.server.tracing.recent_traces
                 }
             },
             'chat_client': {
                 'mode': self.chat_client.mode,
                 'url': self.chat_client.base_url,
                 'default_model': self.chat_client.default_model,
-                'allowed_models': self.chat_client.allowed_models
+                'allowed_models': self.chat_client.allowed_models,
+                'context_budgets': self.chat_client.context_budgets,
+                'default_context_budget': self.chat_client.default_context_budget,
+                'keep_last_messages': self.chat_client.keep_last_messages,
+                'summary_model': self.chat_client.summary_model,
+                'keep_alive': self.chat_client.keep_alive,
+                'prompt_cache': self.chat_client.prompt_cache
             },
             'audio_client': {
                 'mode': self.audio_client.mode,
@@ -354,7 +594,14 @@ class Config:
                 'default_voice': self.audio_client.default_voice,
                 'default_model': self.audio_client.default_model,
                 'allowed_voices': self.audio_client.allowed_voices,
-                'allowed_models': self.audio_client.allowed_models
+                'allowed_models': self.audio_client.allowed_models,
+                'output_profile': {
+                    'request_format': self.audio_client.output_profile.request_format,
+                    'pcm_sample_rate': self.audio_client.output_profile.pcm_sample_rate,
+                    'sample_rate': self.audio_client.output_profile.sample_rate,
+                    'channels': self.audio_client.output_profile.channels,
+                    'bitrate': self.audio_client.output_profile.bitrate
+                }
             } if self.audio_client else None,
             'liquidsoap_client': {
                 'host': self.liquidsoap_client.host,
@@ -368,7 +615,8 @@ class Config:
                 'translation_stream_endpoint_prefix': self.icecast_client.translation_stream_endpoint_prefix
             } if self.icecast_client else None,
             'aitalkmaster': {
-                'join_key_keep_alive_list': self.aitalkmaster.join_key_keep_alive_list
+                'join_key_keep_alive_list': self.aitalkmaster.join_key_keep_alive_list,
+                'streaming_tts': self.aitalkmaster.streaming_tts
             }
         }
     
@@ -421,6 +669,57 @@ class Config:
             from openai import OpenAI
             self._openai_audio_client = OpenAI(api_key=self.get_openai_key_from_file(self.audio_client.key_file))
         return self._openai_audio_client
+
+    def get_or_create_ollama_async_chat_client(self) -> AsyncClient:
+        """
+        Get or create Ollama async chat client instance, used by the async engine
+
+        Returns:
+            Ollama AsyncClient instance for chat operations
+        """
+        if self._ollama_async_chat_client is None:
+            self._ollama_async_chat_client = AsyncClient(host=self.chat_client.base_url)
+        return self._ollama_async_chat_client
+
+    def get_or_create_opensource_async_audio_client(self) -> AsyncOpenAI:
+        """
+        Get or create open source (Kokoro) async audio client instance, used by the async engine
+
+        Returns:
+            AsyncOpenAI Client instance for audio operations
+        """
+        if self._opensource_async_audio_client is None:
+            self._opensource_async_audio_client = AsyncOpenAI(
+                base_url=self.audio_client.base_url,
+                api_key="kokoro"
+            )
+        return self._opensource_async_audio_client
+
+    def get_or_create_openai_async_chat_client(self) -> AsyncOpenAI:
+        """
+        Get or create OpenAI async chat client instance, used by the async engine
+
+        Returns:
+            AsyncOpenAI Client instance for chat operations
+        """
+        if self._openai_async_chat_client is None:
+            if self.chat_client.base_url == "":
+                self._openai_async_chat_client = AsyncOpenAI(api_key=self.get_openai_key_from_file(self.chat_client.key_file))
+            else:
+                self._openai_async_chat_client = AsyncOpenAI(base_url=self.chat_client.base_url, api_key=self.get_openai_key_from_file(self.chat_client.key_file))
+
+        return self._openai_async_chat_client
+
+    def get_or_create_openai_async_audio_client(self) -> AsyncOpenAI:
+        """
+        Get or create OpenAI async audio client instance, used by the async engine
+
+        Returns:
+            AsyncOpenAI Client instance for audio operations
+        """
+        if self._openai_async_audio_client is None:
+            self._openai_async_audio_client = AsyncOpenAI(api_key=self.get_openai_key_from_file(self.audio_client.key_file))
+        return self._openai_async_audio_client
     
     def _get_available_chat_models(self) -> List[str]:
         """
@@ -815,6 +1114,10 @@ class Config:
         self._opensource_audio_client = None
         self._openai_chat_client = None
         self._openai_audio_client = None
+        self._ollama_async_chat_client = None
+        self._opensource_async_audio_client = None
+        self._openai_async_chat_client = None
+        self._openai_async_audio_client = None
         
         # Clear validation results
         self._validation_results = None
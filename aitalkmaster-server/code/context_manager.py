@@ -0,0 +1,140 @@
+"""
+Context window budgeting for long running dialogs.
+
+AIT join_keys can stay alive for weeks, so the prompt is kept within a per-model token budget:
+the last messages are sent verbatim and older messages are folded into a rolling summary that
+is produced in the background by the chat model.
+"""
+import asyncio
+import bisect
+import traceback
+from datetime import datetime
+from typing import Optional
+
+from code.shared import config, log, llm_log
+from code.config import ChatClientMode
+from code.async_engine import async_engine
+from code.metrics import LLM_LATENCY, LLM_ERRORS, timed_call
+from code.rate_limiter import increment_resource_usage
+
+SUMMARY_INSTRUCTIONS = (
+    "You summarize the earlier part of a dialog for the participants of a role play. "
+    "Keep names, facts, decisions and open questions, drop small talk. "
+    "Answer with the summary only, in the language of the dialog."
+)
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count of a chat message, about 4 characters per token plus the message overhead"""
+    return len(text) // 4 + 4
+
+def get_context_budget(model: str) -> int:
+    """Prompt token budget for a model"""
+    return config.chat_client.context_budgets.get(model, config.chat_client.default_context_budget)
+
+class Transcript:
+    """Append-only dialog in chronological order with cached role/content dicts for the chat clients.
+
+    Messages are appended when they are created, so the append order is the timestamp order and
+    the dialog never needs sorting. The messages list is handed to the chat clients as is and must
+    not be modified by them.
+    """
+
+    def __init__(self):
+        self.messages: list[dict] = []
+        self.token_estimate = 0
+        # cumulative_tokens[i] is the token estimate of messages[:i+1]
+        self.cumulative_tokens: list[int] = []
+
+    def append(self, role: str, content: str):
+        self.messages.append({"role": role, "content": content})
+        self.token_estimate += estimate_tokens(content)
+        self.cumulative_tokens.append(self.token_estimate)
+
+    def tokens_before(self, index: int) -> int:
+        """Token estimate of messages[:index]"""
+        return self.cumulative_tokens[index - 1] if index > 0 else 0
+
+    def __len__(self):
+        return len(self.messages)
+
+async def summarize_dialog(model: str, previous_summary: str, messages: list[dict], ip_address: str, name: str) -> str:
+    """Fold messages into the previous summary using the chat model, the tokens count for the IP address whose turn needed it"""
+    # Import here to avoid circular imports
+    from code.chat_request import record_ollama_usage, record_openai_usage
+
+    dialog_text = "\n".join(f'{message["role"]}: {message["content"]}' for message in messages)
+    prompt = f"Summary so far:\n{previous_summary}\n\nDialog to add:\n{dialog_text}" if previous_summary else f"Dialog:\n{dialog_text}"
+
+    async with async_engine.limit("chat"):
+        if config.chat_client.mode == ChatClientMode.OPENAI:
+            with timed_call(LLM_LATENCY, LLM_ERRORS, backend="openai", model=model):
+                response = await config.get_or_create_openai_async_chat_client().responses.create(model=model, input=prompt, instructions=SUMMARY_INSTRUCTIONS, store=False)
+            record_openai_usage(response.usage, f"summary of {name}")
+            increment_resource_usage(ip_address, response.usage.total_tokens)
+            # output[0] is a reasoning item with reasoning models, output_text joins the text of all message items
+            return response.output_text.strip()
+        with timed_call(LLM_LATENCY, LLM_ERRORS, backend="ollama", model=model):
+            response = await config.get_or_create_ollama_async_chat_client().generate(model=model, prompt=prompt, system=SUMMARY_INSTRUCTIONS)
+        record_ollama_usage([{"role": "system", "content": SUMMARY_INSTRUCTIONS}, {"role": "user", "content": prompt}], response, f"summary of {name}")
+        increment_resource_usage(ip_address, response["eval_count"] or 0)
+        return response["response"].strip()
+
+class ContextManager:
+    """Builds the prompt messages of a transcript within the token budget of a model.
+
+    messages[:summary_upto] are represented by the summary, the rest is sent verbatim.
+    When the verbatim part outgrows the budget, all but the last keep_last_messages are folded
+    into the summary by a background task. Until that task is done only the oldest verbatim
+    messages that do not fit into the budget are left out, so a turn never waits for the summary.
+    """
+
+    def __init__(self, transcript: Transcript, name: str):
+        self.transcript = transcript
+        self.name = name
+        self.summary = ""
+        self.summary_upto = 0
+        self._summary_task: Optional[asyncio.Task] = None
+
+    def build_messages(self, model: str, ip_address: str, reserved_tokens: int = 0) -> list[dict]:
+        """Summary (if any) followed by the most recent messages that fit into the budget
+
+        reserved_tokens is the part of the budget used by the system instructions. A summary
+        requested by this turn is charged to ip_address.
+        """
+        messages = self.transcript.messages
+        budget = get_context_budget(model) - reserved_tokens
+        summary_tokens = estimate_tokens(self.summary) if self.summary else 0
+        verbatim_tokens = self.transcript.token_estimate - self.transcript.tokens_before(self.summary_upto)
+
+        if summary_tokens + verbatim_tokens > budget:
+            self._request_summary(model, ip_address)
+
+        # First message index so that the messages from there on fit into the budget, keeping at least the last message
+        overflow_tokens = self.transcript.token_estimate - (budget - summary_tokens)
+        start = bisect.bisect_left(self.transcript.cumulative_tokens, overflow_tokens) + 1 if overflow_tokens > 0 else 0
+        start = min(max(start, self.summary_upto), len(messages) - 1) if messages else 0
+        if start > self.summary_upto:
+            log(f'Context of {self.name}: messages {self.summary_upto} to {start - 1} are over the budget of {model} and left out until the summary covers them', "warning", "context")
+
+        if not self.summary:
+            return messages if start == 0 else messages[start:]
+        return [{"role": "system", "content": f"Summary of the earlier dialog: {self.summary}"}] + messages[start:]
+
+    def _request_summary(self, model: str, ip_address: str):
+        if self._summary_task is not None and not self._summary_task.done():
+            return
+        upto = len(self.transcript.messages) - config.chat_client.keep_last_messages
+        if upto <= self.summary_upto:
+            return
+        summary_model = config.chat_client.summary_model or model
+        self._summary_task = asyncio.get_running_loop().create_task(self._fold(summary_model, upto, ip_address))
+
+    async def _fold(self, model: str, upto: int, ip_address: str):
+        try:
+            summary = await summarize_dialog(model, self.summary, self.transcript.messages[self.summary_upto:upto], ip_address, self.name)
+            self.summary = summary
+            self.summary_upto = upto
+            llm_log(f'{datetime.now().strftime("%Y-%m-%d %H:%M")} Context summary for {self.name} up to message {upto}: {summary}')
+        except Exception as e:
+            log(f'Error summarizing the dialog of {self.name}: {e}')
+            log(f'stack: {traceback.format_exc()}')
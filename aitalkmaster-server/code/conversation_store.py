@@ -0,0 +1,105 @@
+"""
+In-memory store of the /conversation sessions.
+
+Conversations are kept in least recently used order: a lookup moves the conversation to the end,
+so the front holds the conversations that were idle the longest. When the store is full the
+front is evicted, and conversations idle for longer than the timeout are evicted on access.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+from code.shared import log
+
+class ConversationStore:
+    """Dict keyed by conversation_key with LRU and idle timeout eviction"""
+
+    def __init__(self, max_conversations: int, idle_timeout_seconds: float, on_evict: Optional[Callable[[Any, str], None]] = None):
+        self._max_conversations = max_conversations
+        self._idle_timeout_seconds = idle_timeout_seconds
+        self._on_evict = on_evict
+        # conversation_key -> (conversation, last used), in least recently used order
+        self._conversations: OrderedDict[str, tuple[Any, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evicted = {"capacity": 0, "idle": 0}
+
+    def _expired(self, last_used: float, now: float) -> bool:
+        return self._idle_timeout_seconds > 0 and now - last_used > self._idle_timeout_seconds
+
+    def _evict_idle(self, now: float) -> list:
+        """Pop the idle conversations from the front, called with the lock held"""
+        evicted = []
+        while self._conversations:
+            key, (conversation, last_used) = next(iter(self._conversations.items()))
+            if not self._expired(last_used, now):
+                break
+            del self._conversations[key]
+            self._evicted["idle"] += 1
+            evicted.append((conversation, "idle"))
+        return evicted
+
+    def _notify(self, evicted: list):
+        if self._on_evict is None:
+            return
+        for conversation, reason in evicted:
+            try:
+                self._on_evict(conversation, reason)
+            except Exception as e:
+                log(f'Error in conversation eviction callback: {e}')
+
+    def get(self, conversation_key: str) -> Optional[Any]:
+        """Look up a conversation and mark it as used"""
+        now = time.time()
+        evicted = []
+        with self._lock:
+            entry = self._conversations.get(conversation_key)
+            if entry is not None and self._expired(entry[1], now):
+                del self._conversations[conversation_key]
+                self._evicted["idle"] += 1
+                evicted.append((entry[0], "idle"))
+                entry = None
+            if entry is None:
+                self._misses += 1
+                conversation = None
+            else:
+                self._hits += 1
+                conversation = entry[0]
+                self._conversations[conversation_key] = (conversation, now)
+                self._conversations.move_to_end(conversation_key)
+        self._notify(evicted)
+        return conversation
+
+    def put(self, conversation_key: str, conversation: Any):
+        """Add a conversation, evicting idle and then least recently used ones to stay within capacity"""
+        now = time.time()
+        with self._lock:
+            evicted = self._evict_idle(now)
+            while len(self._conversations) >= self._max_conversations:
+                _, (oldest, _) = self._conversations.popitem(last=False)
+                self._evicted["capacity"] += 1
+                evicted.append((oldest, "capacity"))
+            self._conversations[conversation_key] = (conversation, now)
+        self._notify(evicted)
+
+    def values(self) -> list:
+        """Snapshot of the stored conversations"""
+        with self._lock:
+            return [conversation for conversation, _ in self._conversations.values()]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._conversations)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._conversations),
+                "capacity": self._max_conversations,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evicted_capacity": self._evicted["capacity"],
+                "evicted_idle": self._evicted["idle"]
+            }
@@ -1,4 +1,4 @@
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from datetime import datetime
 import uuid
 import traceback
@@ -7,17 +7,23 @@ from typing import Optional
 from dataclasses import dataclass
 
 from code.shared import app, config, log, llm_log
-from code.validation_decorators import validate_chat_model_decorator, rate_limit_decorator
+from code.validation_decorators import validate_chat_model_decorator, rate_limit_decorator, validate_callback_url_decorator
+from code.webhook_delivery import webhooks
 from code.request_models import ConversationStartRequest, ConversationPostMessageRequest
 from code.openai_response import CharacterResponse
 from code.config import ChatClientMode
 from code.rate_limiter import get_ip_address_for_rate_limit, increment_resource_usage
 from fastapi import Request
 from code.message_queue import queue_message_request, RequestType
+from code.async_engine import async_engine
+from code.metrics import LLM_LATENCY, LLM_ERRORS, timed_call
+from code.tracing import trace_stage
+from code.chat_request import ollama_chat_messages, ollama_cache_kwargs, openai_cache_kwargs, record_ollama_usage, record_openai_usage
+from code.context_manager import Transcript, ContextManager, estimate_tokens
+from code.conversation_store import ConversationStore
+from code.notifications import notifications, conversation_channel, event_stream
 from ollama import ResponseError
 
-conversation_queue = []
-MAX_ACTIVE_CONVERSATIONS = 1000
 
 @dataclass
 class ConversationMessage:
@@ -50,8 +56,13 @@ class Conversation:
         self.model = model
         self.user_messages: list[ConversationMessage] = []
         self.assistant_responses: list[ConversationResponse] = []
+        # Indexes for the polled lookups by message_id
+        self.user_messages_by_id: dict[str, ConversationMessage] = {}
+        self.responses_by_message_id: dict[str, ConversationResponse] = {}
         self.options = options
         self.system = system
+        self.transcript = Transcript()
+        self.context = ContextManager(self.transcript, f"conversation {conversation_key}")
         
     def addMessage(self, message: str, message_id: str):
         """Add a user message to the conversation history"""
@@ -60,6 +71,8 @@ class Conversation:
             message_id=message_id
         )
         self.user_messages.append(user_message)
+        self.user_messages_by_id[message_id] = user_message
+        self.transcript.append("user", message)
 
     def addResponse(self, response: str, message_id: str):
         """Add an assistant response to the conversation history"""
@@ -68,54 +81,24 @@ class Conversation:
             message_id=message_id
         )
         self.assistant_responses.append(assistant_response)
+        self.responses_by_message_id[message_id] = assistant_response
+        self.transcript.append("assistant", response)
         
-    def getDialog(self):
-        """Get dialog for chat model"""
-    
-        # Combine user messages and assistant responses in chronological order
-        all_messages = []
-        
-        # Add user messages
-        for message in self.user_messages:
-            all_messages.append({
-                "role": "user",
-                "content": message.content,
-                "timestamp": message.timestamp
-            })
-        
-        # Add assistant responses
-        for response in self.assistant_responses:
-            all_messages.append({
-                "role": "assistant",
-                "content": response.content,
-                "timestamp": response.timestamp
-            })
-        
-        # Sort by timestamp to maintain chronological order
-        all_messages.sort(key=lambda x: x["timestamp"])
-        
-        dialog = []
-        for message in all_messages:
-            dialog.append({
-                "role": message["role"],
-                "content": message["content"]
-            })
-        
-        return dialog
+    def getDialog(self) -> list[dict]:
+        """Get dialog for chat model, the returned list is the maintained transcript and must not be modified"""
+        return self.transcript.messages
+
+    def getPromptDialog(self, ip_address: str) -> list[dict]:
+        """Get the dialog within the context budget of the model, older messages are replaced by a summary charged to ip_address"""
+        return self.context.build_messages(self.model, ip_address, estimate_tokens(self.system))
     
     def getMessageById(self, message_id: str) -> Optional[ConversationMessage]:
         """Get a specific user message by its ID"""
-        for message in self.user_messages:
-            if message.message_id == message_id:
-                return message
-        return None
+        return self.user_messages_by_id.get(message_id)
     
     def findResponseByMessageId(self, message_id: str) -> Optional[ConversationResponse]:
         """Find a specific assistant response by its message ID"""
-        for response in self.assistant_responses:
-            if response.message_id == message_id:
-                return response
-        return None
+        return self.responses_by_message_id.get(message_id)
 
     def __str__(self):
         """String representation for logging"""
@@ -127,11 +110,17 @@ class Conversation:
         })
 
     
-def getConversation(conversation_key):
-    for conversation in conversation_queue:
-        if conversation.conversation_key==conversation_key:
-            return conversation
-    return None
+def log_evicted_conversation(conversation: Conversation, reason: str):
+    llm_log(f'{datetime.now().strftime("%Y-%m-%d %H:%M")} Conversation: evicted ({reason}) conversation {conversation.conversation_key}: {conversation}')
+
+conversation_store = ConversationStore(
+    max_conversations=config.server.conversations.max_conversations,
+    idle_timeout_seconds=config.server.conversations.idle_timeout_seconds,
+    on_evict=log_evicted_conversation
+)
+
+def getConversation(conversation_key) -> Optional[Conversation]:
+    return conversation_store.get(conversation_key)
 
 
 @app.post("/conversation/start")
@@ -141,13 +130,9 @@ def startConversation(request_model: ConversationStartRequest, fastapi_request:
     try:
         log(f'{datetime.now().strftime("%Y-%m-%d %H:%M")} startConversation: model: {request_model.model}, system: {request_model.system_instructions}, options: {request_model.options}')
 
-        while len(conversation_queue)>=MAX_ACTIVE_CONVERSATIONS:
-            llm_log(f'{datetime.now().strftime("%Y-%m-%d %H:%M")} Conversation: Max active conversations reached, removing oldest conversation:{conversation_queue[0]}')
-            conversation_queue.pop()
-
         conversation_key = str(uuid.uuid4())
 
-        conversation_queue.append(Conversation(conversation_key, request_model.model, request_model.options, request_model.system_instructions))
+        conversation_store.put(conversation_key, Conversation(conversation_key, request_model.model, request_model.options, request_model.system_instructions))
 
         return JSONResponse(
             status_code=200,
@@ -163,7 +148,8 @@ def startConversation(request_model: ConversationStartRequest, fastapi_request:
 
 
 @app.get("/conversation/getMessageResponse")
-def conversationGetMessage(conversation_key: str, message_id: str):
+async def conversationGetMessage(conversation_key: str, message_id: str, timeout: float = 0):
+    """Response of a message, with timeout > 0 the request waits up to that many seconds for it instead of returning 425"""
     try:
         conversation = getConversation(conversation_key=conversation_key)
         if conversation == None:
@@ -172,7 +158,10 @@ def conversationGetMessage(conversation_key: str, message_id: str):
                 content={"message": f"no conversation found with key: {conversation_key}"}
             )
 
-        response = conversation.findResponseByMessageId(message_id)
+        if timeout > 0:
+            response = await notifications.wait(conversation_channel(conversation_key), message_id, timeout, lambda: conversation.findResponseByMessageId(message_id))
+        else:
+            response = conversation.findResponseByMessageId(message_id)
 
         if response is None:
             return JSONResponse( 
@@ -190,17 +179,24 @@ def conversationGetMessage(conversation_key: str, message_id: str):
             content=f"Internal server error getMessage: {e}"
         )
 
-def get_response_ollama_conversation(conversation: Conversation, think: bool, ip_address: str) -> str:
-    full_dialog = []
-    full_dialog.append({
-        "role": "system",
-        "content": conversation.system  
-    })
-    for d in conversation.getDialog():
-        full_dialog.append(d)
+@app.get("/conversation/events")
+async def conversationEvents(conversation_key: str):
+    """Server-sent events of a conversation, a "response" event per answered message"""
+    if getConversation(conversation_key=conversation_key) is None:
+        return JSONResponse(
+            status_code=400,
+            content={"message": f"no conversation found with key: {conversation_key}"}
+        )
+    return StreamingResponse(event_stream(conversation_channel(conversation_key)), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+async def get_response_ollama_conversation(conversation: Conversation, think: bool, ip_address: str) -> str:
+    full_dialog = ollama_chat_messages(conversation.system, conversation.getPromptDialog(ip_address))
 
     try:
-        response = config.get_or_create_ollama_chat_client().chat(model=conversation.model, messages = full_dialog, think=think, options=conversation.options)
+        async with async_engine.limit("chat"):
+            with timed_call(LLM_LATENCY, LLM_ERRORS, backend="ollama", model=conversation.model):
+                response = await config.get_or_create_ollama_async_chat_client().chat(model=conversation.model, messages = full_dialog, think=think, options=conversation.options, **ollama_cache_kwargs())
+        record_ollama_usage(full_dialog, response, f"conversation:{conversation.conversation_key}")
         increment_resource_usage(ip_address, response["eval_count"])
         return response["message"]["content"]
     except ResponseError as e:
@@ -209,16 +205,20 @@ def get_response_ollama_conversation(conversation: Conversation, think: bool, ip
         llm_log(error_msg)
         return error_msg
 
-def get_response_openai_conversation(conversation: Conversation, ip_address: str) -> str:
+async def get_response_openai_conversation(conversation: Conversation, ip_address: str) -> str:
     try:
-        response = config.get_or_create_openai_chat_client().responses.parse(
-            model=conversation.model,
-            input=conversation.getDialog(),
-            instructions=conversation.system,
-            text_format=CharacterResponse,
-            store=False
-        )
-
+        async with async_engine.limit("chat"):
+            with timed_call(LLM_LATENCY, LLM_ERRORS, backend="openai", model=conversation.model):
+                response = await config.get_or_create_openai_async_chat_client().responses.parse(
+                    model=conversation.model,
+                    input=conversation.getPromptDialog(ip_address),
+                    instructions=conversation.system,
+                    text_format=CharacterResponse,
+                    store=False,
+                    **openai_cache_kwargs(f"conversation:{conversation.conversation_key}")
+                )
+
+        record_openai_usage(response.usage, f"conversation:{conversation.conversation_key}")
         increment_resource_usage(ip_address, response.usage.total_tokens)
 
         return response.output_parsed.text_response # type: ignore
@@ -228,7 +228,7 @@ def get_response_openai_conversation(conversation: Conversation, ip_address: str
         llm_log(error_msg)
         return error_msg
 
-def process_conversation_post_message(request_model: ConversationPostMessageRequest, ip_address: str):
+async def process_conversation_post_message(request_model: ConversationPostMessageRequest, ip_address: str):
     """Process a conversation postMessage request in the background"""
     try:
         conversation = getConversation(conversation_key=request_model.conversation_key)
@@ -238,15 +238,19 @@ def process_conversation_post_message(request_model: ConversationPostMessageRequ
 
         conversation.addMessage(request_model.message, request_model.message_id)
         
-        if config.chat_client.mode == ChatClientMode.OPENAI:
-            response_msg = get_response_openai_conversation(conversation, ip_address)
-        elif config.chat_client.mode == ChatClientMode.OLLAMA:
-            response_msg = get_response_ollama_conversation(conversation, request_model.think, ip_address)
-        else:
-            log(f'Error: unknown chat client mode: {config.chat_client.mode}')
-            return
+        with trace_stage("llm"):
+            if config.chat_client.mode == ChatClientMode.OPENAI:
+                response_msg = await get_response_openai_conversation(conversation, ip_address)
+            elif config.chat_client.mode == ChatClientMode.OLLAMA:
+                response_msg = await get_response_ollama_conversation(conversation, request_model.think, ip_address)
+            else:
+                log(f'Error: unknown chat client mode: {config.chat_client.mode}')
+                return
 
         conversation.addResponse(response_msg, request_model.message_id)
+        event = {"type": "response", "conversation_key": request_model.conversation_key, "message_id": request_model.message_id, "response": response_msg}
+        notifications.publish(conversation_channel(request_model.conversation_key), request_model.message_id, event)
+        webhooks.deliver(request_model.callback_url, event)
 
         log(f'{datetime.now().strftime("%Y-%m-%d %H:%M")} conversation/postMessage (background): data:{request_model.model_dump()} conversation:{conversation}')
         
@@ -255,6 +259,7 @@ def process_conversation_post_message(request_model: ConversationPostMessageRequ
         log(f'stack: {traceback.print_exc()}')
 
 @app.post("/conversation/postMessage")
+@validate_callback_url_decorator
 @rate_limit_decorator
 def conversationPostMessage(request_model: ConversationPostMessageRequest, fastapi_request: Request):
     try:
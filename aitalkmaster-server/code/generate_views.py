@@ -1,31 +1,49 @@
 from fastapi.responses import JSONResponse
 from datetime import datetime
+import asyncio
 import traceback
 
 from code.shared import app, config, log, llm_log
-from code.validation_decorators import validate_chat_model_decorator, rate_limit_decorator
-from code.request_models import GenerateRequest
+from code.validation_decorators import validate_chat_model_decorator, rate_limit_decorator, validate_callback_url_decorator, validate_batch_decorator, callback_url_error, chat_model_error
+from code.webhook_delivery import webhooks
+from code.request_models import GenerateRequest, GeneratePostMessagesRequest
 from code.config import ChatClientMode
 from code.rate_limiter import get_ip_address_for_rate_limit, increment_resource_usage
 from fastapi import Request
 from code.message_queue import queue_message_request, RequestType
+from code.async_engine import async_engine
+from code.metrics import LLM_LATENCY, LLM_ERRORS, timed_call
+from code.tracing import trace_stage
+from code.result_cache import ResultCache
+from code.notifications import notifications, GENERATE_CHANNEL
 from ollama import ResponseError
 
-generate_response_queue = []
-MAX_CHATS_NO_HISTORY = 1000
+def generate_result_size(result: dict) -> int:
+    """Approximate memory of a stored generate result"""
+    return sum(len(value.encode("utf-8")) for value in (result["response"], result["message"], result["system_instructions"] or "")) + 256
+
+generate_results = ResultCache(
+    max_entries=config.server.generate_results.max_results,
+    max_bytes=config.server.generate_results.max_bytes,
+    ttl_seconds=config.server.generate_results.ttl_seconds,
+    size_of=generate_result_size
+)
 
 @app.get("/generate/getMessageResponse")
-def generateGetMessageResponse(message_id: str):
+async def generateGetMessageResponse(message_id: str, consume: bool = False, timeout: float = 0):
+    """Response of a message, with timeout > 0 the request waits up to that many seconds for it instead of returning 425"""
     try:
-        for response in generate_response_queue:
-            if response["message_id"]==message_id:
-                return JSONResponse( 
-                    status_code=200,
-                    content={
-                        "message_id": message_id,
-                        "response": response["response"]
-                    }
-                )
+        if timeout > 0:
+            await notifications.wait(GENERATE_CHANNEL, message_id, timeout, lambda: generate_results.peek(message_id))
+        response = generate_results.get(message_id, consume=consume)
+        if response is not None:
+            return JSONResponse( 
+                status_code=200,
+                content={
+                    "message_id": message_id,
+                    "response": response["response"]
+                }
+            )
             
         return JSONResponse(
             status_code=425,
@@ -38,9 +56,52 @@ def generateGetMessageResponse(message_id: str):
             content=f"Internal server error: {e}"
         )
 
-def get_response_ollama_generate(request: GenerateRequest, ip_address: str) -> str:
+@app.get("/generate/getMessageResponses")
+async def generateGetMessageResponses(message_ids: str, consume: bool = False, timeout: float = 0):
+    """Responses of several messages, message_ids is comma separated.
+
+    Ready responses are returned together with the ids that are still pending. With timeout > 0
+    the request waits up to that many seconds until all responses are ready.
+    """
+    ids = [message_id for message_id in message_ids.split(",") if message_id]
+    if len(ids) > config.server.max_batch_size:
+        return JSONResponse(
+            status_code=400,
+            content={"error": f"{len(ids)} message_ids requested, at most {config.server.max_batch_size} are allowed"}
+        )
+
+    try:
+        if timeout > 0:
+            await asyncio.gather(*(
+                notifications.wait(GENERATE_CHANNEL, message_id, timeout, lambda message_id=message_id: generate_results.peek(message_id))
+                for message_id in ids
+            ))
+
+        responses = []
+        pending = []
+        for message_id in ids:
+            response = generate_results.get(message_id, consume=consume)
+            if response is None:
+                pending.append(message_id)
+            else:
+                responses.append({"message_id": message_id, "response": response["response"]})
+
+        return JSONResponse(
+            status_code=200 if not pending else 425,
+            content={"responses": responses, "pending": pending}
+        )
+
+    except Exception as e:
+        return JSONResponse(
+            status_code=500,
+            content=f"Internal server error: {e}"
+        )
+
+async def get_response_ollama_generate(request: GenerateRequest, ip_address: str) -> str:
     try:
-        response = config.get_or_create_ollama_chat_client().generate(model=request.model, prompt=request.message, system=request.system_instructions, think=request.think, options=request.options)
+        async with async_engine.limit("chat"):
+            with timed_call(LLM_LATENCY, LLM_ERRORS, backend="ollama", model=request.model):
+                response = await config.get_or_create_ollama_async_chat_client().generate(model=request.model, prompt=request.message, system=request.system_instructions, think=request.think, options=request.options)
         increment_resource_usage(ip_address, response["eval_count"])
         return response["response"]
     except ResponseError as e:
@@ -49,9 +110,11 @@ def get_response_ollama_generate(request: GenerateRequest, ip_address: str) -> s
         llm_log(error_msg)
         return error_msg
     
-def get_response_openai_generate(request: GenerateRequest, ip_address: str) -> str:
+async def get_response_openai_generate(request: GenerateRequest, ip_address: str) -> str:
     try:
-        response = config.get_or_create_openai_chat_client().responses.create(model=request.model, input=request.message, instructions=request.system_instructions)
+        async with async_engine.limit("chat"):
+            with timed_call(LLM_LATENCY, LLM_ERRORS, backend="openai", model=request.model):
+                response = await config.get_or_create_openai_async_chat_client().responses.create(model=request.model, input=request.message, instructions=request.system_instructions)
         increment_resource_usage(ip_address, response.usage.total_tokens)
         return response.output[0].content[0].text
     except Exception as e:
@@ -60,21 +123,22 @@ def get_response_openai_generate(request: GenerateRequest, ip_address: str) -> s
         llm_log(error_msg)
         return error_msg
 
-def process_generate_post_message(request_model: GenerateRequest, ip_address: str):
+async def process_generate_post_message(request_model: GenerateRequest, ip_address: str):
     """Process a generate postMessage request in the background"""
     try:
-        if config.chat_client.mode == ChatClientMode.OPENAI:
-            response_msg = get_response_openai_generate(request_model, ip_address)
-        elif config.chat_client.mode == ChatClientMode.OLLAMA:
-            response_msg = get_response_ollama_generate(request_model, ip_address)
-        else:
-            log(f'Error: unknown chat client mode: {config.chat_client.mode.value}')
-            return
+        with trace_stage("llm"):
+            if config.chat_client.mode == ChatClientMode.OPENAI:
+                response_msg = await get_response_openai_generate(request_model, ip_address)
+            elif config.chat_client.mode == ChatClientMode.OLLAMA:
+                response_msg = await get_response_ollama_generate(request_model, ip_address)
+            else:
+                log(f'Error: unknown chat client mode: {config.chat_client.mode.value}')
+                return
         
         log(f'{datetime.now().strftime("%Y-%m-%d %H:%M")} generate/postMessage (background): data:{request_model.model_dump()} response:{response_msg}')
         llm_log(f'{datetime.now().strftime("%Y-%m-%d %H:%M")} generate/postMessage (background): data:{request_model.model_dump()} response:{response_msg}')
 
-        # Store the response in our list
+        # Store the response until it is polled
         d = {
             "message_id": request_model.message_id,
             "response": response_msg,
@@ -83,10 +147,9 @@ def process_generate_post_message(request_model: GenerateRequest, ip_address: st
             "system_instructions": request_model.system_instructions,
             "options": request_model.options
         }
-        generate_response_queue.append(d)
-
-        while len(generate_response_queue)>=MAX_CHATS_NO_HISTORY:
-            generate_response_queue.pop()
+        generate_results.put(request_model.message_id, d)
+        notifications.publish(GENERATE_CHANNEL, request_model.message_id, {"type": "response", "message_id": request_model.message_id})
+        webhooks.deliver(request_model.callback_url, {"type": "response", "message_id": request_model.message_id, "response": response_msg})
         
     except Exception as e:
         log(f'exception in process_generate_post_message: {e}')
@@ -94,6 +157,7 @@ def process_generate_post_message(request_model: GenerateRequest, ip_address: st
 
 
 @app.post("/generate/postMessage")
+@validate_callback_url_decorator
 @validate_chat_model_decorator
 @rate_limit_decorator
 def generate(request_model: GenerateRequest, fastapi_request: Request):
@@ -128,4 +192,40 @@ def generate(request_model: GenerateRequest, fastapi_request: Request):
         return JSONResponse(
             status_code=500,
             content=f"Internal server error: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+@app.post("/generate/postMessages")
+@validate_batch_decorator(callback_url_error, chat_model_error)
+@rate_limit_decorator
+def generateBatch(request_model: GeneratePostMessagesRequest, fastapi_request: Request):
+    """Queue several prompts at once, they are validated and rate limited as one request"""
+    log(f'generate/postMessages (queued): {len(request_model.messages)} messages')
+    try:
+        ip_address, error = get_ip_address_for_rate_limit(fastapi_request)
+        if error:
+            return JSONResponse(
+                status_code=500,
+                content={
+                    "error": error
+                }
+            )
+
+        for message in request_model.messages:
+            queue_message_request(RequestType.GENERATE, message, ip_address, process_generate_post_message)
+
+        return JSONResponse(
+            status_code=425,
+            content={
+                "message_ids": [message.message_id for message in request_model.messages],
+                "status": "processing",
+                "info": "Requests queued for background processing"
+            }
+        )
+
+    except Exception as e:
+        log(f'exception in /generate/postMessages: {e}')
+        log(f'stack: {traceback.print_exc()}')
+        return JSONResponse(
+            status_code=500,
+            content=f"Internal server error: {str(e)}"
+        )
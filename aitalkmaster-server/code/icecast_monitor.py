@@ -14,6 +14,7 @@ from code.audio_utils import stop_aitalkmaster_stream, stop_translation_stream
 from code.shared import config, log
 from code.config import IcecastClientConfig
 from code.aitalkmaster_views import reset_aitalkmaster
+from code.archive_jobs import archive_jobs
 
 def get_mounts(IcecastClientConfig: IcecastClientConfig) -> list[str]:
     """Get all mount points from Icecast XML response"""
@@ -34,7 +35,7 @@ def get_mounts(IcecastClientConfig: IcecastClientConfig) -> list[str]:
             if mount_attr:
                 mounts.append(mount_attr)
         
-        log(f"Mounts: {mounts}")
+        log(f"Mounts: {mounts}", "debug", "monitor")
         return mounts
         
     except Exception as e:
@@ -141,7 +142,7 @@ def background_aitalkmaster_monitor():
     while True:
         try:
             
-            log("Background aitalkmaster monitor: Checking active ait instances and translation sessions...")
+            log("Background aitalkmaster monitor: Checking active ait instances and translation sessions...", "debug", "monitor")
             
             # Get the keep-alive list from config
             keep_alive_list = config.aitalkmaster.join_key_keep_alive_list if config.aitalkmaster else []
@@ -156,12 +157,12 @@ def background_aitalkmaster_monitor():
                     # this instance is kept alive, so we don't need to check if it's still active
                     continue
 
-                log(f"Checking ait instance: {join_key}, created: {ait_instance.created_at}, last_listened: {ait_instance.last_listened_at}")
+                log(f"Checking ait instance: {join_key}, created: {ait_instance.created_at}, last_listened: {ait_instance.last_listened_at}", "debug", "monitor")
                 
                 mount_path = f"/aitalkmaster/{join_key}"
 
                 if mount_path not in mounts:
-                    log(f"Mount {mount_path} not found in icecast")
+                    log(f"Mount {mount_path} not found in icecast", "debug", "monitor")
                     stats = 0
                 else:
                     # use stats function to get number of listeners
@@ -178,12 +179,12 @@ def background_aitalkmaster_monitor():
             # Check each active translation session
             translation_sessions_to_remove = []
             for session_key, translation_session in active_translation_sessions.items():
-                log(f"Checking translation session: {session_key}, created: {translation_session.created_at}, last_listened: {translation_session.last_listened_at}")
+                log(f"Checking translation session: {session_key}, created: {translation_session.created_at}, last_listened: {translation_session.last_listened_at}", "debug", "monitor")
                 
                 mount_path = f"/translation/{session_key}"
 
                 if mount_path not in mounts:
-                    log(f"Translation mount {mount_path} not found in icecast")
+                    log(f"Translation mount {mount_path} not found in icecast", "debug", "monitor")
                     stats = 0
                 else:
                     # use stats function to get number of listeners
@@ -216,10 +217,8 @@ def background_aitalkmaster_monitor():
             for join_key in ait_instances_to_remove:
                 if join_key in active_aitalkmaster_instances:
                     stop_aitalkmaster_stream(join_key)
-                    reset_aitalkmaster(join_key)
-                    del active_aitalkmaster_instances[join_key]
-
-                    delete_active_icecast_directory(join_key)
+                    # The archive job deletes the active directory after archiving its files
+                    reset_aitalkmaster(join_key, remove_active_dir=True)
                     log(f"Removed inactive ait instance: {join_key}")
 
             # Remove inactive translation sessions
@@ -231,12 +230,12 @@ def background_aitalkmaster_monitor():
                     log(f"Removed inactive translation session: {session_key}")
 
             active_directories = get_active_directories()
-            log(f"Active directories: {active_directories}")
+            log(f"Active directories: {active_directories}", "debug", "monitor")
 
             # Clean up detached directories (not in either active list)
             for directory_name, directory_type in active_directories:
                 if directory_type == 'aitalkmaster':
-                    if directory_name not in active_aitalkmaster_instances.keys():
+                    if directory_name not in active_aitalkmaster_instances.keys() and not archive_jobs.has_pending(directory_name):
                         delete_active_icecast_directory(directory_name)
                         log(f"Deleted detached aitalkmaster directory: {directory_name}")
                 elif directory_type == 'translation':
@@ -0,0 +1,133 @@
+"""
+Buffered log writer.
+
+log() and llm_log() only append the line to a bounded in-memory buffer. A background thread
+writes the buffered lines in batches to the log files it keeps open, and rotates a file when it
+grows past max_bytes. When the buffer is full the oldest lines are dropped and the number of
+dropped lines is written with the next batch.
+"""
+import os
+import sys
+import threading
+from collections import deque
+from typing import Optional, TextIO
+
+LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+
+# A batch is written early once this many lines are waiting
+FLUSH_BATCH_LINES = 500
+
+class LogWriter:
+    """Ring buffer of (file path, line) drained by one writer thread"""
+
+    def __init__(self, buffer_size: int, flush_interval_seconds: float, max_bytes: int, backup_count: int, stdout: bool):
+        self._buffer: deque = deque(maxlen=buffer_size)
+        self._condition = threading.Condition()
+        # Taken before the condition is released, so batches reach the files in the order they were taken
+        self._write_lock = threading.Lock()
+        self._flush_interval_seconds = flush_interval_seconds
+        self._max_bytes = max_bytes
+        self._backup_count = backup_count
+        self._stdout = stdout
+        self._files: dict[str, TextIO] = {}
+        self._dropped = 0
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+
+    def write(self, path: str, line: str):
+        with self._condition:
+            if len(self._buffer) == self._buffer.maxlen:
+                self._dropped += 1
+            self._buffer.append((path, line))
+            if self._closed:
+                # After close (interpreter shutdown) lines are written directly, after the lines still buffered
+                self._flush_locked()
+                return
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name="LogWriter")
+                self._thread.start()
+            if len(self._buffer) >= FLUSH_BATCH_LINES:
+                self._condition.notify()
+
+    def _take_batch(self) -> tuple[list, int]:
+        batch = list(self._buffer)
+        self._buffer.clear()
+        dropped = self._dropped
+        self._dropped = 0
+        return batch, dropped
+
+    def _flush_locked(self):
+        """Write the buffered lines on the calling thread, the condition must be held"""
+        batch, dropped = self._take_batch()
+        with self._write_lock:
+            self._write_batch(batch, dropped)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._closed and len(self._buffer) < FLUSH_BATCH_LINES:
+                    self._condition.wait(timeout=self._flush_interval_seconds)
+                batch, dropped = self._take_batch()
+                closed = self._closed
+                self._write_lock.acquire()
+            try:
+                self._write_batch(batch, dropped)
+            except Exception as e:
+                print(f"Error writing log batch: {e}")
+            finally:
+                self._write_lock.release()
+            if closed:
+                return
+
+    def _open(self, path: str) -> TextIO:
+        file = self._files.get(path)
+        if file is None:
+            file = open(path, "a")
+            self._files[path] = file
+        return file
+
+    def _rotate(self, path: str):
+        self._files.pop(path).close()
+        for index in range(self._backup_count - 1, 0, -1):
+            if os.path.exists(f"{path}.{index}"):
+                os.replace(f"{path}.{index}", f"{path}.{index + 1}")
+        if self._backup_count > 0:
+            os.replace(path, f"{path}.1")
+        else:
+            os.remove(path)
+
+    def _write_batch(self, batch: list, dropped: int):
+        if not batch and not dropped:
+            return
+        lines_by_path: dict[str, list[str]] = {}
+        for path, line in batch:
+            lines_by_path.setdefault(path, []).append(line)
+        if dropped:
+            dropped_line = f"[log] {dropped} log lines dropped, the log buffer was full"
+            for lines in lines_by_path.values():
+                lines.insert(0, dropped_line)
+
+        for path, lines in lines_by_path.items():
+            file = self._open(path)
+            file.write("\n".join(lines) + "\n")
+            file.flush()
+            if self._max_bytes > 0 and file.tell() > self._max_bytes:
+                self._rotate(path)
+
+        if self._stdout:
+            sys.stdout.write("\n".join(line for _, line in batch) + "\n")
+            sys.stdout.flush()
+
+    def close(self):
+        """Write the buffered lines and stop the writer thread"""
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+            self._condition.notify()
+        if thread is not None:
+            thread.join(timeout=5)
+        # Lines written while the thread was finishing its last batch
+        with self._condition:
+            self._flush_locked()
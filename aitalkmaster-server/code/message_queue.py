@@ -1,15 +1,20 @@
 """
 Unified message queue system for processing all types of postMessage requests
 """
-import queue
+import asyncio
 import threading
+import time
 import traceback
+from collections import deque, OrderedDict
 from enum import Enum
-from dataclasses import dataclass
-from typing import Union, Callable, Any
+from dataclasses import dataclass, field
+from typing import Union, Callable, Any, Dict, Tuple
 
-from code.shared import log
-from code.request_models import AitPostMessageRequest, ConversationPostMessageRequest, GenerateRequest, AitGenerateAudioRequest, TranslationRequest
+from code.shared import config, log
+from code.async_engine import async_engine
+from code.metrics import QUEUE_WAIT, JOB_DURATION, JOB_ERRORS
+from code.tracing import tracer, activate_trace, release_trace, run_traced
+from code.request_models import AitPostMessageRequest, AitSceneMessageRequest, ConversationPostMessageRequest, GenerateRequest, AitGenerateAudioRequest, TranslationRequest
 
 class RequestType(Enum):
     """Type of request in the queue"""
@@ -22,9 +27,11 @@ class RequestType(Enum):
 class QueuedMessageRequest:
     """Unified queued message request for background processing"""
     request_type: RequestType
-    request_model: Union[AitPostMessageRequest, ConversationPostMessageRequest, GenerateRequest, TranslationRequest]
+    request_model: Union[AitPostMessageRequest, AitSceneMessageRequest, ConversationPostMessageRequest, GenerateRequest, TranslationRequest]
     ip_address: str
     processor: Callable[[Any, str], None]  # Function to process this request: (request_model, ip_address) -> None
+    dispatch_key: str = ""  # Requests with the same dispatch key are processed in order, one at a time
+    enqueued_at: float = field(default_factory=time.time)
 
 @dataclass
 class QueuedAudioGenerationRequest:
@@ -32,65 +39,257 @@ class QueuedAudioGenerationRequest:
     request_model: Union[AitGenerateAudioRequest]  # Supports ait audio generation only
     ip_address: str
     processor: Callable[[Any, str], None]  # Function to process this request: (request_model, ip_address) -> None
+    dispatch_key: str = ""
+    enqueued_at: float = field(default_factory=time.time)
+
+@dataclass
+class QueueClassStats:
+    """Depth and wait time counters for one scheduling class"""
+    enqueued: int = 0
+    dispatched: int = 0
+    depth: int = 0
+    total_wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "enqueued": self.enqueued,
+            "dispatched": self.dispatched,
+            "depth": self.depth,
+            "avg_wait_seconds": self.total_wait_seconds / self.dispatched if self.dispatched else 0.0,
+            "max_wait_seconds": self.max_wait_seconds
+        }
+
+class KeyedDispatcher:
+    """Queue that hands out requests for the same key in order and one at a time.
+
+    Requests with different keys are handed out in parallel to any free worker.
+    A key is "scheduled" while it has an entry in _pending: it is then either waiting
+    in _ready or held by exactly one worker until that worker calls task_done(key).
+
+    Ready keys are scheduled by the (class, priority, fairness key) of their oldest item:
+    the lowest priority number goes first and within a priority the fairness keys
+    (rate limit IP addresses) take turns. An item that waited longer than
+    starvation_seconds is served before higher priorities, so no class starves.
+    """
+
+    def __init__(self, name: str, classify: Callable[[Any], Tuple[str, int, str]], starvation_seconds: float = 30.0):
+        self.name = name
+        self._classify = classify
+        self._starvation_seconds = starvation_seconds
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._pending: Dict[str, deque] = {}
+        # priority -> fairness key -> ready keys, the first fairness key is served next
+        self._ready: Dict[int, OrderedDict] = {}
+        self._ready_count = 0
+        self._stats: Dict[str, QueueClassStats] = {}
+
+    def _mark_ready(self, key: str):
+        _, priority, fairness_key = self._classify(self._pending[key][0])
+        self._ready.setdefault(priority, OrderedDict()).setdefault(fairness_key, deque()).append(key)
+        self._ready_count += 1
+        self._not_empty.notify()
+
+    def _head_waited(self, fairness_ring: OrderedDict, now: float) -> float:
+        key = next(iter(fairness_ring.values()))[0]
+        return now - self._pending[key][0].enqueued_at
+
+    def _select_priority(self) -> int:
+        priorities = sorted(priority for priority, ring in self._ready.items() if ring)
+        now = time.time()
+        for priority in priorities[1:]:
+            if self._head_waited(self._ready[priority], now) > self._starvation_seconds:
+                return priority
+        return priorities[0]
+
+    def put(self, key: str, item: Any):
+        """Add an item for a key, the key becomes ready if no worker holds it"""
+        with self._lock:
+            class_name, _, _ = self._classify(item)
+            stats = self._stats.setdefault(class_name, QueueClassStats())
+            stats.enqueued += 1
+            stats.depth += 1
+
+            pending = self._pending.get(key)
+            if pending is None:
+                self._pending[key] = deque([item])
+                self._mark_ready(key)
+            else:
+                pending.append(item)
+
+    def get(self) -> Tuple[str, Any]:
+        """Block until a key is ready and return the key with its oldest item"""
+        with self._not_empty:
+            while self._ready_count == 0:
+                self._not_empty.wait()
+
+            fairness_ring = self._ready[self._select_priority()]
+            fairness_key, keys = fairness_ring.popitem(last=False)
+            key = keys.popleft()
+            if keys:
+                # This fairness key had more ready keys, it takes its next turn after the others
+                fairness_ring[fairness_key] = keys
+            self._ready_count -= 1
+
+            item = self._pending[key].popleft()
+            wait_seconds = time.time() - item.enqueued_at
+            class_name = self._classify(item)[0]
+            stats = self._stats[class_name]
+            stats.dispatched += 1
+            stats.depth -= 1
+            stats.total_wait_seconds += wait_seconds
+            stats.max_wait_seconds = max(stats.max_wait_seconds, wait_seconds)
+        QUEUE_WAIT.observe(wait_seconds, queue=self.name, request_type=class_name)
+        return key, item
+
+    def task_done(self, key: str):
+        """Release a key after its item was processed, requeue the key if more items are waiting"""
+        with self._lock:
+            if self._pending[key]:
+                # Put the key at the back so busy keys do not starve other keys
+                self._mark_ready(key)
+            else:
+                del self._pending[key]
+
+    def qsize(self) -> int:
+        """Number of items that are waiting and not yet handed to a worker"""
+        with self._lock:
+            return sum(len(pending) for pending in self._pending.values())
+
+    def get_stats(self) -> dict:
+        """Per class queue counters"""
+        with self._lock:
+            return {class_name: stats.to_dict() for class_name, stats in self._stats.items()}
+
+def get_dispatch_key(request_type: RequestType, request_model: Any) -> str:
+    """Key that serializes requests touching the same shared state.
+
+    AIT, conversation and translation requests share per-key state (dialog, audio sequence
+    and liquidsoap queue order), generate requests are independent of each other.
+    """
+    if request_type == RequestType.AIT:
+        return f"ait:{request_model.join_key}"
+    if request_type == RequestType.CONVERSATION:
+        return f"conversation:{request_model.conversation_key}"
+    if request_type == RequestType.TRANSLATION:
+        return f"translation:{request_model.session_key}"
+    return f"{request_type.value}:{getattr(request_model, 'message_id', id(request_model))}"
+
+def classify_message_request(queued_request: QueuedMessageRequest) -> Tuple[str, int, str]:
+    """Scheduling class, priority and fairness key of a queued message request"""
+    request_type = queued_request.request_type.value
+    return request_type, config.server.queue.priorities.get(request_type, 0), queued_request.ip_address
+
+def classify_audio_generation_request(queued_request: QueuedAudioGenerationRequest) -> Tuple[str, int, str]:
+    """Audio generation requests share one class, only fairness between IP addresses applies"""
+    return "audio_generation", 0, queued_request.ip_address
 
 # Global queue for all message requests
-message_queue = queue.Queue()
+message_queue = KeyedDispatcher("message_queue", classify_message_request, starvation_seconds=config.server.queue.starvation_seconds)
 
 # Separate queue for audio generation requests (doesn't wait for other content)
-audio_generation_queue = queue.Queue()
+audio_generation_queue = KeyedDispatcher("audio_generation_queue", classify_audio_generation_request, starvation_seconds=config.server.queue.starvation_seconds)
 
-def queue_message_request(request_type: RequestType, request_model: Union[AitPostMessageRequest, ConversationPostMessageRequest, GenerateRequest, TranslationRequest], ip_address: str, processor: Callable):
+def get_queue_stats() -> dict:
+    """Per class depth and wait time counters of both queues"""
+    return {
+        "message_queue": message_queue.get_stats(),
+        "audio_generation_queue": audio_generation_queue.get_stats()
+    }
+
+def queue_message_request(request_type: RequestType, request_model: Union[AitPostMessageRequest, AitSceneMessageRequest, ConversationPostMessageRequest, GenerateRequest, TranslationRequest], ip_address: str, processor: Callable):
     """Queue a message request for background processing"""
     queued_request = QueuedMessageRequest(
         request_type=request_type,
         request_model=request_model,
         ip_address=ip_address,
-        processor=processor
+        processor=processor,
+        dispatch_key=get_dispatch_key(request_type, request_model)
     )
-    message_queue.put(queued_request)
+    message_queue.put(queued_request.dispatch_key, queued_request)
+
+def run_processor(dispatcher: KeyedDispatcher, dispatch_key: str, queued_request: Any, worker_name: str, description: str, request_type: str) -> bool:
+    """Run the processor of a queued request.
+
+    Blocking processors run on the worker thread. Coroutine processors are handed to the
+    async engine and the key is released when the coroutine finishes, so the worker is free
+    for the next key while the LLM/TTS calls are in flight.
+
+    Returns:
+        True if the processor was handed to the async engine and releases the key itself
+    """
+    start = time.perf_counter()
+    trace = tracer.start(request_type, description, queued_request.enqueued_at)
+    if not asyncio.iscoroutinefunction(queued_request.processor):
+        try:
+            with JOB_DURATION.time(request_type=request_type), activate_trace(trace):
+                queued_request.processor(queued_request.request_model, queued_request.ip_address)
+        except Exception as e:
+            release_trace(trace, str(e))
+            raise
+        release_trace(trace)
+        log(f'{worker_name}: Completed processing {description}')
+        return False
+
+    def on_done(future):
+        try:
+            JOB_DURATION.observe(time.perf_counter() - start, request_type=request_type)
+            exception = future.exception()
+            release_trace(trace, None if exception is None else str(exception))
+            if exception is not None:
+                JOB_ERRORS.inc(request_type=request_type)
+                log(f'Error in async processing of {description}: {exception}')
+            else:
+                log(f'Async engine: Completed processing {description}')
+        finally:
+            dispatcher.task_done(dispatch_key)
+
+    async_engine.submit(run_traced(trace, queued_request.processor(queued_request.request_model, queued_request.ip_address)), on_done)
+    return True
 
 def background_message_worker():
     """Background worker thread that processes queued message requests"""
     worker_name = threading.current_thread().name
     while True:
+        # Get a queued request (blocks until one is available)
+        dispatch_key, queued_request = message_queue.get()
+        handed_off = False
         try:
-            # Get a queued request (blocks until one is available)
-            queued_request = message_queue.get()
-            
             # Get message_id for logging (all request types have this field)
             message_id = getattr(queued_request.request_model, 'message_id', 'unknown')
             
             log(f'{worker_name}: Processing queued {queued_request.request_type.value} request for message_id: {message_id}')
             
             # Process the request using the provided processor function
-            queued_request.processor(queued_request.request_model, queued_request.ip_address)
-            
-            log(f'{worker_name}: Completed processing {queued_request.request_type.value} message_id: {message_id}')
-            
-            # Mark the task as done
-            message_queue.task_done()
+            handed_off = run_processor(message_queue, dispatch_key, queued_request, worker_name, f'{queued_request.request_type.value} message_id: {message_id}', queued_request.request_type.value)
             
         except Exception as e:
             log(f'Error in {worker_name}: {e}')
             log(f'stack: {traceback.print_exc()}')
+        finally:
+            # Release the key so the next request for it can be processed
+            if not handed_off:
+                message_queue.task_done(dispatch_key)
 
 def queue_audio_generation_request(request_model: Union[AitGenerateAudioRequest, TranslationRequest], ip_address: str, processor: Callable):
     """Queue an audio generation or translation request for background processing in a separate queue"""
     queued_request = QueuedAudioGenerationRequest(
         request_model=request_model,
         ip_address=ip_address,
-        processor=processor
+        processor=processor,
+        dispatch_key=f"ait:{getattr(request_model, 'join_key', None) or getattr(request_model, 'session_key', '')}"
     )
-    audio_generation_queue.put(queued_request)
+    audio_generation_queue.put(queued_request.dispatch_key, queued_request)
 
 def background_audio_generation_worker():
     """Background worker thread that processes queued audio generation and translation requests"""
     worker_name = threading.current_thread().name
     while True:
+        # Get a queued request (blocks until one is available)
+        dispatch_key, queued_request = audio_generation_queue.get()
+        handed_off = False
         try:
-            # Get a queued request (blocks until one is available)
-            queued_request = audio_generation_queue.get()
-            
             # Get identifier for logging (join_key for audio generation, session_key for translation)
             identifier = getattr(queued_request.request_model, 'join_key', None) or getattr(queued_request.request_model, 'session_key', 'unknown')
             request_type = 'translation' if hasattr(queued_request.request_model, 'session_key') else 'audio generation'
@@ -98,16 +297,14 @@ def background_audio_generation_worker():
             log(f'{worker_name}: Processing queued {request_type} request for {identifier}')
             
             # Process the request using the provided processor function
-            queued_request.processor(queued_request.request_model, queued_request.ip_address)
-            
-            log(f'{worker_name}: Completed processing {request_type} request for {identifier}')
-            
-            # Mark the task as done
-            audio_generation_queue.task_done()
+            handed_off = run_processor(audio_generation_queue, dispatch_key, queued_request, worker_name, f'{request_type} request for {identifier}', request_type.replace(' ', '_'))
             
         except Exception as e:
             log(f'Error in {worker_name}: {e}')
             log(f'stack: {traceback.print_exc()}')
+        finally:
+            if not handed_off:
+                audio_generation_queue.task_done(dispatch_key)
 
 def start_background_message_workers(num_workers: int = 4):
     """Start multiple background message worker threads
@@ -0,0 +1,185 @@
+"""
+Counters, gauges and latency histograms in the Prometheus text format.
+
+Recording is a dict update under a per-metric lock, so instruments can stay on in production.
+Values that already exist elsewhere (queue depths, active instances, cache sizes, eviction
+counts) are not duplicated here, they are read by collectors when /metrics is scraped.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterable, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_labels(label_names: Tuple[str, ...], label_values: Tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Metric:
+    metric_type = ""
+
+    def __init__(self, name: str, help_text: str, label_names: Iterable[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values: dict = {}
+
+    def _key(self, labels: dict) -> Tuple:
+        return tuple(labels.get(name, "") for name in self.label_names)
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+
+class Counter(Metric):
+    metric_type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return self.header() + [f"{self.name}{format_labels(self.label_names, key)} {value}" for key, value in values]
+
+class Gauge(Metric):
+    metric_type = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return self.header() + [f"{self.name}{format_labels(self.label_names, key)} {value}" for key, value in values]
+
+class Histogram(Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name: str, help_text: str, label_names: Iterable[str] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # per bucket counts (not cumulative), sum, count
+                entry = [[0] * len(self.buckets), 0.0, 0]
+                self._values[key] = entry
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with block, also when it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = [(key, (list(entry[0]), entry[1], entry[2])) for key, entry in self._values.items()]
+        lines = self.header()
+        for key, (bucket_counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                bucket_labels = format_labels(self.label_names, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            bucket_labels = format_labels(self.label_names, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+            lines.append(f"{self.name}_sum{format_labels(self.label_names, key)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.label_names, key)} {count}")
+        return lines
+
+class MetricsRegistry:
+    """Instruments plus collectors that export gauges read at scrape time"""
+
+    def __init__(self):
+        self._metrics: list[Metric] = []
+        self._collectors: list[Callable[[], Iterable[Metric]]] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, label_names: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, help_text, label_names))
+
+    def histogram(self, name: str, help_text: str, label_names: Iterable[str] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, label_names, buckets))
+
+    def add_collector(self, collector: Callable[[], Iterable[Metric]]):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for metric in collector():
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
+
+# Queues and jobs
+QUEUE_WAIT = registry.histogram("ait_queue_wait_seconds", "Time requests waited in a queue before a worker took them", ["queue", "request_type"])
+JOB_DURATION = registry.histogram("ait_job_duration_seconds", "Processing time of queued requests", ["request_type"])
+JOB_ERRORS = registry.counter("ait_job_errors_total", "Queued requests whose processor raised", ["request_type"])
+
+# Backends
+LLM_LATENCY = registry.histogram("ait_llm_request_seconds", "Latency of chat backend calls", ["backend", "model"])
+LLM_ERRORS = registry.counter("ait_llm_errors_total", "Failed chat backend calls", ["backend", "model"])
+LLM_TOKENS = registry.counter("ait_llm_tokens_total", "Tokens of chat backend calls by kind (prompt, cached as reported, cached_derived from Ollama's evaluated tokens, completion)", ["backend", "kind"])
+TTS_LATENCY = registry.histogram("ait_tts_request_seconds", "Latency of text-to-speech calls", ["model", "voice"])
+TTS_ERRORS = registry.counter("ait_tts_errors_total", "Failed text-to-speech calls", ["model", "voice"])
+TTS_AUDIO_SECONDS = registry.counter("ait_tts_audio_seconds_total", "Seconds of synthesized audio", ["voice"])
+LIQUIDSOAP_LATENCY = registry.histogram("ait_liquidsoap_command_seconds", "Latency of Liquidsoap HTTP commands", ["command"], buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+LIQUIDSOAP_FAILURES = registry.counter("ait_liquidsoap_failures_total", "Failed Liquidsoap HTTP commands", ["command", "reason"])
+
+# Requests
+RATE_LIMIT_REJECTIONS = registry.counter("ait_rate_limit_rejections_total", "Requests rejected by the rate limit", ["reason"])
+
+@contextmanager
+def timed_call(histogram: Histogram, errors: Counter, **labels):
+    """Observe the latency of a backend call and count it as failed when it raises"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        errors.inc(**labels)
+        raise
+    finally:
+        histogram.observe(time.perf_counter() - start, **labels)
+
+def gauge_family(name: str, help_text: str, label_names: Iterable[str], values: Iterable[Tuple[Tuple, float]]) -> Gauge:
+    """Gauge filled with (label values, value) pairs, for collectors"""
+    gauge = Gauge(name, help_text, label_names)
+    for label_values, value in values:
+        gauge.set(value, **dict(zip(gauge.label_names, label_values)))
+    return gauge
+
+def counter_family(name: str, help_text: str, label_names: Iterable[str], values: Iterable[Tuple[Tuple, float]]) -> Counter:
+    """Counter filled with (label values, total) pairs, for collectors reading cumulative counts kept elsewhere"""
+    counter = Counter(name, help_text, label_names)
+    for label_values, value in values:
+        counter.inc(value, **dict(zip(counter.label_names, label_values)))
+    return counter
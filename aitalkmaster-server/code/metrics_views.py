@@ -0,0 +1,65 @@
+from fastapi import Request
+from fastapi.responses import PlainTextResponse
+
+from code.shared import app, config
+from code.admin_views import admin_token_error
+from code.metrics import registry, gauge_family, counter_family
+from code.message_queue import message_queue, audio_generation_queue
+from code.aitalkmaster_views import active_aitalkmaster_instances, tts_stage, publish_stage
+from code.conversation_views import conversation_store
+from code.generate_views import generate_results
+from code.translation_views import active_translation_sessions
+from code.chat_request import get_prompt_cache_stats
+from code.notifications import notifications
+from code.webhook_delivery import webhooks
+from code.rate_limiter import rate_limiter
+
+def collect_queues():
+    queue_stats = [(dispatcher.name, dispatcher.get_stats()) for dispatcher in (message_queue, audio_generation_queue)]
+    yield gauge_family("ait_queue_depth", "Requests waiting in a queue", ["queue", "request_type"],
+                       [((name, class_name), stats["depth"]) for name, per_class in queue_stats for class_name, stats in per_class.items()])
+    yield gauge_family("ait_pipeline_queue_depth", "Audio clips waiting for a pipeline stage", ["stage"],
+                       [(("tts",), tts_stage.qsize()), (("publish",), publish_stage.qsize())])
+    yield gauge_family("ait_unpublished_clips", "Audio clips of active AI Talkmaster instances not published or skipped yet", [],
+                       [((), sum(ait_instance.unpublished_clip_count() for ait_instance in list(active_aitalkmaster_instances.values())))])
+
+def collect_sessions():
+    conversations = conversation_store.get_stats()
+    results = generate_results.get_stats()
+    yield gauge_family("ait_active_streams", "Active AI Talkmaster instances and translation sessions", ["kind"],
+                       [(("ait",), len(active_aitalkmaster_instances)), (("translation",), len(active_translation_sessions))])
+    yield gauge_family("ait_conversations", "Conversations held in memory", [], [((), conversations["size"])])
+    yield counter_family("ait_conversation_evictions_total", "Conversations evicted from memory", ["reason"],
+                       [(("capacity",), conversations["evicted_capacity"]), (("idle",), conversations["evicted_idle"])])
+    yield gauge_family("ait_generate_results", "Generate results held in memory", [], [((), results["size"])])
+    yield gauge_family("ait_generate_results_bytes", "Size of the generate results held in memory", [], [((), results["bytes"])])
+
+def collect_delivery():
+    webhook_stats = webhooks.get_stats()
+    notification_stats = notifications.get_stats()
+    yield counter_family("ait_webhook_deliveries_total", "Webhook deliveries by outcome", ["outcome"],
+                         [((outcome,), webhook_stats[outcome]) for outcome in ("queued", "delivered", "retried", "failed", "dropped")])
+    yield gauge_family("ait_webhook_pending", "Webhook deliveries waiting for a worker", [], [((), webhook_stats["pending"])])
+    yield gauge_family("ait_event_listeners", "Long-poll waiters and server-sent event subscribers", ["kind"],
+                       [(("waiters",), notification_stats["waiters"]), (("subscribers",), notification_stats["subscribers"])])
+    yield gauge_family("ait_rate_limit_tracked_ips", "IP addresses with usage in the rate limit window", [],
+                       [((), rate_limiter.get_stats()["tracked_ip_addresses"])])
+
+def collect_prompt_cache():
+    yield gauge_family("ait_prompt_cached_ratio", "Share of prompt tokens served from the backend prompt cache, reported by the backend or derived", ["backend", "source"],
+                       [((backend, stats["source"]), stats["cached_ratio"]) for backend, stats in get_prompt_cache_stats().items()])
+
+registry.add_collector(collect_queues)
+registry.add_collector(collect_sessions)
+registry.add_collector(collect_delivery)
+registry.add_collector(collect_prompt_cache)
+
+@app.get("/metrics")
+def metrics(fastapi_request: Request):
+    """Metrics in the Prometheus text exposition format, protected by the admin token when one is configured"""
+    # Without an admin token the metrics stay open, they only hold aggregate counts and timings
+    if config.server.admin_token:
+        error = admin_token_error(fastapi_request)
+        if error is not None:
+            return error
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,129 @@
+"""
+Completion notifications for the queued requests.
+
+The background processors publish an event when a result is ready. Long-poll requests wait for
+the event of their message_id instead of returning 425 right away, and event stream subscribers
+get every event of their channel (a join_key or conversation_key).
+
+Events can be published from any thread, waiters and subscribers are woken on their own loop.
+"""
+import asyncio
+import json
+import threading
+from typing import Any, AsyncIterator, Callable, Optional
+
+from code.shared import config, log
+
+# Events buffered per event stream subscriber, a subscriber that does not keep up loses events
+SUBSCRIBER_QUEUE_SIZE = 256
+
+def ait_channel(join_key: str) -> str:
+    return f"ait:{join_key}"
+
+def conversation_channel(conversation_key: str) -> str:
+    return f"conversation:{conversation_key}"
+
+GENERATE_CHANNEL = "generate"
+
+class NotificationHub:
+    """Wait/notify registry keyed by channel and message_id, plus per-channel event subscribers"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (channel, message_id) -> futures of the waiting long-poll requests
+        self._waiters: dict[tuple[str, str], list[asyncio.Future]] = {}
+        # channel -> (loop, queue) of the event stream subscribers
+        self._subscribers: dict[str, list[tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+        self._dropped_events = 0
+
+    def publish(self, channel: str, message_id: Optional[str], event: dict):
+        """Wake the waiters of message_id and hand the event to the subscribers of the channel"""
+        with self._lock:
+            waiters = self._waiters.pop((channel, message_id), []) if message_id is not None else []
+            subscribers = list(self._subscribers.get(channel, []))
+
+        try:
+            for future in waiters:
+                future.get_loop().call_soon_threadsafe(self._resolve, future, event)
+            for loop, subscriber_queue in subscribers:
+                loop.call_soon_threadsafe(self._enqueue, subscriber_queue, event)
+        except RuntimeError as e:
+            # The loop of a waiter was closed (server shutdown)
+            log(f"Could not deliver {event['type']} event on {channel}: {e}")
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, event: dict):
+        if not future.done():
+            future.set_result(event)
+
+    def _enqueue(self, subscriber_queue: asyncio.Queue, event: dict):
+        try:
+            subscriber_queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self._dropped_events += 1
+
+    async def wait(self, channel: str, message_id: str, timeout: float, lookup: Callable[[], Optional[Any]]) -> Optional[Any]:
+        """Wait up to timeout seconds until lookup returns a result.
+
+        The waiter is registered before the first lookup, so a result published in between is not missed.
+        """
+        future = asyncio.get_running_loop().create_future()
+        key = (channel, message_id)
+        with self._lock:
+            self._waiters.setdefault(key, []).append(future)
+        try:
+            result = lookup()
+            if result is not None:
+                return result
+            try:
+                await asyncio.wait_for(asyncio.shield(future), timeout=min(timeout, config.server.long_poll_max_seconds))
+            except asyncio.TimeoutError:
+                return None
+            return lookup()
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(key)
+                if waiters is not None and future in waiters:
+                    waiters.remove(future)
+                    if not waiters:
+                        del self._waiters[key]
+
+    async def subscribe(self, channel: str) -> AsyncIterator[Optional[dict]]:
+        """Yield the events of a channel, None every sse_heartbeat_seconds without an event"""
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE))
+        subscriber_queue = subscriber[1]
+        with self._lock:
+            self._subscribers.setdefault(channel, []).append(subscriber)
+        log(f"Event stream subscribed to {channel}")
+        try:
+            while True:
+                try:
+                    yield await asyncio.wait_for(subscriber_queue.get(), timeout=config.server.sse_heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            with self._lock:
+                subscribers = self._subscribers.get(channel, [])
+                if subscriber in subscribers:
+                    subscribers.remove(subscriber)
+                if not subscribers:
+                    self._subscribers.pop(channel, None)
+            log(f"Event stream unsubscribed from {channel}")
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "waiters": sum(len(waiters) for waiters in self._waiters.values()),
+                "subscribers": sum(len(subscribers) for subscribers in self._subscribers.values()),
+                "dropped_events": self._dropped_events
+            }
+
+async def event_stream(channel: str) -> AsyncIterator[str]:
+    """Server-sent events of a channel, heartbeats are sent as comments"""
+    async for event in notifications.subscribe(channel):
+        if event is None:
+            yield ": keep-alive\n\n"
+        else:
+            yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+notifications = NotificationHub()
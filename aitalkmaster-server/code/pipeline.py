@@ -0,0 +1,57 @@
+"""
+Pipeline stages for the async engine.
+
+A stage is a bounded asyncio queue drained by its own pool of worker tasks. Putting an item
+into a full stage waits, so a slow stage pushes back on the stage before it instead of
+buffering without limit.
+"""
+import asyncio
+import traceback
+from typing import Any, Awaitable, Callable, List, Optional
+
+from code.shared import log
+
+class PipelineStage:
+    """Bounded hand-off queue with its own worker tasks running on the async engine loop"""
+
+    def __init__(self, name: str, handler: Callable[[Any], Awaitable[None]], num_workers: int, queue_size: int):
+        self.name = name
+        self._handler = handler
+        self._num_workers = num_workers
+        self._queue_size = queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _ensure_started(self):
+        # The queue and the workers belong to the loop of the first put, a new loop (engine reattached) restarts them
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=self._queue_size)
+        self._workers = [
+            loop.create_task(self._worker(), name=f"{self.name}-{i+1}")
+            for i in range(self._num_workers)
+        ]
+        log(f"Pipeline stage {self.name}: started {self._num_workers} workers, queue size {self._queue_size}")
+
+    async def put(self, item: Any):
+        """Hand an item to this stage, waits while the stage queue is full"""
+        self._ensure_started()
+        await self._queue.put(item)
+
+    def qsize(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def _worker(self):
+        queue = self._queue
+        while True:
+            item = await queue.get()
+            try:
+                await self._handler(item)
+            except Exception as e:
+                log(f'Error in pipeline stage {self.name}: {e}')
+                log(f'stack: {traceback.format_exc()}')
+            finally:
+                queue.task_done()
@@ -1,47 +1,113 @@
-
-
 import time
-from typing import Dict
-from collections import defaultdict, deque
+import threading
+import zlib
+from typing import Dict, Optional
+from collections import deque
 from code.shared import config, log
 from fastapi import Request
 
-# In-memory storage for rate limiting
-# Structure: {ip_address: deque of (timestamp, weight) tuples}
-rate_limit_storage: Dict[str, deque] = defaultdict(lambda: deque())
+# Usage is summed over a sliding day in buckets of one minute, so the day total is exact to within a minute
+WINDOW_SECONDS = 86400
+BUCKET_SECONDS = 60
+# IP addresses are spread over shards with their own lock, so request threads rarely wait for each other
+NUM_SHARDS = 16
+# Entries of IP addresses without usage in the window are removed this often
+IDLE_CLEANUP_SECONDS = 300
 
-def clean_old_entries(ip_address: str, current_time: float, window_seconds: int):
-    if ip_address not in rate_limit_storage:
-        return
-    
-    # Remove entries older than the window
-    while (rate_limit_storage[ip_address] and 
-           current_time - rate_limit_storage[ip_address][0][0] > window_seconds):
-        rate_limit_storage[ip_address].popleft()
-
-def get_total_weight(ip_address: str, window_seconds: int) -> float:
-    current_time = time.time()
-    clean_old_entries(ip_address, current_time, window_seconds)
-    
-    total_weight = 0.0
-    for timestamp, weight in rate_limit_storage[ip_address]:
-        total_weight += weight
-    
-    return total_weight
+class UsageWindow:
+    """Usage of one IP address: per-minute buckets of the last day and their running total"""
+
+    def __init__(self):
+        self.buckets: deque = deque()  # [bucket_start, weight], oldest first
+        self.total = 0.0
+
+    def expire(self, current_time: float):
+        oldest_allowed = current_time - WINDOW_SECONDS
+        while self.buckets and self.buckets[0][0] + BUCKET_SECONDS <= oldest_allowed:
+            _, weight = self.buckets.popleft()
+            self.total -= weight
+        if not self.buckets:
+            # Avoid float drift of the running total
+            self.total = 0.0
+
+    def add(self, current_time: float, weight: float):
+        bucket_start = current_time - current_time % BUCKET_SECONDS
+        if self.buckets and self.buckets[-1][0] == bucket_start:
+            self.buckets[-1][1] += weight
+        else:
+            self.buckets.append([bucket_start, weight])
+        self.total += weight
+
+class RateLimiterShard:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.windows: Dict[str, UsageWindow] = {}
+        self.last_cleanup = time.time()
+
+    def cleanup_idle(self, current_time: float) -> int:
+        """Remove IP addresses without usage in the window, called with the lock held"""
+        idle = []
+        for ip_address, window in self.windows.items():
+            window.expire(current_time)
+            if not window.buckets:
+                idle.append(ip_address)
+        for ip_address in idle:
+            del self.windows[ip_address]
+        self.last_cleanup = current_time
+        return len(idle)
+
+class RateLimiter:
+    """Thread safe sliding day window of the resource usage per IP address"""
+
+    def __init__(self, num_shards: int = NUM_SHARDS):
+        self._shards = [RateLimiterShard() for _ in range(num_shards)]
+
+    def _shard(self, ip_address: str) -> RateLimiterShard:
+        return self._shards[zlib.crc32(ip_address.encode()) % len(self._shards)]
+
+    def add(self, ip_address: str, weight: float):
+        current_time = time.time()
+        shard = self._shard(ip_address)
+        with shard.lock:
+            window = shard.windows.get(ip_address)
+            if window is None:
+                window = UsageWindow()
+                shard.windows[ip_address] = window
+            window.expire(current_time)
+            window.add(current_time, weight)
+            if current_time - shard.last_cleanup > IDLE_CLEANUP_SECONDS:
+                shard.cleanup_idle(current_time)
+
+    def total(self, ip_address: str) -> float:
+        """Usage in the last day, does not create an entry for unknown IP addresses"""
+        current_time = time.time()
+        shard = self._shard(ip_address)
+        with shard.lock:
+            if current_time - shard.last_cleanup > IDLE_CLEANUP_SECONDS:
+                shard.cleanup_idle(current_time)
+            window: Optional[UsageWindow] = shard.windows.get(ip_address)
+            if window is None:
+                return 0.0
+            window.expire(current_time)
+            return window.total
+
+    def get_stats(self) -> dict:
+        tracked = 0
+        for shard in self._shards:
+            with shard.lock:
+                tracked += len(shard.windows)
+        return {"tracked_ip_addresses": tracked, "shards": len(self._shards)}
+
+rate_limiter = RateLimiter()
+
+def get_total_weight(ip_address: str) -> float:
+    return rate_limiter.total(ip_address)
 
 def increment_resource_usage(ip_address: str, weight: float) -> None:
-    
-    current_time = time.time()
-    rate_limit_storage[ip_address].append((current_time, weight))
-    
-    # Log the increment for debugging
-    log(f"Rate limit: Incremented usage for IP {ip_address} with weight {weight} at {current_time}")
-    
-    # Clean up old entries to prevent memory bloat
-    clean_old_entries(ip_address, current_time, 86400)  # Clean entries older than 24 hours
+    rate_limiter.add(ip_address, weight)
 
 def rate_limit_exceeded(ip_address: str) -> bool:
-    day_weight = get_total_weight(ip_address, 86400)
+    day_weight = get_total_weight(ip_address)
     if day_weight > config.server.usage.rate_limit_per_day:
         log(f"Rate limit: IP {ip_address} exceeded day limit ({day_weight}/{config.server.usage.rate_limit_per_day})")
         return True
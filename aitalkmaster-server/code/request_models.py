@@ -9,6 +9,10 @@ class GenerateRequest(BaseModel):
     model: Optional[str] = ""
     options: Optional[dict] = {}
     think: Optional[bool] = False
+    callback_url: Optional[str] = "" # the response is POSTed here when it is ready
+
+class GeneratePostMessagesRequest(BaseModel):
+    messages: list[GenerateRequest]
 
 # Conversation requests (single-character conversations with history, no audio streaming)
 class ConversationStartRequest(BaseModel):
@@ -21,6 +25,7 @@ class ConversationPostMessageRequest(BaseModel):
     message: str
     message_id: str
     think: Optional[bool] = False
+    callback_url: Optional[str] = "" # the response is POSTed here when it is ready
 
 # AI Talkmaster requests (multi-character conversations with history and audio streaming)
 class AitPostMessageRequest(BaseModel):
@@ -36,6 +41,29 @@ class AitPostMessageRequest(BaseModel):
     options: Optional[dict] = {}
     audio_instructions: Optional[str] = ""
     audio_model: Optional[str] = ""
+    callback_url: Optional[str] = "" # the response is POSTed here when it is ready
+
+class AitPostMessagesRequest(BaseModel):
+    messages: list[AitPostMessageRequest] # e.g. several characters answering one prompt, queued in list order
+
+class AitSceneCharacter(BaseModel):
+    charactername: str
+    message_id: str # id of this character's response
+    model: Optional[str] = ""
+    think: Optional[bool] = False
+    system_instructions: Optional[str] = ""
+    audio_voice: Optional[str] = ""
+    options: Optional[dict] = {}
+    audio_instructions: Optional[str] = ""
+    audio_model: Optional[str] = ""
+    callback_url: Optional[str] = ""
+
+class AitSceneMessageRequest(BaseModel):
+    join_key: str
+    username: str # name of the agent that said the message
+    message: str
+    message_id: str # id of the user message
+    characters: list[AitSceneCharacter] # all characters answer the same dialog, their clips are queued in list order
 
 class AitResetJoinkeyRequest(BaseModel):
     join_key: str
@@ -60,4 +88,5 @@ class TranslationRequest(BaseModel):
     model: Optional[str] = ""
     audio_voice: Optional[str] = ""
     audio_model: Optional[str] = ""
-    message_id: str
\ No newline at end of file
+    message_id: str
+    callback_url: Optional[str] = "" # the translation is POSTed here when it is ready
\ No newline at end of file
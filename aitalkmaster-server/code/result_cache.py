@@ -0,0 +1,93 @@
+"""
+Bounded cache of finished results that clients poll for by id.
+
+Results are kept in insertion order, so the oldest result is always at the front and is the
+first to go when the entry count or the byte budget is exceeded or its TTL is over.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+class ResultCache:
+    """Results keyed by id with insertion order/TTL eviction and a byte budget"""
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl_seconds: float, size_of: Callable[[Any], int]):
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._ttl_seconds = ttl_seconds
+        self._size_of = size_of
+        # id -> (result, size in bytes, stored at), oldest first
+        self._results: OrderedDict[str, tuple[Any, int, float]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._consumed = 0
+        self._evicted = {"entries": 0, "bytes": 0, "ttl": 0}
+
+    def _pop_oldest(self, reason: str):
+        _, (_, size, _) = self._results.popitem(last=False)
+        self._bytes -= size
+        self._evicted[reason] += 1
+
+    def _evict_expired(self, now: float):
+        while self._results and self._ttl_seconds > 0 and now - next(iter(self._results.values()))[2] > self._ttl_seconds:
+            self._pop_oldest("ttl")
+
+    def put(self, result_id: str, result: Any):
+        now = time.time()
+        size = self._size_of(result)
+        with self._lock:
+            previous = self._results.pop(result_id, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._evict_expired(now)
+            while self._results and len(self._results) >= self._max_entries:
+                self._pop_oldest("entries")
+            while self._results and self._bytes + size > self._max_bytes:
+                self._pop_oldest("bytes")
+            self._results[result_id] = (result, size, now)
+            self._bytes += size
+
+    def get(self, result_id: str, consume: bool = False) -> Optional[Any]:
+        """Look up a result, consume removes it once it was read"""
+        now = time.time()
+        with self._lock:
+            self._evict_expired(now)
+            entry = self._results.get(result_id)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            if consume:
+                del self._results[result_id]
+                self._bytes -= entry[1]
+                self._consumed += 1
+            return entry[0]
+
+    def peek(self, result_id: str) -> Optional[Any]:
+        """Look up a result without consuming it or counting a hit or miss, for long polls that read it with get afterwards"""
+        with self._lock:
+            self._evict_expired(time.time())
+            entry = self._results.get(result_id)
+            return entry[0] if entry is not None else None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._results)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._results),
+                "bytes": self._bytes,
+                "max_entries": self._max_entries,
+                "max_bytes": self._max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "consumed": self._consumed,
+                "evicted_entries": self._evicted["entries"],
+                "evicted_bytes": self._evicted["bytes"],
+                "evicted_ttl": self._evicted["ttl"]
+            }
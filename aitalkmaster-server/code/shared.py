@@ -1,28 +1,45 @@
 from fastapi import FastAPI
 from contextlib import asynccontextmanager
+import asyncio
 import time
 from datetime import datetime
 
+import atexit
+
 from code.config import get_config
+from code.log_writer import LogWriter, LEVELS
 
 config = get_config()
 
-def log(message):
-    with open(config.server.log_file, "a") as file:
-        file.write(message + "\n")
-    print(message)
+log_writer = LogWriter(
+    buffer_size=config.server.logging.buffer_size,
+    flush_interval_seconds=config.server.logging.flush_interval_seconds,
+    max_bytes=config.server.logging.max_bytes,
+    backup_count=config.server.logging.backup_count,
+    stdout=config.server.logging.stdout
+)
+atexit.register(log_writer.close)
+
+def log_enabled(level: str, subsystem: str = "server") -> bool:
+    """True if messages of this level are logged for the subsystem, lets hot paths skip building the message"""
+    configured = config.server.logging.levels.get(subsystem, config.server.logging.level)
+    return LEVELS[level] >= LEVELS.get(configured, LEVELS["info"])
+
+def log(message, level: str = "info", subsystem: str = "server"):
+    if log_enabled(level, subsystem):
+        log_writer.write(config.server.log_file, message)
 
 def llm_log(message):
-    with open(config.server.llm_log_file, "a") as file:
-        file.write(message + "\n")
-    print(message)
+    log_writer.write(config.server.llm_log_file, message)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """FastAPI lifespan event handler"""
     # Startup
     log("FastAPI startup event triggered - initializing server...")
-    # Add any startup initialization here if needed
+    # LLM and TTS calls of queued requests run on this event loop
+    from code.async_engine import async_engine
+    async_engine.attach(asyncio.get_running_loop())
     log("FastAPI startup completed successfully")
     
     yield
@@ -31,19 +48,20 @@ async def lifespan(app: FastAPI):
     log("FastAPI shutdown event triggered - performing cleanup...")
     llm_log("FastAPI shutdown event triggered - performing cleanup...")
     
+    async_engine.detach()
+
     try:
         # Import here to avoid circular imports
         from code.audio_utils import stop_aitalkmaster_stream, stop_translation_stream
         from code.aitalkmaster_views import active_aitalkmaster_instances, reset_aitalkmaster
-        from code.icecast_monitor import delete_active_icecast_directory
         
         # Stop all active liquidsoap streams
         for join_key in list(active_aitalkmaster_instances.keys()):
             log(f"Stopping stream for join_key: {join_key}")
             if config.liquidsoap_client is not None:
                 stop_aitalkmaster_stream(join_key)
-            reset_aitalkmaster(join_key)
-            delete_active_icecast_directory(join_key)
+            # Archive jobs that do not finish before the shutdown are resumed from their journal on the next start
+            reset_aitalkmaster(join_key, remove_active_dir=True)
         
         # Stop all active translation streams
         from code.translation_views import active_translation_sessions
@@ -52,8 +70,8 @@ async def lifespan(app: FastAPI):
             if config.liquidsoap_client is not None:
                 stop_translation_stream(session_key)
 
-        from code.conversation_views import conversation_queue
-        for conversation in conversation_queue:
+        from code.conversation_views import conversation_store
+        for conversation in conversation_store.values():
             llm_log(f'{datetime.now().strftime("%Y-%m-%d %H:%M")} Conversation: Server shutdown - logging active conversation: {conversation}')
 
         
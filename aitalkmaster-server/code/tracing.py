@@ -0,0 +1,152 @@
+"""
+Stage timing traces of queued jobs.
+
+A trace starts when a worker takes a job from the queue, its first stage is the queue wait.
+The trace follows the job in a context variable, so the process_* functions only wrap their
+steps in `with trace_stage("llm"):` and need no extra parameter. AIT audio clips run in the
+pipeline stages on their own tasks, they carry the trace of their job and hold it open until
+they are queued to liquidsoap.
+
+Finished traces are kept in a ring buffer for /admin/traces. Traces slower than
+server.tracing.slow_seconds are also written to the slow log as one JSON line each.
+"""
+import contextvars
+import itertools
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Coroutine, Optional
+
+from code.shared import config, log, log_writer
+
+_current_trace: contextvars.ContextVar[Optional["JobTrace"]] = contextvars.ContextVar("current_trace", default=None)
+_trace_ids = itertools.count(1)
+
+class JobTrace:
+    """Start and end of the stages of one job, relative to the time it was queued"""
+
+    def __init__(self, request_type: str, description: str, enqueued_at: float):
+        self.trace_id = next(_trace_ids)
+        self.request_type = request_type
+        self.description = description
+        self.enqueued_at = enqueued_at
+        self.stages: list[tuple[str, float, float]] = []
+        self.error: Optional[str] = None
+        self.finished_at: Optional[float] = None
+        self._lock = threading.Lock()
+        # The job itself plus the audio clips it handed to the pipeline
+        self._pending = 1
+
+    def add_stage(self, name: str, start: float, end: float):
+        with self._lock:
+            self.stages.append((name, start - self.enqueued_at, end - self.enqueued_at))
+
+    def hold(self):
+        """Keep the trace open for work that continues after the job (an audio clip in the pipeline)"""
+        with self._lock:
+            self._pending += 1
+
+    def release(self, error: Optional[str] = None):
+        """Finish the job or one held piece of work, the trace is recorded when nothing is pending"""
+        with self._lock:
+            if error is not None and self.error is None:
+                self.error = error
+            self._pending -= 1
+            if self._pending > 0:
+                return
+            self.finished_at = time.time()
+        tracer.record(self)
+
+    @property
+    def duration_seconds(self) -> float:
+        return (self.finished_at or time.time()) - self.enqueued_at
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            stages = list(self.stages)
+        return {
+            "trace_id": self.trace_id,
+            "request_type": self.request_type,
+            "description": self.description,
+            "enqueued_at": self.enqueued_at,
+            "duration_seconds": round(self.duration_seconds, 3),
+            "error": self.error,
+            "stages": [{"stage": name, "start": round(start, 3), "end": round(end, 3), "seconds": round(end - start, 3)} for name, start, end in stages]
+        }
+
+class Tracer:
+    """Recent finished traces and the slow log"""
+
+    def __init__(self, recent_traces: int):
+        self._recent: deque = deque(maxlen=recent_traces)
+        self._lock = threading.Lock()
+        self._finished = 0
+        self._slow = 0
+
+    def start(self, request_type: str, description: str, enqueued_at: float) -> Optional[JobTrace]:
+        """Trace of a job that was just taken from the queue, None when tracing is disabled"""
+        if not config.server.tracing.enabled:
+            return None
+        trace = JobTrace(request_type, description, enqueued_at)
+        trace.add_stage("queue_wait", enqueued_at, time.time())
+        return trace
+
+    def record(self, trace: JobTrace):
+        slow = trace.duration_seconds >= config.server.tracing.slow_seconds
+        with self._lock:
+            self._recent.append(trace)
+            self._finished += 1
+            if slow:
+                self._slow += 1
+        if slow:
+            log_writer.write(config.server.tracing.slow_log_file, json.dumps(trace.to_dict()))
+            log(f"Slow job ({trace.duration_seconds:.1f}s): {trace.description}", "warning")
+
+    def get_recent(self, limit: int, min_seconds: float = 0.0) -> list[dict]:
+        """Newest finished traces first"""
+        with self._lock:
+            traces = list(self._recent)
+        traces = [trace for trace in reversed(traces) if trace.duration_seconds >= min_seconds]
+        return [trace.to_dict() for trace in traces[:limit]]
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {"finished": self._finished, "slow": self._slow, "kept": len(self._recent)}
+
+tracer = Tracer(config.server.tracing.recent_traces)
+
+def current_trace() -> Optional[JobTrace]:
+    return _current_trace.get()
+
+def release_trace(trace: Optional[JobTrace], error: Optional[str] = None):
+    if trace is not None:
+        trace.release(error)
+
+@contextmanager
+def trace_stage(name: str):
+    """Record the with block as a stage of the current job, does nothing outside of a traced job"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        trace.add_stage(name, start, time.time())
+
+@contextmanager
+def activate_trace(trace: Optional[JobTrace]):
+    """Make trace the current trace of the with block (e.g. in a pipeline stage worker)"""
+    token = _current_trace.set(trace)
+    try:
+        yield
+    finally:
+        _current_trace.reset(token)
+
+async def run_traced(trace: Optional[JobTrace], coroutine: Coroutine[Any, Any, Any]) -> Any:
+    """Run a job coroutine with its trace as the current trace, the task has its own context copy"""
+    _current_trace.set(trace)
+    return await coroutine
@@ -1,21 +1,24 @@
 from fastapi.responses import JSONResponse
 from fastapi import Request
+import asyncio
 import time
 from pathlib import Path
 from datetime import datetime
 from mutagen.easyid3 import EasyID3
-from mutagen.mp3 import MP3
+from mutagen.id3 import ID3NoHeaderError
 import traceback
-import io
 from dataclasses import dataclass
 from typing import Optional
 
-from code.config import ChatClientMode, AudioClientMode
-from code.audio_utils import start_translation_stream, queue_translation_audio
+from code.config import ChatClientMode
+from code.audio_utils import start_translation_stream, queue_translation_audio, save_audio
 from code.request_models import TranslationRequest
-from code.validation_decorators import validate_audio_decorator, rate_limit_decorator, validate_session_key_decorator, validate_chat_model_decorator
-from code.shared import app, config, log
-from pydub import AudioSegment
+from code.validation_decorators import validate_audio_decorator, rate_limit_decorator, validate_session_key_decorator, validate_chat_model_decorator, validate_callback_url_decorator
+from code.webhook_delivery import webhooks
+from code.shared import app, config, log, log_enabled
+from code.async_engine import async_engine
+from code.metrics import LLM_LATENCY, LLM_ERRORS, timed_call
+from code.tracing import trace_stage
 from code.rate_limiter import get_ip_address_for_rate_limit, increment_resource_usage
 from code.message_queue import queue_message_request, RequestType
 from code.translation_utils import build_audio_instructions, build_translation_instructions
@@ -84,7 +87,7 @@ def get_or_create_translation_session(session_key: str) -> TranslationSession:
     return session
 
 
-def translate_text(message: str, source_language: str, target_language: str, ip_address: str, model: str = "") -> str:
+async def translate_text(message: str, source_language: str, target_language: str, ip_address: str, model: str = "") -> str:
     """Translate text from source language to target language using the chat client"""
     try:
         translation_input = message
@@ -94,23 +97,27 @@ def translate_text(message: str, source_language: str, target_language: str, ip_
         translation_model = model if model else config.chat_client.default_model
         
         if config.chat_client.mode == ChatClientMode.OPENAI:
-            response = config.get_or_create_openai_chat_client().responses.create(
-                model=translation_model,
-                input=translation_input,
-                instructions=translation_instructions
-            )
+            async with async_engine.limit("chat"):
+                with timed_call(LLM_LATENCY, LLM_ERRORS, backend="openai", model=translation_model):
+                    response = await config.get_or_create_openai_async_chat_client().responses.create(
+                        model=translation_model,
+                        input=translation_input,
+                        instructions=translation_instructions
+                    )
             translated_text = response.output[0].content[0].text.strip()
             
             # Track token usage for rate limiting
             increment_resource_usage(ip_address, response.usage.total_tokens)
         
         elif config.chat_client.mode == ChatClientMode.OLLAMA:
-            response = config.get_or_create_ollama_chat_client().generate(
-                model=translation_model,
-                prompt=translation_input,
-                system=translation_instructions,
-                options={}
-            )
+            async with async_engine.limit("chat"):
+                with timed_call(LLM_LATENCY, LLM_ERRORS, backend="ollama", model=translation_model):
+                    response = await config.get_or_create_ollama_async_chat_client().generate(
+                        model=translation_model,
+                        prompt=translation_input,
+                        system=translation_instructions,
+                        options={}
+                    )
             translated_text = response["response"].strip()
             
             # Track eval_count for rate limiting
@@ -126,72 +133,39 @@ def translate_text(message: str, source_language: str, target_language: str, ip_
         log(f'stack: {traceback.print_exc()}')
         return message  # Return original message if translation fails
 
-def save_audio(filename: str, response_msg: str, audio_voice: str, audio_model: str, audio_instructions: str, ip_address: str):
-    """Save audio file from translated text"""
-    if config.audio_client.mode == AudioClientMode.OPENAI:
-        response = config.get_or_create_openai_audio_client().audio.speech.create(
-            model=audio_model,
-            voice=audio_voice,
-            input=response_msg,
-            instructions=audio_instructions,
-            response_format="mp3",
-            speed=1.0)
-    else:
-        response = config.get_or_create_opensource_audio_client().audio.speech.create(
-            model=audio_model,
-            voice=audio_voice,
-            input=response_msg,
-            instructions=audio_instructions,
-            response_format="mp3",
-            speed=1.0)
-
-    with open(filename, "wb") as f:
-        f.write(response.content)
-
-    # Get audio duration for rate limiting
-    audio = AudioSegment.from_file(io.BytesIO(response.content), format="mp3")
-    duration_seconds = len(audio) / 1000.0  # pydub returns duration in milliseconds
-
-    log(f'duration_seconds: {duration_seconds}')
-    
-    # Use duration as weight for rate limiting (duration in seconds)
-    increment_resource_usage(ip_address, duration_seconds * config.server.usage.audio_cost_per_second)
-
-    output_path = filename
-    audio.export(output_path, format="mp3", codec="libmp3lame", bitrate="128k")
-
 def save_metadata(filename: str, session_key: str):
     """Save metadata to audio file"""
-    mp3 = MP3(filename)
-    if mp3.tags is None:
-        mp3.add_tags()
-
-    # Use EasyID3 to set metadata
-    tags = EasyID3(filename)
+    try:
+        tags = EasyID3(filename)
+    except ID3NoHeaderError:
+        # Provider MP3s stored as is may have no ID3 header yet
+        tags = EasyID3()
     tags["title"] = session_key
     tags["artist"] = "Translation"
     tags["album"] = session_key
     tags["genre"] = "Speech"
-    tags.save()
+    tags.save(filename)
 
-def process_translation(request_model: TranslationRequest, ip_address: str):
+async def process_translation(request_model: TranslationRequest, ip_address: str):
     """Process a translation request in the background"""
     try:
-        data_json = request_model.model_dump()
-        log(f'Processing queued translation data: {data_json}')
+        if log_enabled("debug", "requests"):
+            log(f'Processing queued translation data: {request_model.model_dump()}', "debug", "requests")
 
         session_key = request_model.session_key
 
-        session = get_or_create_translation_session(session_key)  # This starts the audio stream if it is not already running
+        with trace_stage("instance"):
+            session = await asyncio.to_thread(get_or_create_translation_session, session_key)  # This starts the audio stream if it is not already running
 
         # Translate the message
-        translated_text = translate_text(
-            request_model.message,
-            request_model.source_language,
-            request_model.target_language,
-            ip_address,
-            request_model.model or ""
-        )
+        with trace_stage("llm"):
+            translated_text = await translate_text(
+                request_model.message,
+                request_model.source_language,
+                request_model.target_language,
+                ip_address,
+                request_model.model or ""
+            )
 
         # Create directory for the session_key if it doesn't exist (use translation-specific directory)
         session_dir = Path(f'./generated-audio/translation/active/{request_model.session_key}')
@@ -213,11 +187,21 @@ def process_translation(request_model: TranslationRequest, ip_address: str):
             target_language=request_model.target_language
         )
         session.add_translation(translation_result)
+        webhooks.deliver(request_model.callback_url, {
+            "type": "translation",
+            "session_key": session_key,
+            "message_id": request_model.message_id,
+            "translated_text": translated_text,
+            "source_language": request_model.source_language,
+            "target_language": request_model.target_language
+        })
         
-        save_audio(full_name, translated_text, request_model.audio_voice or "", request_model.audio_model or "", build_audio_instructions(request_model.target_language), ip_address)
-        save_metadata(full_name, session_key)
+        await save_audio(full_name, translated_text, request_model.audio_voice or "", request_model.audio_model or "", build_audio_instructions(request_model.target_language), ip_address)
+        with trace_stage("metadata"):
+            await asyncio.to_thread(save_metadata, full_name, session_key)
 
-        queue_translation_audio(session_key, filename)
+        with trace_stage("liquidsoap"):
+            await asyncio.to_thread(queue_translation_audio, session_key, filename)
         
         log(f'{datetime.now().strftime("%Y-%m-%d %H:%M")} translation (background): {request_model.source_language} -> {request_model.target_language}: {request_model.message[:50]}... -> {translated_text[:50]}... -> {filename}')
         
@@ -227,6 +211,7 @@ def process_translation(request_model: TranslationRequest, ip_address: str):
 
 @app.post("/translation/translate")
 @validate_session_key_decorator
+@validate_callback_url_decorator
 @validate_audio_decorator
 @rate_limit_decorator
 @validate_chat_model_decorator
@@ -1,115 +1,162 @@
 from functools import wraps
+from typing import Callable, Optional
 from fastapi.responses import JSONResponse
 from fastapi import Request
 from code.shared import config, log
 from code.rate_limiter import rate_limit_exceeded, get_ip_address_for_rate_limit
+from code.webhook_delivery import validate_callback_url
+from code.metrics import RATE_LIMIT_REJECTIONS
 
 def check_chat_model(model: str) -> tuple[bool, list]:
     available_models = config.chat_client.allowed_models
     if model in available_models:
         return True, available_models
-        
+
     return False, available_models
 
 def check_audio_voice(voice: str) -> tuple[bool, list]:
     allowed_voices = config.audio_client.allowed_voices
     if voice not in allowed_voices:
         return False, allowed_voices
-        
+
     return True, allowed_voices
-        
+
 def check_audio_model(model: str) -> tuple[bool, list]:
     available_models = config.audio_client.allowed_models
     if model not in available_models:
         return False, available_models
-        
+
     return True, available_models
 
-def validate_join_key_decorator(func):
-    @wraps(func)
-    def wrapper(request_model, fastapi_request: Request, *args, **kwargs):
-        join_key = request_model.join_key
-        
-        if " " in join_key:
-            return JSONResponse(
-                status_code=400,
-                content={
-                    "error": f'Invalid join key "{join_key}", it contains spaces',
-                }
-            )
-        return func(request_model, fastapi_request, *args, **kwargs)
-    return wrapper
+# Request checks return the content of a 400 response, or None if the request is valid.
+# They are shared by the decorators of the single endpoints and the batch endpoints.
 
-def validate_chat_model_decorator(func):
-    @wraps(func)
-    def wrapper(request_model, fastapi_request: Request, *args, **kwargs):
-        if request_model.model == "":
-            request_model.model = config.chat_client.default_model
-
-        is_valid_model, available_models = check_chat_model(request_model.model)
-        if not is_valid_model:
-            return JSONResponse(
-                status_code=400,
-                content={
-                    "error": f"Invalid chat model: {request_model.model}",
-                    "available_models": available_models
-                }
-            )
-        
-        return func(request_model, fastapi_request, *args, **kwargs)
-    return wrapper
+def join_key_error(request_model) -> Optional[dict]:
+    join_key = request_model.join_key
+    if " " in join_key:
+        return {"error": f'Invalid join key "{join_key}", it contains spaces'}
+    return None
 
-def validate_audio_decorator(func):
-    @wraps(func)
-    def wrapper(request_model, fastapi_request: Request, *args, **kwargs):
-        if config.audio_client is None:
+def session_key_error(request_model) -> Optional[dict]:
+    session_key = request_model.session_key
+    if " " in session_key:
+        return {"error": f'Invalid session key "{session_key}", it contains spaces'}
+    return None
+
+def callback_url_error(request_model) -> Optional[dict]:
+    error = validate_callback_url(request_model.callback_url)
+    if error is not None:
+        return {"error": error}
+    return None
+
+def chat_model_error(request_model) -> Optional[dict]:
+    if request_model.model == "":
+        request_model.model = config.chat_client.default_model
+
+    is_valid_model, available_models = check_chat_model(request_model.model)
+    if not is_valid_model:
+        return {
+            "error": f"Invalid chat model: {request_model.model}",
+            "available_models": available_models
+        }
+    return None
+
+def audio_error(request_model) -> Optional[dict]:
+    if config.audio_client is None:
+        return None
+
+    if request_model.audio_model == "":
+        request_model.audio_model = config.audio_client.default_model
+
+    if request_model.audio_voice == "":
+        request_model.audio_voice = config.audio_client.default_voice
+
+    is_valid_audio_model, available_audio_models = check_audio_model(request_model.audio_model)
+    if not is_valid_audio_model:
+        return {
+            "error": f"Invalid audio model: {request_model.audio_model}",
+            "available_audio_models": available_audio_models
+        }
+
+    is_valid_voice, allowed_voices = check_audio_voice(request_model.audio_voice)
+    if not is_valid_voice:
+        return {
+            "error": f"Invalid audio voice: {request_model.audio_voice}",
+            "allowed_voices": allowed_voices
+        }
+    return None
+
+def request_check_decorator(check: Callable[[object], Optional[dict]]):
+    """Decorator that answers 400 when the check fails for the request model"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(request_model, fastapi_request: Request, *args, **kwargs):
+            error = check(request_model)
+            if error is not None:
+                return JSONResponse(
+                    status_code=400,
+                    content=error
+                )
             return func(request_model, fastapi_request, *args, **kwargs)
+        return wrapper
+    return decorator
 
-        if request_model.audio_model == "":
-            request_model.audio_model = config.audio_client.default_model
-
-        if request_model.audio_voice == "":
-            request_model.audio_voice = config.audio_client.default_voice
-
-        is_valid_audio_model, available_audio_models = check_audio_model(request_model.audio_model)
-        if not is_valid_audio_model:
-            return JSONResponse(
-                status_code=400,
-                content={
-                    "error": f"Invalid audio model: {request_model.audio_model}",
-                    "available_audio_models": available_audio_models
-                }
-            )
-
-        is_valid_voice, allowed_voices = check_audio_voice(request_model.audio_voice)
-        if not is_valid_voice:
-            return JSONResponse(
-                status_code=400,
-                content={
-                    "error": f"Invalid audio voice: {request_model.audio_voice}",
-                    "allowed_voices": allowed_voices
-                }
-            )
-        
-        return func(request_model, fastapi_request, *args, **kwargs)
-    return wrapper
+validate_join_key_decorator = request_check_decorator(join_key_error)
+validate_session_key_decorator = request_check_decorator(session_key_error)
+validate_callback_url_decorator = request_check_decorator(callback_url_error)
+validate_chat_model_decorator = request_check_decorator(chat_model_error)
+validate_audio_decorator = request_check_decorator(audio_error)
+
+def validate_batch_decorator(*checks: Callable[[object], Optional[dict]], field: str = "messages"):
+    """Run the checks on every item of a batch request (request_model.messages by default) in one pass.
+
+    The first failing item answers the whole batch with 400 and its index, nothing is queued.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(request_model, fastapi_request: Request, *args, **kwargs):
+            items = getattr(request_model, field)
+            if not items:
+                return JSONResponse(
+                    status_code=400,
+                    content={"error": f"The batch contains no {field}"}
+                )
+            if len(items) > config.server.max_batch_size:
+                return JSONResponse(
+                    status_code=400,
+                    content={"error": f"The batch contains {len(items)} {field}, at most {config.server.max_batch_size} are allowed"}
+                )
+            for index, message in enumerate(items):
+                for check in checks:
+                    error = check(message)
+                    if error is not None:
+                        error["index"] = index
+                        return JSONResponse(
+                            status_code=400,
+                            content=error
+                        )
+            return func(request_model, fastapi_request, *args, **kwargs)
+        return wrapper
+    return decorator
 
 def rate_limit_decorator(func):
     @wraps(func)
     def wrapper(request_model, fastapi_request: Request, *args, **kwargs):
-        log(f'Rate limit check for IP: {fastapi_request.client.host}')
+        log(f'Rate limit check for IP: {fastapi_request.client.host}', "debug", "rate_limit")
 
         if config.server.usage.use_rate_limit:
             ip_address, error = get_ip_address_for_rate_limit(fastapi_request)
             if error:
+                RATE_LIMIT_REJECTIONS.inc(reason="no_ip")
                 return JSONResponse(
                     status_code=429,
                     content={
                         "error": error
                     }
                 )
-        
+
             if rate_limit_exceeded(ip_address):
+                RATE_LIMIT_REJECTIONS.inc(reason="exceeded")
                 return JSONResponse(
                     status_code=429,
                     content={
@@ -122,20 +169,3 @@ def rate_limit_decorator(func):
         else:
             return func(request_model, fastapi_request, *args, **kwargs)
     return wrapper
-
-def validate_session_key_decorator(func):
-    from functools import wraps
-    
-    @wraps(func)
-    def wrapper(request_model, fastapi_request: Request, *args, **kwargs):
-        session_key = request_model.session_key
-        
-        if " " in session_key:
-            return JSONResponse(
-                status_code=400,
-                content={
-                    "error": f'Invalid session key "{session_key}", it contains spaces',
-                }
-            )
-        return func(request_model, fastapi_request, *args, **kwargs)
-    return wrapper
\ No newline at end of file
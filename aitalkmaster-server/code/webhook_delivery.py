@@ -0,0 +1,195 @@
+"""
+Push delivery of finished responses to the callback_url of a request.
+
+OpenSimulator objects can open an HTTP-in URL, a script that passes it as callback_url gets the
+response POSTed there and does not need to poll getMessageResponse. Deliveries go through a
+bounded queue to a pool of worker threads sharing one connection pool, failed deliveries are
+retried a few times with an increasing delay.
+
+A callback_url must resolve to public addresses only, otherwise any client could make the
+server POST to its own backends (Liquidsoap, Ollama, cloud metadata services). Hosts on a
+private network of the grid can be listed in server.webhooks.allowed_hosts. The POST connects
+to the address that was checked, a host that resolves to another address by then (DNS
+rebinding) does not get the request sent there.
+"""
+import ipaddress
+import queue
+import socket
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from code.shared import config, log
+
+@dataclass
+class WebhookDelivery:
+    url: str
+    payload: dict
+    attempts: int = 0
+    created_at: float = field(default_factory=time.time)
+
+def is_allowed_host(host: str, address: ipaddress._BaseAddress) -> bool:
+    """True if the host or one of its addresses is listed in server.webhooks.allowed_hosts"""
+    for allowed in config.server.webhooks.allowed_hosts:
+        allowed = str(allowed).strip().lower()
+        if allowed == host:
+            return True
+        try:
+            if address in ipaddress.ip_network(allowed, strict=False):
+                return True
+        except ValueError:
+            continue
+    return False
+
+def resolve_callback_url(url: str) -> Tuple[Optional[str], list[str]]:
+    """Resolve the host of a callback_url and check its addresses
+
+    Returns:
+        An error message for an unusable callback_url, otherwise None and the checked addresses
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        return f'Invalid callback_url "{url}", only http and https URLs are supported', []
+    host = parsed.hostname.lower()
+    try:
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        addresses = list(dict.fromkeys(info[4][0].split("%", 1)[0] for info in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)))
+    except (OSError, ValueError) as e:
+        return f'Invalid callback_url "{url}", the host cannot be resolved: {e}', []
+    for address in addresses:
+        ip = ipaddress.ip_address(address)
+        if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+            ip = ip.ipv4_mapped
+        if (not ip.is_global or ip.is_multicast) and not is_allowed_host(host, ip):
+            return f'Invalid callback_url "{url}", {host} resolves to the non-public address {ip}', []
+    return None, addresses
+
+def validate_callback_url(url: Optional[str]) -> Optional[str]:
+    """Error message for an unusable callback_url, None if it is empty or valid
+
+    The host is resolved, so this blocks and must not run on the event loop.
+    """
+    if not url:
+        return None
+    error, _ = resolve_callback_url(url)
+    return error
+
+class PinnedAddressAdapter(HTTPAdapter):
+    """Connects to request.pinned_address instead of resolving the host of the URL again
+
+    The URL keeps the host name, so the Host header, SNI and the certificate check use it.
+    """
+
+    def build_connection_pool_key_attributes(self, request, verify, cert=None):
+        host_params, pool_kwargs = super().build_connection_pool_key_attributes(request, verify, cert)
+        pinned_address = getattr(request, "pinned_address", None)
+        if pinned_address is not None:
+            host_name = host_params["host"]
+            host_params["host"] = pinned_address
+            if host_params["scheme"] == "https":
+                pool_kwargs["server_hostname"] = host_name
+                pool_kwargs["assert_hostname"] = host_name
+        return host_params, pool_kwargs
+
+class WebhookDispatcher:
+    """Bounded delivery queue with worker threads, retries and delivery counters"""
+
+    def __init__(self):
+        self._queue: queue.Queue = queue.Queue(maxsize=config.server.webhooks.queue_size)
+        self._session = requests.Session()
+        # A proxy from the environment would resolve the host itself
+        self._session.trust_env = False
+        adapter = PinnedAddressAdapter(pool_connections=config.server.webhooks.pool_size, pool_maxsize=config.server.webhooks.pool_size)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._lock = threading.Lock()
+        self._started = False
+        self._stats = {"queued": 0, "delivered": 0, "retried": 0, "failed": 0, "dropped": 0}
+        self._latency_total = 0.0
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def deliver(self, url: Optional[str], payload: dict):
+        """Queue a POST of the payload to url, does nothing without a url"""
+        if not url:
+            return
+        # The callback_url is checked by the delivery worker, resolving its host would block the event loop
+        self._ensure_started()
+        self._put(WebhookDelivery(url=url, payload=payload))
+
+    def _put(self, delivery: WebhookDelivery):
+        try:
+            self._queue.put_nowait(delivery)
+            self._count("queued")
+        except queue.Full:
+            self._count("dropped")
+            log(f'Webhook queue full, dropped delivery to {delivery.url}')
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for i in range(config.server.webhooks.workers):
+            threading.Thread(target=self._worker, daemon=True, name=f"WebhookWorker-{i+1}").start()
+        log(f"Started {config.server.webhooks.workers} webhook worker threads")
+
+    def _worker(self):
+        while True:
+            delivery = self._queue.get()
+            try:
+                self._attempt(delivery)
+            finally:
+                self._queue.task_done()
+
+    def _attempt(self, delivery: WebhookDelivery):
+        delivery.attempts += 1
+        # Checked again on every attempt, the host may resolve to another address by now
+        error, addresses = resolve_callback_url(delivery.url)
+        if error is not None:
+            self._count("failed")
+            log(f'Webhook not delivered: {error}')
+            return
+        try:
+            response = self._post(delivery, addresses[0])
+            response.raise_for_status()
+            if response.is_redirect:
+                raise requests.HTTPError(f'redirected to {response.headers.get("location")}')
+            with self._lock:
+                self._stats["delivered"] += 1
+                self._latency_total += time.time() - delivery.created_at
+        except Exception as e:
+            if delivery.attempts < config.server.webhooks.max_attempts:
+                self._count("retried")
+                timer = threading.Timer(config.server.webhooks.retry_delay_seconds * delivery.attempts, self._put, args=(delivery,))
+                timer.daemon = True
+                timer.start()
+            else:
+                self._count("failed")
+                log(f'Webhook delivery to {delivery.url} failed after {delivery.attempts} attempts: {e}')
+
+    def _post(self, delivery: WebhookDelivery, address: str) -> requests.Response:
+        """POST the payload to the checked address of the callback_url host"""
+        parsed = urlparse(delivery.url)
+        host = f"[{parsed.hostname}]" if ":" in parsed.hostname else parsed.hostname
+        request = self._session.prepare_request(requests.Request("POST", delivery.url, json=delivery.payload))
+        request.headers["Host"] = f"{host}:{parsed.port}" if parsed.port else host
+        request.pinned_address = address
+        # Redirects are not followed, they could lead to an address the check would refuse
+        return self._session.send(request, timeout=config.server.webhooks.timeout_seconds, allow_redirects=False)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = self._queue.qsize()
+            stats["avg_delivery_seconds"] = round(self._latency_total / self._stats["delivered"], 3) if self._stats["delivered"] else 0.0
+            return stats
+
+webhooks = WebhookDispatcher()
@@ -0,0 +1,32 @@
+"""
+The server modules read config.yml from the working directory when they are imported and
+validate it against the chat and audio backends. The tests give them a config pointing at the
+fake backends of the benchmarks, in a scratch directory like ServerProcess does.
+"""
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+import yaml
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SERVER_DIR))
+# pytest has already imported the standard library module named code (through pdb), the server package replaces it
+if not hasattr(sys.modules.get("code"), "__path__"):
+    sys.modules.pop("code", None)
+
+from benchmarks.fake_backends import FakeBehaviour
+from benchmarks.server_process import BenchmarkSetup, BenchmarkBackends, build_config
+
+setup = BenchmarkSetup(llm=FakeBehaviour(), tts=FakeBehaviour(), liquidsoap=FakeBehaviour())
+backends = BenchmarkBackends(setup).__enter__()
+workdir = Path(tempfile.mkdtemp(prefix="aitalkmaster-tests-"))
+(workdir / "logs").mkdir()
+(workdir / "config.yml").write_text(yaml.safe_dump(build_config(setup, backends, workdir), sort_keys=False))
+os.chdir(workdir)
+
+def pytest_unconfigure(config):
+    backends.__exit__(None, None, None)
+    shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,67 @@
+import asyncio
+import json
+
+import pytest
+from starlette.requests import Request
+
+from code import aitalkmaster_views
+from code.request_models import AitPostMessageRequest, AitPostMessagesRequest, AitSceneCharacter, AitSceneMessageRequest
+
+def fastapi_request(path: str) -> Request:
+    return Request({"type": "http", "method": "POST", "path": path, "headers": [], "client": ("203.0.113.9", 40000)})
+
+def post_request(join_key: str, message_id: str) -> AitPostMessageRequest:
+    return AitPostMessageRequest(join_key=join_key, username="Visitor", message="Hello", charactername="Guide", message_id=message_id, audio_voice="af_bench")
+
+def scene_request(join_key: str, message_id: str, character_ids: list[str]) -> AitSceneMessageRequest:
+    characters = [AitSceneCharacter(charactername=f"Character {index}", message_id=character_id, audio_voice="af_bench") for index, character_id in enumerate(character_ids)]
+    return AitSceneMessageRequest(join_key=join_key, username="Visitor", message="Hello", message_id=message_id, characters=characters)
+
+@pytest.fixture
+def queued(monkeypatch) -> list:
+    """Requests handed to the message queue, they are not processed"""
+    requests = []
+    monkeypatch.setattr(aitalkmaster_views, "queue_message_request", lambda request_type, request_model, ip_address, processor: requests.append((request_model, processor)))
+    monkeypatch.setattr(aitalkmaster_views, "start_aitalkmaster_stream", lambda join_key: None)
+    return requests
+
+def test_character_ids_of_a_queued_scene_are_reserved(queued):
+    join_key = "message-ids-scene"
+    response = aitalkmaster_views.postaitSceneMessage(scene_request(join_key, "u1", ["c1", "c2"]), fastapi_request("/ait/postSceneMessage"))
+    assert response.status_code == 425
+
+    response = aitalkmaster_views.postaitMessage(post_request(join_key, "c2"), fastapi_request("/ait/postMessage"))
+    assert response.status_code == 400
+
+    response = aitalkmaster_views.postaitSceneMessage(scene_request(join_key, "u2", ["c3", "c1"]), fastapi_request("/ait/postSceneMessage"))
+    assert response.status_code == 400
+    assert json.loads(response.body)["index"] == 1
+    assert len(queued) == 1
+
+def test_ids_are_released_after_processing_and_stay_taken_by_the_responses(monkeypatch, queued):
+    join_key = "message-ids-processed"
+    monkeypatch.setattr(aitalkmaster_views.config, "audio_client", None)
+
+    async def answer(request, ait_instance, ip_address):
+        return f"{request.charactername} answers"
+    monkeypatch.setattr(aitalkmaster_views, "get_character_response", answer)
+
+    aitalkmaster_views.postaitSceneMessage(scene_request(join_key, "u1", ["c1"]), fastapi_request("/ait/postSceneMessage"))
+    request_model, processor = queued[0]
+    asyncio.run(processor(request_model, "203.0.113.9"))
+
+    ait_instance = aitalkmaster_views.active_aitalkmaster_instances[join_key]
+    assert not ait_instance.reserved_message_ids
+    assert ait_instance.get_response("c1").response == "Character 0 answers"
+    response = aitalkmaster_views.postaitMessage(post_request(join_key, "c1"), fastapi_request("/ait/postMessage"))
+    assert response.status_code == 400
+
+def test_a_refused_batch_reserves_nothing(queued):
+    join_key = "message-ids-batch"
+    batch = AitPostMessagesRequest(messages=[post_request(join_key, "m1"), post_request(join_key, "m1")])
+    response = aitalkmaster_views.postaitMessages(batch, fastapi_request("/ait/postMessages"))
+    assert response.status_code == 400
+    assert json.loads(response.body)["index"] == 1
+
+    response = aitalkmaster_views.postaitMessage(post_request(join_key, "m1"), fastapi_request("/ait/postMessage"))
+    assert response.status_code == 425
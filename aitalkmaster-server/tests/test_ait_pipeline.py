@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+from code import aitalkmaster_views
+from code.aitalkmaster_utils import AitalkmasterInstance
+from code.request_models import AitPostMessageRequest
+
+def post_request(join_key: str, message_id: str) -> AitPostMessageRequest:
+    return AitPostMessageRequest(join_key=join_key, username="Visitor", message="Hello", charactername="Guide", message_id=message_id, audio_voice="af_bench")
+
+@pytest.fixture
+def published(monkeypatch) -> list[str]:
+    """Filenames queued to liquidsoap, in publish order"""
+    filenames = []
+    monkeypatch.setattr(aitalkmaster_views, "queue_aitalkmaster_audio", lambda join_key, filename: filenames.append(filename))
+    monkeypatch.setattr(aitalkmaster_views, "append_to_merged_audio", lambda ait_instance, full_name: None)
+    return filenames
+
+def test_a_response_that_fails_does_not_hold_back_later_clips(monkeypatch, published):
+    ait_instance = AitalkmasterInstance("pipeline-failed-response")
+
+    def fail(request, response):
+        raise RuntimeError("event failed")
+    monkeypatch.setattr(aitalkmaster_views, "publish_response_event", fail)
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await aitalkmaster_views.add_response_with_clip(post_request(ait_instance.join_key, "m1"), ait_instance, "First", "127.0.0.1")
+        job = aitalkmaster_views.build_clip_job(post_request(ait_instance.join_key, "m2"), ait_instance, "Second", "127.0.0.1", "m2")
+        await aitalkmaster_views.publish_ready(ait_instance, job.sequence_number, job)
+        return job
+
+    job = asyncio.run(run())
+    assert published == [job.filename]
+    assert not ait_instance.has_unpublished_clips()
+
+def test_a_liquidsoap_error_does_not_drop_the_other_ready_clips(monkeypatch, published):
+    ait_instance = AitalkmasterInstance("pipeline-liquidsoap-error")
+    first = aitalkmaster_views.build_clip_job(post_request(ait_instance.join_key, "m1"), ait_instance, "First", "127.0.0.1", "m1")
+    second = aitalkmaster_views.build_clip_job(post_request(ait_instance.join_key, "m2"), ait_instance, "Second", "127.0.0.1", "m2")
+
+    def queue_audio(join_key, filename):
+        if filename == first.filename:
+            raise ConnectionError("liquidsoap is gone")
+        published.append(filename)
+    monkeypatch.setattr(aitalkmaster_views, "queue_aitalkmaster_audio", queue_audio)
+
+    async def run():
+        # The second clip waits for the first, both are published by the call for the first
+        await aitalkmaster_views.publish_ready(ait_instance, second.sequence_number, second)
+        await aitalkmaster_views.publish_ready(ait_instance, first.sequence_number, first)
+
+    asyncio.run(run())
+    assert published == [second.filename]
+    assert not ait_instance.has_unpublished_clips()
@@ -0,0 +1,125 @@
+import json
+import threading
+import time
+from pathlib import Path
+
+from benchmarks.fake_backends import synthetic_mp3
+from code import aitalkmaster_views, archive_jobs as archive_jobs_module
+from code.aitalkmaster_views import active_aitalkmaster_instances, append_to_merged_audio, get_or_create_ait_instance, reset_aitalkmaster
+from code.archive_jobs import ArchiveJobQueue, archive_jobs
+
+def active_dir(join_key: str) -> Path:
+    return Path(f'./generated-audio/aitalkmaster/active/{join_key}')
+
+def write_clip(join_key: str, name: str, ait_instance=None) -> Path:
+    active_dir(join_key).mkdir(parents=True, exist_ok=True)
+    clip = active_dir(join_key) / name
+    clip.write_bytes(synthetic_mp3(0.5))
+    if ait_instance is not None:
+        ait_instance.add_clip_file(str(clip))
+    return clip
+
+def wait_for_status(jobs: ArchiveJobQueue, job_id: str, status: str, timeout_seconds: float = 10.0) -> dict:
+    deadline = time.time() + timeout_seconds
+    while time.time() < deadline:
+        job = jobs.get_status(job_id)
+        if job["status"] == status:
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"archive job {job_id} is {jobs.get_status(job_id)['status']}, expected {status}")
+
+def test_reset_archives_a_live_instance():
+    join_key = "archive-live"
+    ait_instance = get_or_create_ait_instance(join_key)
+    ait_instance.addUserMessage("Hello", "Visitor", "m1")
+    ait_instance.addResponse("Welcome", "Guide", "m1", None)
+    clip = write_clip(join_key, "001_Guide_m1_af_bench.mp3", ait_instance)
+
+    job_id = reset_aitalkmaster(join_key)
+
+    assert join_key not in active_aitalkmaster_instances
+    with open(archive_jobs_module.ARCHIVE_JOB_DIR / f"{job_id}.json") as f:
+        assert json.load(f)["files"] == [str(clip)]
+    archive_jobs.start()
+    job = wait_for_status(archive_jobs, job_id, "done")
+    assert not clip.exists()
+    assert (Path(job["inactive_dir"]) / clip.name).exists()
+
+def test_active_dir_of_a_new_instance_is_kept():
+    join_key = "archive-new-instance"
+    get_or_create_ait_instance(join_key)
+    clip = write_clip(join_key, "001_Guide_m1_af_bench.mp3")
+    jobs = ArchiveJobQueue()
+
+    # The old instance was reset and a new one started before the job ran
+    job = jobs.submit(join_key, None, [], remove_active_dir=True)
+    jobs.start()
+
+    wait_for_status(jobs, job.job_id, "done")
+    assert clip.exists()
+
+def test_files_stay_until_the_clips_of_the_instance_are_published():
+    join_key = "archive-unpublished"
+    ait_instance = get_or_create_ait_instance(join_key)
+    sequence_number = int(ait_instance.generate_sequence_str())
+    clip = write_clip(join_key, f"{sequence_number:03d}_Guide_m1_af_bench.mp3", ait_instance)
+    jobs = ArchiveJobQueue()
+
+    job = jobs.submit(join_key, ait_instance, jobs.list_files(join_key, ait_instance))
+    jobs.start()
+
+    wait_for_status(jobs, job.job_id, "waiting")
+    assert clip.exists()
+    ait_instance.complete_sequence(sequence_number, None)
+    wait_for_status(jobs, job.job_id, "done")
+    assert not clip.exists()
+
+def test_late_clips_of_a_reset_instance_go_to_its_archive():
+    join_key = "archive-late-clip"
+    ait_instance = get_or_create_ait_instance(join_key)
+    first_sequence_number = int(ait_instance.generate_sequence_str())
+    first = write_clip(join_key, f"{first_sequence_number:03d}_Guide_m1_af_bench.mp3", ait_instance)
+    ait_instance.complete_sequence(first_sequence_number, None)
+    append_to_merged_audio(ait_instance, str(first))
+    # The second clip is still in TTS when the join_key is reset and a new instance starts
+    late_sequence_number = int(ait_instance.generate_sequence_str())
+    job_id = reset_aitalkmaster(join_key)
+    new_instance = get_or_create_ait_instance(join_key)
+    archive_jobs.start()
+    wait_for_status(archive_jobs, job_id, "waiting")
+
+    late = write_clip(join_key, f"{late_sequence_number:03d}_Guide_m2_af_bench.mp3", ait_instance)
+    append_to_merged_audio(ait_instance, str(late))
+    ait_instance.complete_sequence(late_sequence_number, None)
+
+    job = wait_for_status(archive_jobs, job_id, "done")
+    inactive_files = sorted(file_path.name for file_path in Path(job["inactive_dir"]).iterdir())
+    assert first.name in inactive_files and late.name in inactive_files
+    merged_files = [name for name in inactive_files if name.startswith("merged_conversation_")]
+    assert len(merged_files) == 1
+    assert not Path(new_instance.merged_filename).exists()
+    assert list(active_dir(join_key).iterdir()) == []
+
+def test_a_slow_stream_start_does_not_block_other_join_keys(monkeypatch):
+    started = threading.Event()
+    release = threading.Event()
+
+    def start_stream(join_key):
+        if join_key == "stream-slow":
+            started.set()
+            release.wait(10)
+        return True
+    monkeypatch.setattr(aitalkmaster_views, "start_aitalkmaster_stream", start_stream)
+
+    slow = threading.Thread(target=get_or_create_ait_instance, args=("stream-slow",))
+    slow.start()
+    try:
+        assert started.wait(5)
+        other = threading.Thread(target=get_or_create_ait_instance, args=("stream-other",))
+        other.start()
+        other.join(5)
+        assert not other.is_alive()
+        assert "stream-other" in active_aitalkmaster_instances
+    finally:
+        release.set()
+        slow.join()
@@ -0,0 +1,21 @@
+from mutagen.easyid3 import EasyID3
+
+from benchmarks.fake_backends import synthetic_mp3
+from code import aitalkmaster_views, translation_views
+from code.audio_utils import matches_output_profile, store_audio
+
+def test_passthrough_mp3_without_id3_header_gets_tagged(tmp_path):
+    content = synthetic_mp3(2.0)
+    assert matches_output_profile(content) is not None
+
+    for save_metadata, arguments, artist in [
+        (aitalkmaster_views.save_metadata, ("Guide", "join-key"), "AIT Guide"),
+        (translation_views.save_metadata, ("session-key",), "Translation")
+    ]:
+        filename = str(tmp_path / f"{artist}.mp3")
+        store_audio(filename, content, "127.0.0.1")
+        with open(filename, "rb") as f:
+            assert f.read() == content  # written as is, without ID3 header
+
+        save_metadata(filename, *arguments)
+        assert EasyID3(filename)["artist"] == [artist]
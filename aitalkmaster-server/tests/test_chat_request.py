@@ -0,0 +1,19 @@
+from code import chat_request
+from code.chat_request import get_prompt_cache_stats, record_ollama_usage
+from code.context_manager import estimate_tokens
+
+def test_ollama_reused_tokens_are_derived_from_the_evaluated_prompt_tokens(monkeypatch):
+    lines = []
+    monkeypatch.setattr(chat_request, "log", lambda message, *args: lines.append(message))
+    messages = [{"role": "system", "content": "x" * 400}, {"role": "user", "content": "y" * 40}]
+    prompt_tokens = sum(estimate_tokens(message["content"]) for message in messages)
+    before = get_prompt_cache_stats().get("ollama", {"calls": 0, "cached_tokens": 0})
+
+    record_ollama_usage(messages, {"model": "bench-model", "prompt_eval_count": 20, "eval_count": 5}, "ait:cache-test")
+
+    stats = get_prompt_cache_stats()["ollama"]
+    assert stats["source"] == "derived"
+    assert stats["calls"] == before["calls"] + 1
+    assert stats["cached_tokens"] == before["cached_tokens"] + prompt_tokens - 20
+    assert lines == [f"Prompt cache ait:cache-test: ollama bench-model evaluated 20 of about {prompt_tokens} prompt tokens, "
+                     f"{prompt_tokens - 20} reused from the KV cache (derived)"]
@@ -0,0 +1,46 @@
+import asyncio
+
+from code import context_manager
+from code.chat_request import get_prompt_cache_stats
+from code.context_manager import ContextManager, Transcript, estimate_tokens, summarize_dialog
+from code.rate_limiter import get_total_weight
+from code.shared import config
+
+def transcript_of(count: int) -> Transcript:
+    transcript = Transcript()
+    for index in range(count):
+        transcript.append("user" if index % 2 == 0 else "assistant", f"message {index:02d} " + "x" * 29)
+    return transcript
+
+def test_only_messages_over_the_budget_are_left_out_while_the_summary_is_pending(monkeypatch):
+    transcript = transcript_of(20)
+    message_tokens = estimate_tokens(transcript.messages[0]["content"])
+    monkeypatch.setattr(config.chat_client, "default_context_budget", 7 * message_tokens)
+    monkeypatch.setattr(config.chat_client, "keep_last_messages", 4)
+    requests = []
+
+    async def pending_summary(model, previous_summary, messages, ip_address, name):
+        requests.append((len(messages), ip_address))
+        await asyncio.sleep(3600)
+    monkeypatch.setattr(context_manager, "summarize_dialog", pending_summary)
+
+    async def run():
+        context = ContextManager(transcript, "test")
+        messages = context.build_messages("bench-model", "203.0.113.7")
+        await asyncio.sleep(0)
+        context._summary_task.cancel()
+        return messages
+
+    messages = asyncio.run(run())
+    assert messages == transcript.messages[-7:]
+    assert requests == [(16, "203.0.113.7")]
+
+def test_summary_calls_are_accounted_to_the_ip_address():
+    ip_address = "203.0.113.8"
+    calls_before = get_prompt_cache_stats().get("ollama", {}).get("calls", 0)
+
+    summary = asyncio.run(summarize_dialog("bench-model", "", transcript_of(6).messages, ip_address, "test"))
+
+    assert summary
+    assert get_total_weight(ip_address) > 0
+    assert get_prompt_cache_stats()["ollama"]["calls"] == calls_before + 1
@@ -0,0 +1,21 @@
+import threading
+
+from code.log_writer import LogWriter
+
+def test_lines_written_around_close_keep_their_order(tmp_path):
+    path = str(tmp_path / "logfile.txt")
+    writer = LogWriter(buffer_size=100000, flush_interval_seconds=0.01, max_bytes=0, backup_count=0, stdout=False)
+
+    def write_lines(start: int, count: int):
+        for number in range(start, start + count):
+            writer.write(path, str(number))
+
+    write_lines(0, 2000)
+    closing = threading.Thread(target=writer.close)
+    closing.start()
+    write_lines(2000, 2000)
+    closing.join()
+    write_lines(4000, 10)
+
+    with open(path) as f:
+        assert f.read().split() == [str(number) for number in range(4010)]
@@ -0,0 +1,22 @@
+from starlette.requests import Request
+
+from code.shared import config
+from code.metrics_views import metrics
+
+def request(headers: dict) -> Request:
+    return Request({"type": "http", "method": "GET", "path": "/metrics",
+                    "headers": [(name.lower().encode(), value.encode()) for name, value in headers.items()]})
+
+def test_cumulative_collector_values_are_counters():
+    text = metrics(request({})).body.decode()
+    assert "# TYPE ait_conversation_evictions_total counter" in text
+    assert "# TYPE ait_webhook_deliveries_total counter" in text
+    assert "# TYPE ait_webhook_pending gauge" in text
+    assert "# TYPE ait_unpublished_clips gauge" in text
+
+def test_metrics_require_the_admin_token_when_configured(monkeypatch):
+    monkeypatch.setattr(config.server, "admin_token", "secret")
+    assert metrics(request({})).status_code == 403
+    assert metrics(request({"X-Admin-Token": "wrong"})).status_code == 403
+    assert metrics(request({"X-Admin-Token": "secret"})).status_code == 200
+    assert metrics(request({"Authorization": "Bearer secret"})).status_code == 200
@@ -0,0 +1,11 @@
+from code.result_cache import ResultCache
+
+def test_peek_does_not_count_hits_or_misses():
+    cache = ResultCache(max_entries=10, max_bytes=1024, ttl_seconds=0, size_of=len)
+    assert cache.peek("a") is None
+    cache.put("a", "done")
+    assert cache.peek("a") == "done"
+    assert cache.get("a", consume=True) == "done"
+
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["misses"], stats["consumed"]) == (1, 0, 1)
@@ -0,0 +1,78 @@
+import socket
+import threading
+
+import pytest
+import urllib3
+
+from code.shared import config
+from code.webhook_delivery import WebhookDelivery, WebhookDispatcher, validate_callback_url
+
+@pytest.mark.parametrize("url", [
+    "http://127.0.0.1:8080/queue_aitalkmaster_audio",
+    "http://localhost:11434/api/generate",
+    "http://[::1]/",
+    "http://[::ffff:127.0.0.1]/",
+    "http://0.0.0.0/",
+    "http://10.1.2.3/",
+    "http://172.16.0.1/",
+    "http://192.168.1.10:9000/",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://[fe80::1]/",
+    "http://240.0.0.1/",
+    "http://224.0.0.1/",
+])
+def test_non_public_addresses_are_refused(url):
+    assert "non-public address" in validate_callback_url(url)
+
+@pytest.mark.parametrize("url", ["ftp://93.184.215.14/", "http:///path", "not a url"])
+def test_other_schemes_are_refused(url):
+    assert "only http and https" in validate_callback_url(url)
+
+def test_public_addresses_are_accepted():
+    assert validate_callback_url("http://93.184.215.14:9000/lslhttp/abc") is None
+    assert validate_callback_url("") is None
+
+def test_allowed_hosts_open_private_addresses(monkeypatch):
+    monkeypatch.setattr(config.server.webhooks, "allowed_hosts", ["localhost", "10.0.0.0/8"])
+    assert validate_callback_url("http://localhost:9000/") is None
+    assert validate_callback_url("http://10.1.2.3/") is None
+    assert validate_callback_url("http://192.168.1.10/") is not None
+
+def test_delivery_connects_to_the_validated_address(monkeypatch):
+    # The host passes the check with a public address, then resolves to the loopback address (DNS rebinding)
+    answers = iter(["93.184.215.14", "127.0.0.1"])
+    resolve = socket.getaddrinfo
+
+    def rebinding_getaddrinfo(host, port, *args, **kwargs):
+        if host == "rebind.test":
+            return [(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, "", (next(answers, "127.0.0.1"), port))]
+        return resolve(host, port, *args, **kwargs)
+    monkeypatch.setattr(socket, "getaddrinfo", rebinding_getaddrinfo)
+
+    connected = []
+    server_socket, client_socket = socket.socketpair()
+
+    def create_connection(address, *args, **kwargs):
+        connected.append(address)
+        return client_socket
+    monkeypatch.setattr(urllib3.util.connection, "create_connection", create_connection)
+
+    received = []
+    def answer():
+        data = b""
+        while b"\r\n\r\n" not in data:
+            data += server_socket.recv(4096)
+        received.append(data.decode())
+        server_socket.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+    receiver = threading.Thread(target=answer)
+    receiver.start()
+
+    dispatcher = WebhookDispatcher()
+    dispatcher._attempt(WebhookDelivery(url="http://rebind.test:9000/lslhttp/abc", payload={"response": "Hello"}))
+    receiver.join(5)
+
+    assert connected == [("93.184.215.14", 9000)]
+    assert "\r\nHost: rebind.test:9000\r\n" in received[0]
+    assert dispatcher.get_stats()["delivered"] == 1
+    server_socket.close()
+    client_socket.close()